@@ -31,6 +31,9 @@ def add_component_arguments(parser):
   parser.add_argument("--owl_port", type=int, nargs="?",
     default=0,
     help="The port to use for owl monitor.")
+  parser.add_argument("--owl_server", type=str, nargs="?",
+    default="runserver", choices=["runserver", "gunicorn"],
+    help="The server to run owl monitor, use gunicorn for production.")
 
 def parse_command_line():
   parser = argparse.ArgumentParser(
@@ -123,6 +123,11 @@ def create_django_database():
   cmd = [ENV_PYTHON, "%s" % django_entry, "syncdb"]
   build_utils.execute_command(cmd)
 
+def prepare_static_files():
+  django_entry = os.path.join(OWL_ROOT, 'manage.py')
+  cmd = [ENV_PYTHON, "%s" % django_entry, "prepare_static"]
+  build_utils.execute_command(cmd)
+
 def deploy_opentsdb():
   if not os.path.exists(OPENTSDB_ROOT):
     log_message = "Checkout opentsdb in %s" % OPENTSDB_ROOT
@@ -194,6 +199,7 @@ def configure_opentsdb_collector(owl_port):
   opentsdb_collector_dict = {
     'owl_monitor_http_port': owl_port,
     'tsdb': OPENTSDB_BIN_PATH,
+    'opentsdb_port': OPENTSDB_PORT,
   }
   build_utils.generate_config_file(OPENTSDB_COLLECTOR_CONFIG_TEMPLATE,
     OPENTSDB_COLLECTOR_CONFIG_FILE, opentsdb_collector_dict)
@@ -234,13 +240,17 @@ def start_quota_updater():
   build_utils.start_daemon_process('Quota updater', QUOTA_UPDATER_PID_FILE,
     OWL_ROOT, './start_quota_updater.sh')
 
-def start_owl_monitor():
+def start_owl_monitor(owl_monitor_server):
   owl_monitor_http_port = build_utils.get_build_info_option('owl', 'owl_port')
   if not owl_monitor_http_port:
     Log.print_critical("Owl port is null")
 
+  if owl_monitor_server == 'gunicorn':
+    # static files may be changed since the last start
+    prepare_static_files()
+
   build_utils.start_daemon_process('Owl monitor', OWL_MONITOR_PID_FILE,
-    OWL_ROOT, './start_owl_monitor.sh', owl_monitor_http_port)
+    OWL_ROOT, './start_owl_monitor.sh', owl_monitor_http_port, owl_monitor_server)
 
 def stop_opentsdb_collector():
   build_utils.stop_daemon_process('Opentsdb collector', OPENTSDB_COLLECTOR_PID_FILE,
@@ -301,7 +311,7 @@ def _do_start(args):
   if args.quota_updater:
     start_quota_updater()
 
-  start_owl_monitor()
+  start_owl_monitor(args.owl_server)
 
 def _do_stop():
   stop_owl_collector()
@@ -45,6 +45,9 @@ OWL_PREREQUISITE_PYTHON_LIBS = [
   ('twisted', 'twisted', '13.2.0'),
   ('MySQLdb', 'Mysql-python', '1.2.5'),
   ('DBUtils', 'dbutils', '1.1'),
+  ('gunicorn', 'gunicorn', '19.1.1'),
+  ('concurrent', 'futures', '2.1.6'),
+  ('numpy', 'numpy', '1.8.1'),
 ]
 OWL_CONFIG_ROOT = os.path.join(CONFIG_DIR, 'owl')
 OWL_CONFIG_FILE = os.path.join(OWL_CONFIG_ROOT, 'owl_config.py')
@@ -2,3 +2,20 @@ metrics_url = 'http://127.0.0.1:8000/monitor/metrics'
 opentsdb_bin_path = 'tsdb'
 opentsdb_extra_args = ''
 collect_period = 10
+# the tsdb daemons the metrics are written to, as 'host:port'
+tsdb_addresses = ['127.0.0.1:4242']
+# 'telnet' or 'http', the http api needs tsdb 2.x
+tsdb_protocol = 'telnet'
+# the number of points sent in a batch, and the batches sent in parallel
+tsdb_batch_size = 1000
+tsdb_concurrency = 2
+# the spool of metrics not written to tsdb for outages, and the metrics of
+# the spool replayed per second besides the live metrics
+spool_path = 'tsdb_spool'
+spool_segment_bytes = 4 * 1024 * 1024
+spool_max_bytes = 2 * 1024 * 1024 * 1024
+spool_max_age = 24 * 3600
+spool_replay_rate = 20000
+# the period in seconds to reconcile the metric names registered to tsdb with
+# the uid table of tsdb
+registry_reconcile_period = 3600
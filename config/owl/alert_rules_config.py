@@ -0,0 +1,54 @@
+# The metric rules of owl alerts, evaluated by the status updater of the
+# collector over the metrics of the healthy tasks of a job every period, see
+# owl/alert/rule_engine.py. A firing rule makes the status of its job WARN
+# or ERROR, which is alerted like the other status problems.
+#
+# A rule is a dict of:
+#   name: the unique name of the rule
+#   service, job: the jobs the rule applies to
+#   group, metric: the perf counter group and key of the metric, as shown on
+#     owl pages, eg: ('DataNode', 'VolumeFailures')
+#   condition:
+#     'threshold': the value of the metric compared with value
+#     'rate': the change per second of the metric compared with value
+#     'absence': the metric isn't reported by a task
+#   operator: '>', '>=', '<', '<=', '==' or '!=', for threshold and rate
+#   value: the value compared with
+#   for: the seconds the condition holds on a task before the rule fires,
+#     0 by default
+#   level: 'WARN' or 'ERROR', 'ERROR' by default
+#   clusters: the overrides of value, for, level or enabled by cluster name,
+#     eg: {'dptst-example': {'value': 100, 'for': 600}}
+#
+# No rules are shipped, eg:
+# ALERT_RULES = [
+#   {
+#     'name': 'datanode_volume_failures',
+#     'service': 'hdfs', 'job': 'datanode',
+#     'group': 'DataNode', 'metric': 'VolumeFailures',
+#     'condition': 'threshold', 'operator': '>', 'value': 0,
+#     'for': 300, 'level': 'WARN',
+#   },
+#   {
+#     'name': 'namenode_corrupt_blocks_increasing',
+#     'service': 'hdfs', 'job': 'namenode',
+#     'group': 'NameNode', 'metric': 'CorruptBlocks',
+#     'condition': 'rate', 'operator': '>', 'value': 0,
+#     'for': 600,
+#   },
+#   {
+#     'name': 'regionserver_flush_queue',
+#     'service': 'hbase', 'job': 'regionserver',
+#     'group': 'RegionServer', 'metric': 'flushQueueSize',
+#     'condition': 'threshold', 'operator': '>', 'value': 100,
+#     'for': 600, 'level': 'WARN',
+#   },
+#   {
+#     'name': 'regionserver_metrics_absent',
+#     'service': 'hbase', 'job': 'regionserver',
+#     'group': 'RegionServer', 'metric': 'regions',
+#     'condition': 'absence',
+#     'for': 300, 'level': 'WARN',
+#   },
+# ]
+ALERT_RULES = []
@@ -1,7 +1,6 @@
 import json
 import logging
 import logging.config
-import os
 import sys
 import time
 import tsdb_register
@@ -10,10 +9,19 @@ import urllib
 from tsdb_register import collect_period
 from tsdb_register import metrics_url
 from tsdb_register import opentsdb_bin_path
-from tsdb_register import opentsdb_extra_args
+from tsdb_register import spool_max_age
+from tsdb_register import spool_max_bytes
+from tsdb_register import spool_path
+from tsdb_register import spool_replay_rate
+from tsdb_register import spool_segment_bytes
+from tsdb_register import tsdb_addresses
+from tsdb_register import tsdb_batch_size
+from tsdb_register import tsdb_concurrency
+from tsdb_register import tsdb_protocol
 from tsdb_register import TsdbRegister
-
-local_data_path = 'metrics_dump.data'
+from tsdb_spool import SpooledWriter
+from tsdb_spool import TsdbSpool
+from tsdb_writer import TsdbWriter
 
 logging.config.fileConfig('metrics_logging.conf')
 logger_metrics = logging.getLogger('metrics')
@@ -31,26 +39,37 @@ def verify_config():
     logger_metrics.warning("Please set collect_period")
     return False
 
+  if not tsdb_addresses:
+    logger_metrics.warning("Please set tsdb_addresses")
+    return False
+
   return True
 
 class MetricsCollector():
   def __init__(self):
     self.tsdb_register = TsdbRegister()
+    self.tsdb_register.start_reconcile(tsdb_addresses[0])
+    # points are spooled before written, and the backlog of a tsdb outage
+    # is replayed at spool_replay_rate
+    self.tsdb_writer = SpooledWriter(
+      TsdbWriter(tsdb_addresses, tsdb_protocol, tsdb_batch_size, tsdb_concurrency),
+      TsdbSpool(spool_path, spool_segment_bytes, spool_max_bytes, spool_max_age),
+      spool_replay_rate * collect_period)
 
   def run(self):
     while True:
       start = time.time()
-      self.collect_metrics()
+      points = self.collect_metrics()
       self.tsdb_register.register_new_keys_to_tsdb()
-      self.batch_output_to_tsdb()
+      self.batch_output_to_tsdb(points)
       end = time.time()
       to_sleep_time = collect_period - (end - start)
       if to_sleep_time > 0:
         time.sleep(to_sleep_time)
 
   def collect_metrics(self):
+    points = []
     try:
-      out_file = open(local_data_path, 'w')
       json_string = urllib.urlopen(metrics_url).read()
       metrics = json.loads(json_string)
       timestamp = metrics['timestamp']
@@ -60,24 +79,24 @@ class MetricsCollector():
             if key.find('#') != -1:
               key = key.replace("#", "_")
             value = metric['value']
-            self.append_to_file(out_file, timestamp, key, value, endpoint, group)
+            points.append((key, int(timestamp), value,
+              {'host': endpoint, 'group': group}))
             if key not in self.tsdb_register.register_keys:
               self.tsdb_register.new_keys.append(key)
               self.tsdb_register.register_keys.add(key)
-      out_file.close()
     except Exception, e:
       logger_metrics.error("collect_metrics exception: %s", e)
+    return points
 
-  @staticmethod
-  def append_to_file(out_file, timestamp, key, value, endpoint, group):
-    # format example: metric_key 1288900000 42 host=127.0.0.1-10000 group=Master
-    out_file.write("%s %s %s host=%s group=%s\n" % (key, timestamp, value, endpoint, group))
-
-
-  def batch_output_to_tsdb(self):
+  def batch_output_to_tsdb(self, points):
     start_time = time.time()
-    os.system('%s import %s %s' % (opentsdb_bin_path, opentsdb_extra_args, local_data_path))
-    logger_metrics.info("Batch import metrics cost %f secs" % (time.time() - start_time))
+    stats, replayed, backlog = self.tsdb_writer.write(points)
+    logger_metrics.info("Write %d metrics in %d batches cost %f secs, "
+      "%d metrics in %d batches failed", stats['points'], stats['batches'],
+      stats['seconds'], stats['failed_points'], stats['failed_batches'])
+    if replayed or backlog:
+      logger_metrics.info("Replay %d spooled metrics, %d segments left, cost %f secs",
+        replayed, backlog, time.time() - start_time)
 
 if __name__ == '__main__':
   if not verify_config():
@@ -1,8 +1,11 @@
 import logging
 import os
 import sys
+import threading
 import time
 
+import tsdb_registry
+
 root_path = os.path.abspath(
   os.path.dirname(os.path.realpath(__file__))+ '/..')
 
@@ -20,6 +23,31 @@ metrics_url = metrics_collector_config.metrics_url
 opentsdb_bin_path = metrics_collector_config.opentsdb_bin_path
 opentsdb_extra_args = metrics_collector_config.opentsdb_extra_args
 collect_period = metrics_collector_config.collect_period
+# the tsdb daemons the metrics are written to
+tsdb_addresses = getattr(metrics_collector_config, 'tsdb_addresses',
+  ['127.0.0.1:4242'])
+# 'telnet' or 'http', the http api needs tsdb 2.x
+tsdb_protocol = getattr(metrics_collector_config, 'tsdb_protocol', 'telnet')
+tsdb_batch_size = getattr(metrics_collector_config, 'tsdb_batch_size', 1000)
+tsdb_concurrency = getattr(metrics_collector_config, 'tsdb_concurrency', 2)
+# the spool of points not written to tsdb, see tsdb_spool.py
+spool_path = getattr(metrics_collector_config, 'spool_path', 'tsdb_spool')
+spool_segment_bytes = getattr(metrics_collector_config, 'spool_segment_bytes',
+  4 * 1024 * 1024)
+spool_max_bytes = getattr(metrics_collector_config, 'spool_max_bytes',
+  2 * 1024 * 1024 * 1024)
+# in seconds
+spool_max_age = getattr(metrics_collector_config, 'spool_max_age', 24 * 3600)
+# the points replayed per second besides the live points
+spool_replay_rate = getattr(metrics_collector_config, 'spool_replay_rate', 20000)
+# the metric names registered to tsdb, shared by the collector and the quota
+# injector, and the period in seconds to reconcile them with tsdb. A relative
+# path is under the opentsdb directory, so the processes of any working
+# directory share it.
+registry_path = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+  getattr(metrics_collector_config, 'registry_path', 'tsdb_registry'))
+registry_reconcile_period = getattr(metrics_collector_config,
+  'registry_reconcile_period', 3600)
 
 logger_metrics = logging.getLogger('metrics')
 logger_quota = logging.getLogger('quota')
@@ -28,7 +56,21 @@ logger_quota = logging.getLogger('quota')
 class TsdbRegister:
   def __init__(self):
     self.new_keys = []
-    self.register_keys = set()
+    # the registered keys are loaded from the registry, so a restart
+    # doesn't register them again
+    self.registry = tsdb_registry.MetricRegistry(registry_path)
+    self.register_keys = self.registry.load()
+    self.lock = threading.Lock()
+
+  def make_metrics(self, keys):
+    mkmetric_operation = '%s mkmetric %s %s' % (opentsdb_bin_path, opentsdb_extra_args, ' '.join(keys))
+    logger_metrics.info(mkmetric_operation)
+    logger_quota.info(mkmetric_operation)
+    # keys failed, or registered before, are added to the registry by the
+    # reconcile
+    if os.system(mkmetric_operation) == 0:
+      with self.lock:
+        self.registry.add(keys)
 
   def register_new_keys_to_tsdb(self):
     start_time = time.time()
@@ -39,22 +81,43 @@ class TsdbRegister:
 
     # register MAX_REGISTERED_KEYS one time
     while size - offset >= MAX_REGISTERED_KEYS:
-      keys_to_add = self.new_keys[offset:offset+MAX_REGISTERED_KEYS]
-      mkmetric_operation = '%s mkmetric %s %s' % (opentsdb_bin_path, opentsdb_extra_args, ' '.join(keys_to_add))
-      logger_metrics.info(mkmetric_operation)
-      logger_quota.info(mkmetric_operation)
-      os.system(mkmetric_operation)
+      self.make_metrics(self.new_keys[offset:offset+MAX_REGISTERED_KEYS])
       offset += MAX_REGISTERED_KEYS
 
     # register remainings
     if offset < size:
-      keys_to_add = self.new_keys[offset:]
-      mkmetric_operation = '%s mkmetric %s %s' % (opentsdb_bin_path, opentsdb_extra_args, ' '.join(keys_to_add))
-      logger_metrics.info(mkmetric_operation)
-      logger_quota.info(mkmetric_operation)
-      os.system(mkmetric_operation)
+      self.make_metrics(self.new_keys[offset:])
 
     self.new_keys = []
     registered_metrics_log = "Registered %d metrics cost %f secs" % (size, time.time() - start_time)
     logger_metrics.info(registered_metrics_log)
     logger_quota.info(registered_metrics_log)
+
+  def reconcile(self, address):
+    tsdb_keys, complete = tsdb_registry.fetch_tsdb_metrics(address)
+    with self.lock:
+      added, removed = tsdb_registry.reconcile(self.register_keys, tsdb_keys,
+        complete)
+      self.register_keys |= added
+      self.register_keys -= removed
+      # the keys pending in new_keys aren't persisted before registered
+      self.registry.update(added, removed)
+    logger_metrics.info("Reconciled %d metrics with %s, %d added, %d removed",
+      len(tsdb_keys), address, len(added), len(removed))
+
+  def start_reconcile(self, address, period=registry_reconcile_period):
+    '''
+    Reconcile the registry with the uid table of tsdb every period in a
+    background thread.
+    '''
+    def run():
+      while True:
+        try:
+          self.reconcile(address)
+        except Exception, e:
+          logger_metrics.warning("Failed to reconcile metrics with %s: %r",
+            address, e)
+        time.sleep(period)
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
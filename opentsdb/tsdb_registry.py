@@ -0,0 +1,92 @@
+import contextlib
+import fcntl
+import httplib
+import json
+import logging
+import os
+import urllib
+
+logger_metrics = logging.getLogger('metrics')
+
+# the max metric names fetched from tsdb in a reconcile
+MAX_SUGGEST_RESULTS = 1000000
+LOCK_SUFFIX = '.lock'
+
+class MetricRegistry:
+  '''
+  The metric names registered to tsdb, kept in a file of one name per line.
+  Names are appended once registered, and the file is rewritten when
+  reconciled with tsdb. The collector and the quota injector share the
+  file, the appends and rewrites hold the flock of a lock file beside it,
+  so a rewrite doesn't lose the names appended meanwhile.
+  '''
+  def __init__(self, path):
+    self.path = path
+
+  @contextlib.contextmanager
+  def locked(self):
+    with open(self.path + LOCK_SUFFIX, 'a') as lock_file:
+      fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+      yield
+
+  def load(self):
+    if not os.path.exists(self.path):
+      return set()
+    with open(self.path) as registry:
+      return set(line.strip() for line in registry if line.strip())
+
+  def add(self, keys):
+    with self.locked():
+      with open(self.path, 'a') as registry:
+        registry.write(''.join('%s\n' % key for key in keys))
+
+  def write(self, keys):
+    temp_path = self.path + '.tmp'
+    with open(temp_path, 'w') as registry:
+      registry.write(''.join('%s\n' % key for key in sorted(keys)))
+    os.rename(temp_path, self.path)
+
+  def replace(self, keys):
+    with self.locked():
+      self.write(keys)
+
+  def update(self, added, removed):
+    '''
+    Add and remove keys of the registry, return the keys of it.
+    '''
+    with self.locked():
+      keys = (self.load() | added) - removed
+      self.write(keys)
+    return keys
+
+def fetch_tsdb_metrics(address, timeout=60):
+  '''
+  Return (names, complete) of the metrics in the uid table of a tsdb.
+  complete is False if tsdb may have more names than returned: tsdb 1.x
+  ignores max and returns at most 25 names.
+  '''
+  host, port = address.rsplit(':', 1)
+  conn = httplib.HTTPConnection(host, int(port), timeout=timeout)
+  try:
+    conn.request('GET', '/suggest?' + urllib.urlencode(
+      {'type': 'metrics', 'q': '', 'max': MAX_SUGGEST_RESULTS}))
+    response = conn.getresponse()
+    content = response.read()
+    if response.status != httplib.OK:
+      raise httplib.HTTPException('Unexpected response %d from %s: %s' % (
+        response.status, address, content[:200]))
+    names = json.loads(content)
+    return set(names), len(names) < 25 or 25 < len(names) < MAX_SUGGEST_RESULTS
+  finally:
+    conn.close()
+
+def reconcile(registered_keys, tsdb_keys, complete):
+  '''
+  Return (added, removed) keys to make the registry consistent with tsdb.
+  The keys missing in tsdb are removed only if the names of tsdb are
+  complete, so they are registered again, eg: after the uid table is
+  recreated.
+  '''
+  added = tsdb_keys - registered_keys
+  removed = registered_keys - tsdb_keys if complete else set()
+  return added, removed
@@ -0,0 +1,83 @@
+import BaseHTTPServer
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import tsdb_registry
+
+class FakeSuggestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  def do_GET(self):
+    body = json.dumps(self.server.names)
+    self.send_response(200)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+class MetricRegistryTest(unittest.TestCase):
+  def setUp(self):
+    self.path = tempfile.mkdtemp()
+    self.registry = tsdb_registry.MetricRegistry(
+      os.path.join(self.path, 'registry'))
+
+  def tearDown(self):
+    shutil.rmtree(self.path)
+
+  def test_load_and_add(self):
+    self.assertEqual(set(), self.registry.load())
+    self.registry.add(['a', 'b'])
+    self.registry.add(['c'])
+    self.assertEqual(set(['a', 'b', 'c']), self.registry.load())
+    self.registry.replace(set(['b', 'd']))
+    self.assertEqual(set(['b', 'd']), self.registry.load())
+
+  def test_update_with_appends(self):
+    self.registry.add(['a'])
+    def append(prefix):
+      for i in range(200):
+        tsdb_registry.MetricRegistry(self.registry.path).add(
+          ['%s%d' % (prefix, i)])
+    threads = [threading.Thread(target=append, args=(prefix,))
+               for prefix in 'wxyz']
+    for thread in threads:
+      thread.start()
+    for i in range(50):
+      self.registry.update(set(['b']), set(['a']))
+    for thread in threads:
+      thread.join()
+    # the names appended in the rewrites aren't lost
+    keys = self.registry.load()
+    self.assertEqual(801, len(keys))
+    self.assertNotIn('a', keys)
+
+  def test_reconcile(self):
+    registered = set(['a', 'b'])
+    self.assertEqual((set(['c']), set(['a'])),
+      tsdb_registry.reconcile(registered, set(['b', 'c']), True))
+    self.assertEqual((set(['c']), set()),
+      tsdb_registry.reconcile(registered, set(['b', 'c']), False))
+
+  def test_fetch_tsdb_metrics(self):
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), FakeSuggestHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    address = '127.0.0.1:%d' % server.server_address[1]
+    try:
+      server.names = ['a', 'b']
+      self.assertEqual((set(['a', 'b']), True),
+        tsdb_registry.fetch_tsdb_metrics(address))
+      # may be truncated by tsdb 1.x
+      server.names = ['m%d' % i for i in range(25)]
+      self.assertFalse(tsdb_registry.fetch_tsdb_metrics(address)[1])
+    finally:
+      server.shutdown()
+      server.server_close()
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,154 @@
+import logging
+import os
+import time
+
+logger_metrics = logging.getLogger('metrics')
+
+SEGMENT_SUFFIX = '.spool'
+TEMP_SUFFIX = '.tmp'
+
+def format_point(point):
+  # format example: metric_key 1288900000 42 group=Master host=127.0.0.1-10000
+  metric, timestamp, value, tags = point
+  return '%s %s %s %s\n' % (metric, timestamp, value,
+    ' '.join('%s=%s' % tag for tag in sorted(tags.iteritems())))
+
+def parse_point(line):
+  fields = line.split()
+  tags = dict(field.split('=', 1) for field in fields[3:])
+  return (fields[0], int(fields[1]), fields[2], tags)
+
+class TsdbSpool:
+  '''
+  A disk spool of the points written to tsdb, so the points aren't lost
+  when tsdb is down.
+
+  Points are appended to new segments, each of at most segment_bytes, before
+  they are written to tsdb, and a segment is deleted once its points are
+  written. Segments not written are the backlog, which is replayed oldest
+  first at a limited rate. The backlog is capped by max_bytes and max_age
+  seconds, the oldest segments over the caps are dropped.
+  '''
+  def __init__(self, path, segment_bytes, max_bytes, max_age):
+    self.path = path
+    self.segment_bytes = segment_bytes
+    self.max_bytes = max_bytes
+    self.max_age = max_age
+    if not os.path.exists(path):
+      os.makedirs(path)
+    # remove the segments not completely written
+    for name in os.listdir(path):
+      if name.endswith(TEMP_SUFFIX):
+        os.remove(os.path.join(path, name))
+    segments = self.get_segments()
+    self.next_sequence = int(segments[-1][:-len(SEGMENT_SUFFIX)]) + 1 \
+      if segments else 0
+
+  def get_segments(self):
+    '''
+    Return the names of segments, the oldest first.
+    '''
+    return sorted(name for name in os.listdir(self.path)
+                  if name.endswith(SEGMENT_SUFFIX))
+
+  def get_segment_path(self, name):
+    return os.path.join(self.path, name)
+
+  def write_segment(self, lines):
+    name = '%012d%s' % (self.next_sequence, SEGMENT_SUFFIX)
+    self.next_sequence += 1
+    temp_path = self.get_segment_path(name) + TEMP_SUFFIX
+    with open(temp_path, 'w') as segment:
+      segment.writelines(lines)
+      segment.flush()
+      os.fsync(segment.fileno())
+    os.rename(temp_path, self.get_segment_path(name))
+    return name
+
+  def append(self, points):
+    '''
+    Append points to new segments, return the names of the segments.
+    '''
+    names = []
+    lines = []
+    size = 0
+    for point in points:
+      line = format_point(point)
+      lines.append(line)
+      size += len(line)
+      if size >= self.segment_bytes:
+        names.append(self.write_segment(lines))
+        lines = []
+        size = 0
+    if lines:
+      names.append(self.write_segment(lines))
+    self.enforce_caps()
+    return names
+
+  def load(self, name):
+    with open(self.get_segment_path(name)) as segment:
+      return [parse_point(line) for line in segment if line.strip()]
+
+  def ack(self, name):
+    try:
+      os.remove(self.get_segment_path(name))
+    except OSError:
+      # dropped over the caps
+      pass
+
+  def enforce_caps(self):
+    now = time.time()
+    segments = self.get_segments()
+    sizes = [os.path.getsize(self.get_segment_path(name)) for name in segments]
+    total = sum(sizes)
+    for name, size in zip(segments, sizes):
+      path = self.get_segment_path(name)
+      if total <= self.max_bytes and now - os.path.getmtime(path) <= self.max_age:
+        break
+      logger_metrics.warning("Drop spool segment %s of %d bytes over the caps",
+        name, size)
+      os.remove(path)
+      total -= size
+
+class SpooledWriter:
+  '''
+  Write points to tsdb through a spool. The points of the current cycle
+  are written first, then the backlog is replayed with at most
+  replay_points points per cycle, and the replay stops once a segment can't
+  be written, since tsdb is still unavailable.
+  '''
+  def __init__(self, writer, spool, replay_points):
+    self.writer = writer
+    self.spool = spool
+    self.replay_points = replay_points
+
+  def write_segment(self, name, points):
+    stats = self.writer.write(points)
+    # the points rejected by tsdb won't succeed on retry
+    if stats['unsent_points'] == 0:
+      self.spool.ack(name)
+      return True
+    return False
+
+  def write(self, points):
+    '''
+    Return (live stats, replayed points, backlog segments).
+    '''
+    live_segments = self.spool.append(points)
+    stats = self.writer.write(points)
+    if stats['unsent_points']:
+      return stats, 0, len(self.spool.get_segments())
+    for name in live_segments:
+      self.spool.ack(name)
+
+    replayed = 0
+    backlog = [name for name in self.spool.get_segments()
+               if name not in live_segments]
+    for name in backlog:
+      if replayed >= self.replay_points:
+        break
+      points = self.spool.load(name)
+      if not self.write_segment(name, points):
+        break
+      replayed += len(points)
+    return stats, replayed, len(self.spool.get_segments())
@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import tsdb_spool
+
+class FakeWriter:
+  def __init__(self):
+    self.available = True
+    self.points = []
+
+  def write(self, points):
+    if not self.available:
+      return {'points': len(points), 'unsent_points': len(points)}
+    self.points.extend(points)
+    return {'points': len(points), 'unsent_points': 0}
+
+def make_points(count, timestamp=1400000000):
+  return [('metric_%d' % i, timestamp, i, {'host': '10.0.0.1', 'group': 'Master'})
+          for i in range(count)]
+
+class TsdbSpoolTest(unittest.TestCase):
+  def setUp(self):
+    self.path = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.path)
+
+  def make_spool(self, max_bytes=1 << 30, max_age=3600):
+    return tsdb_spool.TsdbSpool(self.path, 1024, max_bytes, max_age)
+
+  def test_append_and_load(self):
+    spool = self.make_spool()
+    points = make_points(100)
+    names = spool.append(points)
+    self.assertTrue(len(names) > 1)
+    loaded = []
+    for name in names:
+      loaded.extend(spool.load(name))
+    self.assertEqual(100, len(loaded))
+    self.assertEqual(('metric_1', 1400000000, '1',
+      {'host': '10.0.0.1', 'group': 'Master'}), loaded[1])
+
+    # the sequence continues after restart
+    spool = self.make_spool()
+    self.assertTrue(spool.append(make_points(1))[0] > names[-1])
+
+  def test_caps(self):
+    spool = self.make_spool(max_bytes=4096)
+    spool.append(make_points(1000))
+    sizes = [os.path.getsize(os.path.join(self.path, name))
+             for name in spool.get_segments()]
+    self.assertTrue(sum(sizes) <= 4096)
+
+    spool = self.make_spool(max_age=10)
+    name = spool.get_segments()[0]
+    old_time = time.time() - 60
+    os.utime(os.path.join(self.path, name), (old_time, old_time))
+    spool.enforce_caps()
+    self.assertNotIn(name, spool.get_segments())
+
+  def test_replay(self):
+    writer = FakeWriter()
+    spooled_writer = tsdb_spool.SpooledWriter(writer, self.make_spool(), 150)
+
+    # outage of 3 cycles
+    writer.available = False
+    for i in range(3):
+      spooled_writer.write(make_points(100, 1400000000 + i))
+    self.assertEqual([], writer.points)
+
+    writer.available = True
+    stats, replayed, backlog = spooled_writer.write(make_points(100, 1400000003))
+    # the live points first, then the backlog at most 150 points per cycle
+    self.assertEqual(1400000003, writer.points[0][1])
+    self.assertTrue(150 <= replayed < 250)
+    self.assertTrue(backlog > 0)
+
+    for i in range(5):
+      stats, replayed, backlog = spooled_writer.write([])
+    self.assertEqual(0, backlog)
+    self.assertEqual(400, len(writer.points))
+    self.assertEqual(set(range(1400000000, 1400000004)),
+                     set(point[1] for point in writer.points))
+
+if __name__ == '__main__':
+  unittest.main()
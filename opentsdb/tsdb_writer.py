@@ -0,0 +1,221 @@
+import Queue
+import httplib
+import json
+import logging
+import select
+import socket
+import threading
+import time
+
+logger_metrics = logging.getLogger('metrics')
+
+PROTOCOL_TELNET = 'telnet'
+PROTOCOL_HTTP = 'http'
+
+# the max bytes of error lines read from a telnet connection at once
+READ_BUFFER_SIZE = 65536
+
+def format_tags(tags):
+  return ' '.join('%s=%s' % (key, value) for key, value in sorted(tags.iteritems()))
+
+def format_put(point):
+  # format example: put metric_key 1288900000 42 host=127.0.0.1-10000 group=Master
+  metric, timestamp, value, tags = point
+  return 'put %s %s %s %s\n' % (metric, timestamp, value, format_tags(tags))
+
+def parse_address(address):
+  host, port = address.rsplit(':', 1)
+  return host, int(port)
+
+class TelnetConnection:
+  '''
+  A persistent connection to the telnet interface of a tsdb. Puts are
+  pipelined, the tsdb only replies the lines failed, so the error lines
+  available after a batch are counted to it, and the errors replied later
+  are drained after the last batch.
+  '''
+  def __init__(self, address, timeout):
+    self.address = address
+    self.timeout = timeout
+    self.sock = None
+    self.pending = ''
+
+  def connect(self):
+    self.sock = socket.create_connection(parse_address(self.address),
+      self.timeout)
+    self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+  def close(self):
+    if self.sock:
+      self.sock.close()
+      self.sock = None
+    self.pending = ''
+
+  def read_errors(self, wait):
+    '''
+    Read the error lines replied by tsdb in wait seconds.
+    '''
+    errors = []
+    deadline = time.time() + wait
+    while True:
+      readable = select.select([self.sock], [], [],
+        max(0, deadline - time.time()))[0]
+      if not readable:
+        break
+      data = self.sock.recv(READ_BUFFER_SIZE)
+      if not data:
+        raise socket.error('Connection closed by %s' % self.address)
+      lines = (self.pending + data).split('\n')
+      self.pending = lines.pop()
+      errors.extend(line for line in lines if line.strip())
+    return errors
+
+  def send(self, points):
+    if self.sock is None:
+      self.connect()
+    self.sock.sendall(''.join(format_put(point) for point in points))
+    return len(self.read_errors(0))
+
+  def drain(self, wait):
+    if self.sock is None:
+      return 0
+    return len(self.read_errors(wait))
+
+class HttpConnection:
+  '''
+  A persistent connection to the http api of a tsdb 2.x, a batch is posted
+  to /api/put in one request, and its failed points are in the summary.
+  '''
+  def __init__(self, address, timeout):
+    self.address = address
+    self.timeout = timeout
+    self.conn = None
+
+  def connect(self):
+    host, port = parse_address(self.address)
+    self.conn = httplib.HTTPConnection(host, port, timeout=self.timeout)
+
+  def close(self):
+    if self.conn:
+      self.conn.close()
+      self.conn = None
+
+  def send(self, points):
+    if self.conn is None:
+      self.connect()
+    body = json.dumps([{'metric': metric, 'timestamp': timestamp,
+      'value': value, 'tags': tags} for metric, timestamp, value, tags in points])
+    self.conn.request('POST', '/api/put?summary', body,
+      {'Content-Type': 'application/json'})
+    response = self.conn.getresponse()
+    content = response.read()
+    if response.status in (httplib.OK, httplib.NO_CONTENT):
+      return 0
+    try:
+      return json.loads(content)['failed']
+    except (ValueError, KeyError, TypeError):
+      raise httplib.HTTPException('Unexpected response %d from %s: %s' % (
+        response.status, self.address, content[:200]))
+
+  def drain(self, wait):
+    return 0
+
+CONNECTION_CLASSES = {
+  PROTOCOL_TELNET: TelnetConnection,
+  PROTOCOL_HTTP: HttpConnection,
+}
+
+class TsdbWriter:
+  '''
+  Write data points to tsdb daemons over persistent connections.
+
+  The points of a write are split into batches of batch_size, which are sent
+  by concurrency workers, each with its own connection to one of the
+  addresses in turn. A batch failed by a connection error is retried once on
+  a new connection. A point is (metric, timestamp, value, tags).
+
+  drain_wait: seconds to wait for the errors of the last batch on a telnet
+    connection
+  '''
+  def __init__(self, addresses, protocol=PROTOCOL_TELNET, batch_size=1000,
+               concurrency=2, timeout=10, drain_wait=0.1):
+    self.batch_size = batch_size
+    self.drain_wait = drain_wait
+    self.connections = [
+      CONNECTION_CLASSES[protocol](addresses[i % len(addresses)], timeout)
+      for i in range(concurrency)]
+
+  def close(self):
+    for connection in self.connections:
+      connection.close()
+
+  def send_batch(self, connection, batch):
+    '''
+    Return the number of points of a batch rejected by tsdb and not sent.
+    '''
+    for attempt in range(2):
+      try:
+        return connection.send(batch), 0
+      except (socket.error, httplib.HTTPException), e:
+        logger_metrics.warning("Failed to send %d points to %s: %r",
+          len(batch), connection.address, e)
+        connection.close()
+    return 0, len(batch)
+
+  def work(self, connection, batches, results, drain_wait):
+    while True:
+      try:
+        batch = batches.get_nowait()
+      except Queue.Empty:
+        break
+      results.put((True,) + self.send_batch(connection, batch))
+    try:
+      results.put((False, connection.drain(drain_wait), 0))
+    except socket.error, e:
+      logger_metrics.warning("Failed to drain errors from %s: %r",
+        connection.address, e)
+      connection.close()
+
+  def write(self, points, drain_wait=None):
+    '''
+    Write the points, return the statistics of the write. drain_wait
+    overrides the one of the writer, the errors not drained are counted to
+    the next write of the connection.
+    '''
+    if drain_wait is None:
+      drain_wait = self.drain_wait
+    start_time = time.time()
+    batches = Queue.Queue()
+    for start in range(0, len(points), self.batch_size):
+      batches.put(points[start:start + self.batch_size])
+    batch_count = batches.qsize()
+
+    results = Queue.Queue()
+    if len(self.connections) == 1:
+      # no thread is needed for a single connection
+      self.work(self.connections[0], batches, results, drain_wait)
+    else:
+      workers = [threading.Thread(target=self.work,
+        args=(connection, batches, results, drain_wait))
+        for connection in self.connections]
+      for worker in workers:
+        worker.start()
+      for worker in workers:
+        worker.join()
+
+    stats = {
+      'points': len(points),
+      'batches': batch_count,
+      # rejected by tsdb, and not sent for connection errors
+      'failed_points': 0,
+      'unsent_points': 0,
+      'failed_batches': 0,
+    }
+    while not results.empty():
+      is_batch, rejected, unsent = results.get()
+      stats['failed_points'] += rejected + unsent
+      stats['unsent_points'] += unsent
+      if is_batch and rejected + unsent:
+        stats['failed_batches'] += 1
+    stats['seconds'] = time.time() - start_time
+    return stats
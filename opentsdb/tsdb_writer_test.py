@@ -0,0 +1,108 @@
+import BaseHTTPServer
+import SocketServer
+import json
+import threading
+import unittest
+
+import tsdb_writer
+
+class FakeTelnetHandler(SocketServer.StreamRequestHandler):
+  def handle(self):
+    for line in self.rfile:
+      fields = line.split()
+      self.server.lines.append(line)
+      # the tsdb replies the failed puts only
+      if fields[1] == 'bad':
+        self.wfile.write('put: illegal argument: %s\n' % line.strip())
+        self.wfile.flush()
+
+class FakeHttpHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def do_POST(self):
+    points = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+    self.server.lines.extend(points)
+    failed = len([point for point in points if point['metric'] == 'bad'])
+    if failed:
+      body = json.dumps({'success': len(points) - failed, 'failed': failed,
+                         'errors': []})
+      self.send_response(400)
+    else:
+      body = ''
+      self.send_response(204)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+class FakeTelnetServer(SocketServer.ThreadingTCPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+class FakeHttpServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+def start_server(server_class, handler_class):
+  server = server_class(('127.0.0.1', 0), handler_class)
+  server.lines = []
+  thread = threading.Thread(target=server.serve_forever)
+  thread.daemon = True
+  thread.start()
+  return server, '127.0.0.1:%d' % server.server_address[1]
+
+def make_points(count, bad=0):
+  points = [('metric_%d' % (i % 10), 1400000000 + i, i,
+             {'host': '10.0.0.%d' % (i % 100), 'group': 'DataNode'})
+            for i in range(count)]
+  points += [('bad', 1400000000, 0, {'host': 'bad'}) for i in range(bad)]
+  return points
+
+class TsdbWriterTest(unittest.TestCase):
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+  def test_telnet(self):
+    self.server, address = start_server(FakeTelnetServer, FakeTelnetHandler)
+    writer = tsdb_writer.TsdbWriter([address], batch_size=100, concurrency=3,
+      drain_wait=0.5)
+    stats = writer.write(make_points(1000, bad=5))
+    self.assertEqual(1005, stats['points'])
+    self.assertEqual(11, stats['batches'])
+    self.assertEqual(5, stats['failed_points'])
+    self.assertEqual(0, stats['unsent_points'])
+    self.assertEqual(1005, len(self.server.lines))
+    self.assertIn('put metric_1 1400000001 1 group=DataNode host=10.0.0.1\n',
+      self.server.lines)
+
+    # the connections are reused by the next write
+    stats = writer.write(make_points(10))
+    self.assertEqual(0, stats['failed_points'])
+    self.assertEqual(1015, len(self.server.lines))
+    writer.close()
+
+  def test_http(self):
+    self.server, address = start_server(FakeHttpServer, FakeHttpHandler)
+    writer = tsdb_writer.TsdbWriter([address], tsdb_writer.PROTOCOL_HTTP,
+      batch_size=100, concurrency=2)
+    stats = writer.write(make_points(250, bad=3))
+    self.assertEqual(3, stats['batches'])
+    self.assertEqual(3, stats['failed_points'])
+    self.assertEqual(1, stats['failed_batches'])
+    self.assertEqual(253, len(self.server.lines))
+    writer.close()
+
+  def test_connection_failure(self):
+    self.server, address = start_server(FakeTelnetServer, FakeTelnetHandler)
+    self.server.shutdown()
+    self.server.server_close()
+    writer = tsdb_writer.TsdbWriter([address], batch_size=10, concurrency=1)
+    stats = writer.write(make_points(25))
+    self.assertEqual(25, stats['failed_points'])
+    self.assertEqual(25, stats['unsent_points'])
+    self.assertEqual(3, stats['failed_batches'])
+
+if __name__ == '__main__':
+  unittest.main()
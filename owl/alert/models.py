@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+from django.db import models
+
+from monitor.models import Cluster, Status
+
+# A change of the status of a cluster, published by the status updater of the
+# collector once it saves the status. The events are consumed in the order of
+# id by the alert command.
+class AlertEvent(models.Model):
+  cluster = models.ForeignKey(Cluster, db_index=True)
+  # the last attempt time of the cluster status
+  time = models.DateTimeField(db_index=True)
+  previous_status = models.IntegerField()
+  status = models.IntegerField()
+  # the jobs not healthy, one line per job
+  message = models.TextField()
+
+# The alert state of a cluster, maintained by the alert command from the
+# events.
+class AlertState(models.Model):
+  cluster = models.OneToOneField(Cluster, primary_key=True)
+  status = models.IntegerField(default=Status.OK)
+  # the time the cluster changed to the status
+  since = models.DateTimeField()
+  message = models.TextField()
+  # if the problem of the status has been alerted
+  alerted = models.BooleanField(default=False)
+  # if the status isn't updated by the collector recently
+  stale = models.BooleanField(default=False)
+
+# The last event consumed. The cursor is locked while events are consumed,
+# so several alert commands could run at the same time.
+class AlertCursor(models.Model):
+  name = models.CharField(max_length=64, primary_key=True)
+  last_event_id = models.IntegerField(default=0)
+
+# The state of the metric rules of a cluster between periods, saved by the
+# status updater, see alert/rule_engine.py.
+class AlertRuleState(models.Model):
+  cluster = models.OneToOneField(Cluster, primary_key=True)
+  # json of the state
+  data = models.TextField()
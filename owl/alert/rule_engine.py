@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+#
+# The engine of the metric rules of alerts, see
+# config/owl/alert_rules_config.py.
+#
+# The rules of a job are evaluated together over the metrics of its healthy
+# tasks once per period, as selected by the collector, see
+# status_updater.select_status_metrics. The metrics the rules refer to are
+# looked up by key into a matrix of tasks by metrics, and the conditions of
+# all rules are computed as a matrix of tasks by rules, one array operation per operator,
+# so the cost doesn't grow with a python loop per rule and task.
+#
+# The state of a cluster between periods is saved in AlertRuleState: the
+# previous values of the metrics of rate rules, and the time since the
+# condition of a rule holds on a task, only for the tasks it holds on.
+import json
+import logging
+import time
+
+import numpy
+
+import alert_rules_config
+from models import AlertRuleState
+from monitor.bean_name import form_perf_counter_key_suffix
+from monitor.bean_name import parse_bean_name
+from monitor.models import Status
+
+logger = logging.getLogger(__name__)
+
+OPERATORS = {
+  '>': numpy.greater,
+  '>=': numpy.greater_equal,
+  '<': numpy.less,
+  '<=': numpy.less_equal,
+  '==': numpy.equal,
+  '!=': numpy.not_equal,
+}
+CONDITIONS = ('threshold', 'rate', 'absence')
+LEVELS = {
+  'WARN': Status.WARN,
+  'ERROR': Status.ERROR,
+}
+# the max length of the message of a job
+MAX_MESSAGE_LENGTH = 128
+
+# the perf counter group and key suffix of bean names, which are the same for
+# all periods
+bean_groups = {}
+
+def get_bean_group(bean_name):
+  """
+  Return (group, key suffix) of a bean, see
+  bean_name.form_perf_counter_key_name.
+  """
+  group = bean_groups.get(bean_name)
+  if group is None:
+    try:
+      group = (parse_bean_name(bean_name)[0],
+               form_perf_counter_key_suffix(bean_name).replace('~', '-'))
+    except IndexError:
+      group = ('', '')
+    bean_groups[bean_name] = group
+  return group
+
+def get_key_value(bean_metrics, key, suffix):
+  """
+  Return the value of the metric of a bean named by a perf counter key, or
+  None if the bean doesn't report it.
+  """
+  if suffix:
+    if not key.endswith(suffix):
+      return None
+    key = key[:-len(suffix)]
+  value = bean_metrics.get(key)
+  # '~' in the metric names of hbase tables is '-' in keys
+  if value is None and '-' in key:
+    value = bean_metrics.get(key.replace('-', '~'))
+  return value
+
+def check_rule(rule):
+  for field in ('name', 'service', 'job', 'group', 'metric', 'condition'):
+    if field not in rule:
+      raise ValueError("Rule %s has no %s" % (rule.get('name'), field))
+  if rule['condition'] not in CONDITIONS:
+    raise ValueError("Rule %s has invalid condition: %s" % (
+      rule['name'], rule['condition']))
+  if rule['condition'] != 'absence' and rule.get('operator') not in OPERATORS:
+    raise ValueError("Rule %s has invalid operator: %s" % (
+      rule['name'], rule.get('operator')))
+  if rule.get('level', 'ERROR') not in LEVELS:
+    raise ValueError("Rule %s has invalid level: %s" % (
+      rule['name'], rule.get('level')))
+
+def get_metric_name(group, key):
+  return '%s/%s' % (group, key)
+
+class JobRules:
+  """
+  The rules of a job, with the overrides of a cluster applied, compiled
+  into arrays indexed by rule.
+  """
+  def __init__(self, rules):
+    self.rules = rules
+    self.metrics = sorted(set((rule['group'], rule['metric']) for rule in rules))
+    columns = dict((metric, column) for column, metric in enumerate(self.metrics))
+    # group -> [(key, column), ...] of the keys of the group referred
+    self.group_keys = {}
+    for (group, key), column in sorted(columns.iteritems()):
+      self.group_keys.setdefault(group, []).append((key, column))
+
+    self.columns = numpy.array(
+      [columns[(rule['group'], rule['metric'])] for rule in rules], dtype=int)
+    self.values = numpy.array([float(rule.get('value', 0)) for rule in rules])
+    self.durations = numpy.array([rule.get('for', 0) for rule in rules])
+    self.is_rate = numpy.array([rule['condition'] == 'rate' for rule in rules],
+      dtype=bool)
+    self.is_absence = numpy.array(
+      [rule['condition'] == 'absence' for rule in rules], dtype=bool)
+    self.operators = [(OPERATORS[name], numpy.array(
+      [rule.get('operator') == name and rule['condition'] != 'absence'
+       for rule in rules], dtype=bool))
+      for name in sorted(set(rule.get('operator') for rule in rules))
+      if name in OPERATORS]
+    self.rate_columns = sorted(set(self.columns[self.is_rate]))
+
+  def load_metrics(self, tasks):
+    """
+    Return the matrix of tasks by metrics, nan if a task doesn't report a
+    metric.
+    """
+    matrix = numpy.empty((len(tasks), len(self.metrics)))
+    matrix.fill(numpy.nan)
+    for row, (task_id, metrics) in enumerate(tasks):
+      for bean_name, bean_metrics in metrics.iteritems():
+        group, suffix = get_bean_group(bean_name)
+        keys = self.group_keys.get(group)
+        if not keys:
+          continue
+        # only the keys referred are looked up, the other metrics of the bean
+        # are never visited
+        for key, column in keys:
+          value = get_key_value(bean_metrics, key, suffix)
+          if type(value) in (int, long, float):
+            matrix[row, column] = value
+    return matrix
+
+  def load_state(self, task_ids, state, shape):
+    """
+    Return the matrices of the previous values of tasks by metrics and the
+    time since the conditions hold of tasks by rules, from the sparse state.
+    """
+    rows = dict((str(task_id), row) for row, task_id in enumerate(task_ids))
+    previous = numpy.empty((len(task_ids), len(self.metrics)))
+    previous.fill(numpy.nan)
+    for column in self.rate_columns:
+      values = state.get('values', {}).get(get_metric_name(*self.metrics[column]), {})
+      for task_id, value in values.iteritems():
+        if task_id in rows:
+          previous[rows[task_id], column] = value
+
+    since = numpy.empty(shape)
+    since.fill(numpy.nan)
+    for column, rule in enumerate(self.rules):
+      for task_id, timestamp in state.get('since', {}).get(rule['name'], {}).iteritems():
+        if task_id in rows:
+          since[rows[task_id], column] = timestamp
+    return previous, since
+
+  def evaluate(self, tasks, state, now):
+    """
+    Evaluate the rules on tasks, a list of (task id, metrics).
+    Return (firing matrix of tasks by rules, new state).
+    """
+    task_ids = [task_id for task_id, metrics in tasks]
+    matrix = self.load_metrics(tasks)
+    current = matrix[:, self.columns]
+    shape = current.shape
+    previous, since = self.load_state(task_ids, state, shape)
+
+    observed = current.copy()
+    if self.rate_columns:
+      elapsed = now - state.get('time', now)
+      rates = numpy.empty(matrix.shape)
+      rates.fill(numpy.nan)
+      if elapsed > 0:
+        rates = (matrix - previous) / elapsed
+      observed[:, self.is_rate] = rates[:, self.columns[self.is_rate]]
+
+    conditions = numpy.zeros(shape, dtype=bool)
+    # the comparisons with nan are false
+    with numpy.errstate(invalid='ignore'):
+      for func, mask in self.operators:
+        conditions[:, mask] = func(observed[:, mask], self.values[mask])
+      conditions[:, self.is_absence] = numpy.isnan(current[:, self.is_absence])
+      since = numpy.where(conditions,
+        numpy.where(numpy.isnan(since), now, since), numpy.nan)
+      firing = conditions & (now - since >= self.durations)
+
+    new_state = {'values': {}, 'since': {}}
+    for column in self.rate_columns:
+      rows = numpy.nonzero(~numpy.isnan(matrix[:, column]))[0]
+      new_state['values'][get_metric_name(*self.metrics[column])] = dict(
+        (str(task_ids[row]), matrix[row, column]) for row in rows)
+    rows, columns = numpy.nonzero(conditions)
+    for row, column in zip(rows, columns):
+      new_state['since'].setdefault(self.rules[column]['name'], {})[
+        str(task_ids[row])] = since[row, column]
+    return firing, new_state
+
+class RuleEngine:
+  def __init__(self, rules):
+    for rule in rules:
+      check_rule(rule)
+    self.rules = rules
+    # (service, cluster, job) -> JobRules
+    self.job_rules = {}
+
+  def get_jobs(self, service_name):
+    return set(rule['job'] for rule in self.rules
+               if rule['service'] == service_name)
+
+  def get_metrics(self, service_name, job_name):
+    """
+    Return the (group, key) of the metrics the rules of a job refer to, in
+    any cluster.
+    """
+    metrics = set()
+    for rule in self.rules:
+      if rule['service'] != service_name or rule['job'] != job_name:
+        continue
+      for override in [rule] + rule.get('clusters', {}).values():
+        metrics.add((override.get('group', rule['group']),
+                     override.get('metric', rule['metric'])))
+    return metrics
+
+  def get_job_rules(self, service_name, cluster_name, job_name):
+    key = (service_name, cluster_name, job_name)
+    if key not in self.job_rules:
+      rules = []
+      for rule in self.rules:
+        if rule['service'] != service_name or rule['job'] != job_name:
+          continue
+        rule = dict(rule, **rule.get('clusters', {}).get(cluster_name, {}))
+        if rule.get('enabled', True):
+          rules.append(rule)
+      self.job_rules[key] = JobRules(rules) if rules else None
+    return self.job_rules[key]
+
+  def evaluate(self, service_name, cluster_name, job_tasks, state, now):
+    """
+    Evaluate the rules of a cluster.
+
+    job_tasks: dict from job name to a list of (task id, metrics) of the
+      healthy tasks of the job
+    state: the state returned by the previous evaluation, or {}
+    now: the timestamp in seconds
+    Return (firings, state), firings is a list of (rule, job name, task ids),
+    the rule has the overrides of the cluster applied.
+    """
+    firings = []
+    new_state = {'time': now, 'jobs': {}}
+    for job_name, tasks in job_tasks.iteritems():
+      job_rules = self.get_job_rules(service_name, cluster_name, job_name)
+      if job_rules is None or not tasks:
+        continue
+      firing, new_state['jobs'][job_name] = job_rules.evaluate(tasks,
+        dict(state.get('jobs', {}).get(job_name, {}), time=state.get('time', now)),
+        now)
+      for column in numpy.nonzero(firing.any(axis=0))[0]:
+        firings.append((job_rules.rules[column], job_name,
+          [tasks[row][0] for row in numpy.nonzero(firing[:, column])[0]]))
+    return firings, new_state
+
+rule_engine = None
+
+def get_rule_engine():
+  global rule_engine
+  if rule_engine is None:
+    rule_engine = RuleEngine(alert_rules_config.ALERT_RULES)
+  return rule_engine
+
+def apply_rules(cluster, job_tasks, now):
+  """
+  Evaluate the rules of a cluster in the status updater, and raise the
+  status of the jobs with rules fired.
+  """
+  start_time = time.time()
+  record, created = AlertRuleState.objects.get_or_create(cluster=cluster)
+  try:
+    state = json.loads(record.data) if record.data else {}
+  except ValueError:
+    state = {}
+  firings, state = get_rule_engine().evaluate(cluster.service.name,
+    cluster.name, job_tasks, state, now)
+
+  for rule, job_name, task_ids in firings:
+    job = cluster.jobs.get(job_name)
+    if job is None:
+      continue
+    job.last_status = max(job.last_status, LEVELS[rule.get('level', 'ERROR')])
+    message = 'Rule %s fired on %d task(s)' % (rule['name'], len(task_ids))
+    job.last_message = '; '.join(
+      filter(None, [job.last_message, message]))[:MAX_MESSAGE_LENGTH]
+  if cluster.jobs:
+    cluster.last_status = max([cluster.last_status] +
+      [job.last_status for job in cluster.jobs.itervalues()])
+
+  record.data = json.dumps(state)
+  record.save()
+  logger.info("%r evaluated alert rules on %d tasks in %f seconds, %d fired",
+    cluster, sum(len(tasks) for tasks in job_tasks.itervalues()),
+    time.time() - start_time, len(firings))
+  return firings
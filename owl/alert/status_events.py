@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+#
+# Alerts driven by the status changes of clusters.
+#
+# The status updater of the collector publishes an AlertEvent when the status
+# of a cluster changes, and the alert command consumes the events to update
+# the AlertState of clusters. A problem is alerted once the cluster stays in
+# the status for the alert delay, and its recovery is alerted if the problem
+# was. The events are published by the single status updater in order, so
+# the ids are consumed without gaps.
+import datetime
+import logging
+
+from django.db import transaction
+
+from models import AlertCursor, AlertEvent, AlertState
+from monitor.models import Cluster, Status
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CURSOR = 'default'
+# the max events consumed at once
+EVENT_BATCH_SIZE = 1000
+
+def get_unhealthy_jobs_message(cluster):
+  return ''.join('Job[%s] not healthy: %s\n' % (job.name, job.last_message)
+                 for name, job in sorted(cluster.jobs.iteritems())
+                 if job.last_status != Status.OK)
+
+def publish_status_change(cluster, previous_status):
+  """
+  Publish an event if the status of the cluster, computed by the status
+  updater, differs from the previous one.
+  """
+  if cluster.last_status == previous_status:
+    return None
+  return AlertEvent.objects.create(cluster=cluster,
+    time=cluster.last_attempt_time, previous_status=previous_status,
+    status=cluster.last_status, message=get_unhealthy_jobs_message(cluster))
+
+def format_alert(cluster, ok, message):
+  return '[%s]Cluster[%s]\n%s******\n' % ('OK' if ok else 'PROBLEM', cluster,
+                                          message)
+
+def apply_event(state, event, alerts):
+  # the recovery is alerted only if the problem was
+  if event.status == Status.OK and state.alerted:
+    alerts.append(format_alert(state.cluster, True, ''))
+  state.status = event.status
+  state.since = event.time
+  state.message = event.message
+  state.alerted = False
+
+def consume_events(delay, stale_time, now, name=DEFAULT_CURSOR):
+  """
+  Consume the events published, and return the messages of alerts.
+
+  delay: seconds a problem lasts before it's alerted
+  stale_time: seconds a cluster status isn't updated before it's alerted
+  """
+  AlertCursor.objects.get_or_create(name=name)
+  alerts = []
+  with transaction.atomic():
+    cursor = AlertCursor.objects.select_for_update().get(name=name)
+    events = list(AlertEvent.objects.filter(id__gt=cursor.last_event_id)
+                  .order_by('id')[:EVENT_BATCH_SIZE])
+    states = dict((state.cluster_id, state) for state in
+                  AlertState.objects.select_related('cluster__service'))
+    changed = set()
+    clusters = dict((cluster.id, cluster) for cluster in
+                    Cluster.objects.filter(active=True).select_related('service'))
+
+    for event in events:
+      state = states.get(event.cluster_id)
+      if state is None:
+        if event.cluster_id not in clusters:
+          continue
+        state = states[event.cluster_id] = AlertState(
+          cluster=clusters[event.cluster_id], since=event.time)
+      apply_event(state, event, alerts)
+      changed.add(event.cluster_id)
+
+    for cluster_id, cluster in clusters.iteritems():
+      if cluster_id not in states:
+        # the cluster changed to its status before alerted by events
+        states[cluster_id] = AlertState(cluster=cluster,
+          status=cluster.last_status, since=now)
+        changed.add(cluster_id)
+      state = states[cluster_id]
+      if (state.status != Status.OK and not state.alerted and
+          state.since <= now - datetime.timedelta(seconds=delay)):
+        alerts.append(format_alert(cluster, False, state.message))
+        state.alerted = True
+        changed.add(cluster_id)
+      # the status isn't updated if the collector is down
+      stale = cluster.last_attempt_time < now - datetime.timedelta(seconds=stale_time)
+      if stale != state.stale:
+        alerts.append(format_alert(cluster, not stale,
+          'Status not updated since %s\n' % cluster.last_attempt_time if stale else ''))
+        state.stale = stale
+        changed.add(cluster_id)
+
+    for cluster_id in changed:
+      states[cluster_id].save()
+    if events:
+      cursor.last_event_id = events[-1].id
+      cursor.save()
+      logger.info("Consumed %d alert events to %d", len(events), cursor.last_event_id)
+  return alerts
+
+def delete_expired_events(retention, now, name=DEFAULT_CURSOR):
+  """
+  Delete the events consumed older than retention days.
+  """
+  cursors = AlertCursor.objects.filter(name=name)
+  if not cursors:
+    return 0
+  events = AlertEvent.objects.filter(id__lte=cursors[0].last_event_id,
+    time__lt=now - datetime.timedelta(days=retention))
+  count = events.count()
+  events.delete()
+  return count
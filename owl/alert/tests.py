@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the alert app.
+"""
+
+import datetime
+import email
+
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from models import AlertCursor, AlertEvent, AlertState
+from monitor.models import Service, Cluster, Job, Status
+import rule_engine
+import status_events
+import utils.mail
+
+class StatusEventsTest(TestCase):
+  def setUp(self):
+    self.now = timezone.now()
+    service = Service.objects.create(name='hdfs', metric_url='/jmx')
+    self.cluster = Cluster.objects.create(service=service, name='test-cluster',
+      last_status=Status.OK, last_attempt_time=self.now)
+
+  def change_status(self, status, seconds):
+    previous_status = self.cluster.last_status
+    self.cluster.last_status = status
+    self.cluster.last_attempt_time = self.now + datetime.timedelta(seconds=seconds)
+    job = Job(cluster=self.cluster, name='datanode', last_status=status,
+      last_message='Too few running datanodes!')
+    self.cluster.jobs = {'datanode': job}
+    self.cluster.save()
+    return status_events.publish_status_change(self.cluster, previous_status)
+
+  def consume(self, seconds):
+    return status_events.consume_events(60, 3600,
+      self.now + datetime.timedelta(seconds=seconds))
+
+  def test_problem_and_recovery(self):
+    self.assertEqual([], self.consume(0))
+    self.assertEqual(Status.OK, AlertState.objects.get(cluster=self.cluster).status)
+
+    self.assertIsNone(self.change_status(Status.OK, 10))
+    self.change_status(Status.ERROR, 20)
+    # the problem isn't alerted until it lasts for the delay
+    self.assertEqual([], self.consume(30))
+    alerts = self.consume(90)
+    self.assertEqual(1, len(alerts))
+    self.assertIn('[PROBLEM]Cluster[hdfs/test-cluster]', alerts[0])
+    self.assertIn('Too few running datanodes!', alerts[0])
+    self.assertEqual([], self.consume(100))
+
+    self.change_status(Status.OK, 110)
+    alerts = self.consume(120)
+    self.assertEqual(1, len(alerts))
+    self.assertIn('[OK]Cluster[hdfs/test-cluster]', alerts[0])
+    cursor = AlertCursor.objects.get(name=status_events.DEFAULT_CURSOR)
+    self.assertEqual(AlertEvent.objects.order_by('-id')[0].id, cursor.last_event_id)
+
+  def test_transient_problem(self):
+    self.change_status(Status.ERROR, 10)
+    self.change_status(Status.OK, 20)
+    self.assertEqual([], self.consume(120))
+
+  def test_stale_status(self):
+    alerts = self.consume(7200)
+    self.assertEqual(1, len(alerts))
+    self.assertIn('Status not updated', alerts[0])
+    self.assertEqual([], self.consume(7300))
+    self.change_status(Status.OK, 7400)
+    self.assertIn('[OK]', self.consume(7410)[0])
+
+  def test_delete_expired_events(self):
+    self.change_status(Status.ERROR, 10)
+    self.assertEqual(0, status_events.delete_expired_events(1,
+      self.now + datetime.timedelta(days=2)))
+    self.consume(20)
+    self.assertEqual(1, status_events.delete_expired_events(1,
+      self.now + datetime.timedelta(days=2)))
+
+
+RULES = [
+  {'name': 'volume_failures', 'service': 'hdfs', 'job': 'datanode',
+   'group': 'DataNode', 'metric': 'VolumeFailures',
+   'condition': 'threshold', 'operator': '>', 'value': 0, 'level': 'WARN',
+   'clusters': {'big-cluster': {'value': 2}}},
+  {'name': 'bytes_read_rate', 'service': 'hdfs', 'job': 'datanode',
+   'group': 'DataNode', 'metric': 'BytesRead',
+   'condition': 'rate', 'operator': '>=', 'value': 100, 'for': 20},
+  {'name': 'bytes_read_absent', 'service': 'hdfs', 'job': 'datanode',
+   'group': 'DataNode', 'metric': 'BytesRead', 'condition': 'absence',
+   'clusters': {'big-cluster': {'enabled': False}}},
+]
+
+def make_datanode_metrics(volume_failures, bytes_read=None):
+  metrics = {
+    'Hadoop:service=DataNode,name=FSDatasetState-DS-1': {
+      'VolumeFailures': volume_failures,
+    },
+  }
+  if bytes_read is not None:
+    metrics['Hadoop:service=DataNode,name=DataNodeActivity-host-12402'] = {
+      'BytesRead': bytes_read,
+    }
+  return metrics
+
+class RuleEngineTest(SimpleTestCase):
+  def setUp(self):
+    self.engine = rule_engine.RuleEngine(RULES)
+
+  def evaluate(self, cluster_name, tasks, state, now):
+    firings, state = self.engine.evaluate('hdfs', cluster_name,
+      {'datanode': tasks}, state, now)
+    return dict((rule['name'], task_ids) for rule, job, task_ids in firings), state
+
+  def test_threshold_and_absence(self):
+    tasks = [(1, make_datanode_metrics(0, 0)), (2, make_datanode_metrics(1)),
+             (3, make_datanode_metrics(3, 0))]
+    firings, state = self.evaluate('test-cluster', tasks, {}, 1000)
+    self.assertEqual({'volume_failures': [2, 3], 'bytes_read_absent': [2]},
+      firings)
+    # the overrides of a cluster
+    firings, state = self.evaluate('big-cluster', tasks, {}, 1000)
+    self.assertEqual({'volume_failures': [3]}, firings)
+
+  def test_rate_for_duration(self):
+    tasks = [(1, make_datanode_metrics(0, 0)), (2, make_datanode_metrics(0, 0))]
+    firings, state = self.evaluate('test-cluster', tasks, {}, 1000)
+    self.assertEqual({}, firings)
+
+    tasks = [(1, make_datanode_metrics(0, 1000)), (2, make_datanode_metrics(0, 10))]
+    firings, state = self.evaluate('test-cluster', tasks, state, 1010)
+    # the rate holds shorter than the duration
+    self.assertEqual({}, firings)
+    self.assertEqual({'1': 1010}, state['jobs']['datanode']['since']['bytes_read_rate'])
+
+    tasks = [(1, make_datanode_metrics(0, 2000)), (2, make_datanode_metrics(0, 20))]
+    firings, state = self.evaluate('test-cluster', tasks, state, 1020)
+    self.assertEqual({}, firings)
+    tasks = [(1, make_datanode_metrics(0, 3000)), (2, make_datanode_metrics(0, 30))]
+    firings, state = self.evaluate('test-cluster', tasks, state, 1030)
+    self.assertEqual({'bytes_read_rate': [1]}, firings)
+
+    # the condition resets once it doesn't hold
+    tasks = [(1, make_datanode_metrics(0, 3000)), (2, make_datanode_metrics(0, 30))]
+    firings, state = self.evaluate('test-cluster', tasks, state, 1040)
+    self.assertEqual({}, firings)
+    self.assertEqual({}, state['jobs']['datanode']['since'])
+
+  def test_invalid_rule(self):
+    rule = dict(RULES[0], operator='~')
+    self.assertRaises(ValueError, rule_engine.RuleEngine, [rule])
+
+  def test_load_metrics_by_key(self):
+    job_rules = rule_engine.JobRules([
+      {'name': 'log_queue', 'service': 'hbase', 'job': 'regionserver',
+       'group': 'Replication', 'metric': 'sizeOfLogQueue-5',
+       'condition': 'threshold', 'operator': '>', 'value': 10},
+      {'name': 'table_latency', 'service': 'hbase', 'job': 'regionserver',
+       'group': 'RegionServer', 'metric': 'tbl.test.cf.S-T.multiput_AvgTime',
+       'condition': 'threshold', 'operator': '>', 'value': 10},
+    ])
+    metrics = {
+      'hadoop:service=Replication,name=ReplicationSource for 5': {
+        'sizeOfLogQueue': 12, 'ageOfLastShippedOp': 100,
+      },
+      'hadoop:service=Replication,name=ReplicationSource for 6': {
+        'sizeOfLogQueue': 3,
+      },
+      'hadoop:service=RegionServer,name=RegionServerDynamicStatistics': {
+        'tbl.test.cf.S~T.multiput_AvgTime': 20,
+      },
+    }
+    # the columns are in the order of (group, key)
+    self.assertEqual([[20, 12]], job_rules.load_metrics([(1, metrics)]).tolist())
+
+
+class FakeConnection:
+  from_email = 'owl@example.com'
+
+  def __init__(self):
+    self.mails = []
+
+  def sendmail(self, to_emails, message):
+    self.mails.append((to_emails, email.message_from_string(message)))
+
+class NotifierTest(SimpleTestCase):
+  def setUp(self):
+    self.connection = FakeConnection()
+    self.notifier = utils.mail.Notifier(self.connection, group_window=60,
+      dedup_window=3600, rate_limit=2, digest_interval=0)
+
+  def get_subjects(self):
+    return [message['Subject'] for to_emails, message in self.connection.mails]
+
+  def test_group_and_dedup(self):
+    self.notifier.add('alert', 'cluster a', 'x@example.com, y@example.com',
+      'plain', 1000)
+    self.notifier.add('alert', 'cluster b', 'x@example.com,y@example.com',
+      'plain', 1010)
+    self.notifier.add('alert', 'cluster b', 'x@example.com,y@example.com',
+      'plain', 1020)
+    self.notifier.add('error', 'db error', 'x@example.com', 'plain', 1030)
+    self.notifier.send_due(1059)
+    self.assertEqual([], self.connection.mails)
+
+    self.notifier.send_due(1060)
+    self.assertEqual(['alert (3 notifications)'], self.get_subjects())
+    to_emails, message = self.connection.mails[0]
+    self.assertEqual(['x@example.com', 'y@example.com'], to_emails)
+    self.assertIn('alert (repeated 2 times)\ncluster b',
+      message.get_payload(decode=True))
+
+    self.notifier.send_due(1090)
+    self.assertEqual('error', self.get_subjects()[-1])
+    # the same error in the dedup window is dropped and counted
+    self.notifier.add('error', 'db error', 'x@example.com', 'plain', 2000)
+    self.notifier.send_due(2100)
+    self.assertEqual(2, len(self.connection.mails))
+    self.notifier.add('error', 'db error', 'x@example.com', 'plain', 5000)
+    self.notifier.send_due(5100)
+    self.assertEqual('error (2 notifications)', self.get_subjects()[-1])
+
+  def test_dropped_summary(self):
+    self.notifier.add('error', 'db error', 'x@example.com', 'plain', 1000)
+    self.notifier.send_due(1060)
+    for i in range(3):
+      self.notifier.add('error', 'db error', 'x@example.com', 'plain', 1100 + i)
+    self.notifier.send_due(4000)
+    self.assertEqual(['error'], self.get_subjects())
+
+    # the duplicates dropped are reported once the window expires
+    self.notifier.send_due(4660)
+    self.notifier.send_due(4720)
+    self.assertEqual(['error', 'error (3 notifications)'], self.get_subjects())
+    to_emails, message = self.connection.mails[-1]
+    self.assertIn('error (3 duplicates suppressed)',
+      message.get_payload(decode=True))
+    # and the mails sent are forgotten after the window
+    self.notifier.send_due(8400)
+    self.assertEqual({}, self.notifier.recent)
+    self.assertEqual(2, len(self.connection.mails))
+
+  def test_rate_limit(self):
+    for i in range(4):
+      self.notifier.add('alert %d' % i, 'content', 'x@example.com', 'plain',
+        1000 + i)
+    self.notifier.send_due(1100)
+    self.assertEqual(['alert 0', 'alert 1'], self.get_subjects())
+    # the mails over the limit are held until an hour after the first mail
+    self.notifier.send_due(4000)
+    self.assertEqual(2, len(self.connection.mails))
+    self.notifier.send_due(4700)
+    self.assertEqual(['alert 0', 'alert 1', 'alert 2', 'alert 3'],
+      self.get_subjects())
+
+  def test_digest_and_flush(self):
+    self.notifier.digest_interval = 600
+    self.notifier.add('alert', 'cluster a', 'x@example.com', 'plain', 1000)
+    self.notifier.add('error', 'db error', 'x@example.com', 'plain', 1010)
+    self.notifier.send_due(1100)
+    self.assertEqual([], self.connection.mails)
+    self.notifier.send_due(1100, flush=True)
+    self.assertEqual(['OWL digest (2 notifications)'], self.get_subjects())
@@ -17,12 +17,14 @@ import deploy_utils
 from optparse import make_option
 from os import path
 
+from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 from django.db import connection
 from django.db import transaction
 from django.utils import timezone
 
 from monitor import dbutil
+from monitor import storage
 from monitor.models import Service, Cluster, Job, Task
 from monitor.models import Status
 
@@ -32,11 +34,14 @@ from twisted.web import client
 # For debugging
 import gc
 
+from metrics_updater import flush_exported_metrics
 from metrics_updater import update_metrics_in_process
 from status_updater import update_status_in_process
 from metrics_aggregator import aggregate_region_operation_metric_in_process
+from region_pruner import prune_regions_in_process
 from collect_utils import QueueTask
 from collect_utils import METRIC_TASK_TYPE, STATUS_TASK_TYPE, AGGREGATE_TASK_TYPE
+from collect_utils import PRUNE_TASK_TYPE
 
 # the number of multiprocesses
 PROCESS_NUM = 6
@@ -45,6 +50,7 @@ QUEUE_TASK_CALLBACK = {
   METRIC_TASK_TYPE: update_metrics_in_process,
   STATUS_TASK_TYPE: update_status_in_process,
   AGGREGATE_TASK_TYPE: aggregate_region_operation_metric_in_process, 
+  PRUNE_TASK_TYPE: prune_regions_in_process,
 }
 
 logger = logging.getLogger(__name__)
@@ -58,6 +64,7 @@ def process_queue_task(input_queue, output_queue):
         queue_task.task_data)
     except Queue.Empty:
       logger.warning("Input Queue is empty in process %d." % os.getpid())
+      flush_exported_metrics()
       continue
 
 class CollectorConfig:
@@ -186,6 +193,27 @@ class RegionOperationMetricAggregator:
     reactor.callFromThread(reactor.callLater, wait_time,
       self.produce_aggregate_task, input_queue)
 
+class RegionPruner:
+  """
+  Archive and delete the dead regions periodically, so the region table
+  only holds about the live regions.
+  """
+  def produce_prune_task(self, input_queue):
+    reactor.callInThread(self.produce_prune_task_in_thread, input_queue)
+
+  def produce_prune_task_in_thread(self, input_queue):
+    try:
+      input_queue.put(QueueTask(PRUNE_TASK_TYPE, None))
+    except Exception as e:
+      logger.warning("Failed to produce prune task %r", e)
+    finally:
+      self.schedule_next_prune(input_queue)
+
+  def schedule_next_prune(self, input_queue):
+    wait_time = settings.REGION_PRUNE_PERIOD
+    reactor.callFromThread(reactor.callLater, wait_time,
+      self.produce_prune_task, input_queue)
+
 class StatusUpdater:
   """
   Update status of all active clusters and jobs, which are inferred from
@@ -238,6 +266,8 @@ class Command(BaseCommand):
 
     self.args = args
     self.options = options
+    # workers of collector do batch updates every cycle
+    storage.set_process_type(storage.PROCESS_TYPE_COLLECTOR)
 
     self.stdout.write("args: %r\n" % (args, ))
     self.stdout.write("options: %r\n" % options)
@@ -359,5 +389,9 @@ class Command(BaseCommand):
     reactor.callLater(self.collector_config.period + 1,
       region_operation_aggregator.produce_aggregate_task, self.input_queue)
 
+    region_pruner = RegionPruner()
+    reactor.callLater(settings.REGION_PRUNE_PERIOD,
+      region_pruner.produce_prune_task, self.input_queue)
+
     reactor.run()
 
@@ -2,6 +2,7 @@
 METRIC_TASK_TYPE = "Metric"
 STATUS_TASK_TYPE = "Status"
 AGGREGATE_TASK_TYPE = "Aggregate"
+PRUNE_TASK_TYPE = "Prune"
 
 class QueueTask:
   def __init__(self, task_type, task_data):
@@ -1,4 +1,5 @@
 import Queue
+import calendar
 import datetime
 import json
 import logging
@@ -9,10 +10,18 @@ import traceback
 
 from collect_utils import METRIC_TASK_TYPE, STATUS_TASK_TYPE, AGGREGATE_TASK_TYPE
 from collect_utils import QueueTask
+from django.conf import settings
 from django.db import connection
 from monitor import dbutil
+from monitor import distribution
+from monitor import local_tsdb
 from monitor import metric_helper
+from monitor import region_lifecycle
+from monitor import skew
+from monitor import storm_metrics
 from monitor.models import Region, RegionServer, Table, HBaseCluster
+from status_updater import select_status_metrics
+import utils.tsdb_client
 
 REGION_SERVER_DYNAMIC_STATISTICS_BEAN_NAME = "hadoop:service=RegionServer," \
   "name=RegionServerDynamicStatistics"
@@ -33,6 +42,13 @@ HBASE_AGGREGATED_METRICS_KEY = ['memStoreSizeMB',
                                 'writeRequestsCountPerSec',
                                ]
 
+# only the metrics shown on owl pages are saved into the local tsdb.
+LOCAL_TSDB_METRICS = set((group, key)
+  for group, key, unit in metric_helper.get_all_metrics_config())
+LOCAL_TSDB_HBASE_METRICS_KEY = ['readRequestsCountPerSec',
+                                'writeRequestsCountPerSec',
+                               ]
+
 logger = logging.getLogger(__name__)
 
 # global functions for subprocesses to handling metrics
@@ -45,6 +61,95 @@ def aggregate_metrics(from_record, to_record):
     old_value = getattr(to_record, key)
     setattr(to_record, key, old_value + getattr(from_record, key))
 
+def get_timestamp(update_time):
+  return calendar.timegm(update_time.utctimetuple())
+
+def iter_task_perf_counters(metric_task, metrics_saved):
+  """
+  Iterate (group, key, value) of the numeric metrics of a task, named as
+  the perf counters of /monitor/metrics, see dbutil.generate_perf_counter.
+  """
+  for bean_name, bean_metrics in metrics_saved.iteritems():
+    try:
+      group = metric_helper.form_perf_counter_group_name(metric_task, bean_name)
+    except Exception as e:
+      logger.warning("%r failed to parse bean name %s: %r",
+        metric_task, bean_name, e)
+      continue
+    for metric_name, metric_value in bean_metrics.iteritems():
+      metric_type = type(metric_value)
+      if not metric_type is int and not metric_type is float:
+        continue
+      key = metric_helper.form_perf_counter_key_name(bean_name, metric_name)
+      yield group, key, metric_value
+
+def save_task_metrics_to_local_tsdb(metric_task, metrics_saved):
+  store = local_tsdb.get_local_tsdb()
+  if store is None:
+    return
+  endpoint = metric_helper.form_perf_counter_endpoint_name(metric_task)
+  timestamp = get_timestamp(metric_task.last_attempt_time)
+  points = []
+  for group, key, value in iter_task_perf_counters(metric_task, metrics_saved):
+    if (group, key) in LOCAL_TSDB_METRICS:
+      points.append((endpoint, group, key, timestamp, value))
+  store.put_many(points)
+
+def save_task_status_metrics(metric_task, metrics_saved):
+  # the status updater reads the metrics selected here, instead of decoding
+  # last_metrics of every task per cycle
+  metrics = select_status_metrics(metric_task, metrics_saved)
+  if metrics is not None:
+    dbutil.save_task_status_metrics(metric_task, metrics,
+      metric_task.last_attempt_time)
+
+def export_task_metrics_to_tsdb(metric_task, metrics_saved):
+  # the task metrics are pushed to tsdb here instead of being fetched by
+  # opentsdb/metrics_collector.py from /monitor/metrics. The points of the
+  # tasks of a worker process are buffered and put in batches.
+  if not settings.TSDB_EXPORT_ENABLED:
+    return
+  endpoint = metric_helper.form_perf_counter_endpoint_name(metric_task)
+  timestamp = get_timestamp(metric_task.last_attempt_time)
+  points = []
+  for group, key, value in iter_task_perf_counters(metric_task, metrics_saved):
+    # '#' is illegal in tsdb metric names
+    points.append((key.replace('#', '_'), timestamp, value,
+      {'host': endpoint, 'group': group}))
+  try:
+    utils.tsdb_client.register_keys(point[0] for point in points)
+    log_export_stats(utils.tsdb_client.buffer_points(points))
+  except Exception as e:
+    logger.warning("%r failed to export metrics to tsdb: %r", metric_task, e)
+
+def flush_exported_metrics():
+  # called by the idle worker processes, so the points buffered don't wait
+  # for more tasks
+  if not settings.TSDB_EXPORT_ENABLED:
+    return
+  try:
+    log_export_stats(utils.tsdb_client.flush_points())
+  except Exception as e:
+    logger.warning("Failed to export metrics to tsdb: %r", e)
+
+def log_export_stats(stats):
+  if stats is None:
+    return
+  logger.info("Exported %d metrics to tsdb in %f seconds, %d failed",
+    stats['points'], stats['seconds'], stats['failed_points'])
+
+def save_hbase_metrics_to_local_tsdb(cluster, records, update_time):
+  store = local_tsdb.get_local_tsdb()
+  if store is None:
+    return
+  endpoint = dbutil.map_cluster_to_endpoint(cluster.name)
+  timestamp = get_timestamp(update_time)
+  points = []
+  for group, record in records:
+    for key in LOCAL_TSDB_HBASE_METRICS_KEY:
+      points.append((endpoint, group, key, timestamp, getattr(record, key)))
+  store.put_many(points)
+
 def analyze_hbase_region_server_metrics(metric_task, metrics):
   region_server_name = None
   region_operation_metrics_dict = {}
@@ -124,11 +229,39 @@ def get_host_and_port_from_region_server_name(rs_name):
   port = int(tokens[1]) + 1
   return [host_name, port]
 
+# materialize the request and data distributions of tables, regionservers
+# and the cluster, so hbase boards needn't scan all regions.
+def save_hbase_distributions(cluster, regions, rs_records, tables, update_time):
+  top_n = settings.DISTRIBUTION_TOP_N
+  regions_by_owner = {}
+  for region in sorted(regions, key=lambda region: region.name):
+    regions_by_owner.setdefault(('table', region.table_id), []).append(region)
+    regions_by_owner.setdefault(('regionserver', region.region_server.id), []).append(region)
+
+  distributions = []
+  for (owner_type, owner_id), owner_regions in regions_by_owner.iteritems():
+    summaries = distribution.summarize_records(owner_regions,
+      lambda region: region.get_region_id(), distribution.REGION_DISTRIBUTIONS, top_n)
+    for name, summary in summaries.iteritems():
+      distributions.append((owner_type, owner_id, name, summary))
+
+  for owner_type, records in (('cluster_table', tables),
+                              ('cluster_regionserver', rs_records)):
+    summaries = distribution.summarize_records(records, str,
+      distribution.GROUP_DISTRIBUTIONS, top_n)
+    for name, summary in summaries.iteritems():
+      distributions.append((owner_type, cluster.id, name, summary))
+
+  dbutil.save_distributions(cluster, distributions, update_time)
+
 def analyze_hbase_master_metrics(metric_task, metrics):
   cluster = metric_task.job.cluster
   hbase_cluster_record, created = HBaseCluster.objects.get_or_create(cluster=cluster)
   reset_aggregated_metrics(hbase_cluster_record)
   tables = {}
+  # the time of the previous master snapshot of tables
+  previous_times = {}
+  rs_records = []
   region_record_need_save = []
   for bean in metrics['beans']:
     try:
@@ -175,6 +308,8 @@ def analyze_hbase_master_metrics(metric_task, metrics):
           if table_name not in tables:
             table_record, created = Table.objects.get_or_create(cluster = cluster,
               name = table_name)
+            if not created:
+              previous_times[table_name] = table_record.last_attempt_time
             reset_aggregated_metrics(table_record)
             tables[table_name] = table_record
 
@@ -207,6 +342,7 @@ def analyze_hbase_master_metrics(metric_task, metrics):
           aggregate_metrics(region_record, hbase_cluster_record)
 
         rs_record.save()
+        rs_records.append(rs_record)
 
       for table_record in tables.itervalues():
         table_record.last_attempt_time = metric_task.last_attempt_time
@@ -216,6 +352,16 @@ def analyze_hbase_master_metrics(metric_task, metrics):
 
       hbase_cluster_record.save()
 
+      save_hbase_metrics_to_local_tsdb(cluster,
+        [(str(record), record) for record in rs_records] +
+        [(str(record), record) for record in tables.itervalues()] +
+        [('Cluster', hbase_cluster_record)],
+        metric_task.last_attempt_time)
+
+      # compare with the regions of previous snapshot before they're updated
+      region_lifecycle.track_region_events(cluster, tables, previous_times,
+        region_record_need_save, metric_task.last_attempt_time)
+
       # do batch update
       begin = datetime.datetime.now()
       dbutil.update_regions_for_master_metrics(region_record_need_save)
@@ -223,11 +369,30 @@ def analyze_hbase_master_metrics(metric_task, metrics):
         "saved regions=%d, consume=%s",
         metric_task, len(region_record_need_save),
         str((datetime.datetime.now() - begin).total_seconds()))
+
+      save_hbase_distributions(cluster, region_record_need_save, rs_records,
+        tables.values(), metric_task.last_attempt_time)
+
+      begin = time.time()
+      dbutil.save_skew_summaries(cluster, skew.analyze_regions(
+        region_record_need_save, lambda region: region.get_region_id()),
+        metric_task.last_attempt_time)
+      logger.info("%r analyzed skew of %d regions, consume=%f",
+        metric_task, len(region_record_need_save), time.time() - begin)
     except Exception as e:
       traceback.print_exc()
       logger.warning("%r failed to analyze metrics: %r", metric_task, e)
       continue
 
+def save_storm_metrics(metric_task, metrics_raw):
+  try:
+    metrics = json.loads(metrics_raw)
+  except ValueError as e:
+    logger.warning("%r failed to decode storm metrics: %r", metric_task, e)
+    return
+  dbutil.save_storm_metrics(metric_task.job.cluster,
+    storm_metrics.normalize(metrics), metric_task.last_attempt_time)
+
 def analyze_metrics(metric_task, metrics):
   if 'beans' not in metrics:
     return
@@ -249,6 +414,11 @@ def update_metrics_in_process(output_queue, metric_task):
     metricsRawData = metric_task.last_metrics_raw
 
     start_time = time.time()
+    # storm metrics are decoded once here, and pages read the slices
+    if (metricsRawData and metric_task.job.name == 'metricserver' and
+        metric_task.job.cluster.service.name == 'storm'):
+      save_storm_metrics(metric_task, metricsRawData)
+
     # analyze the metric if needed
     if metric_task.need_analyze:
       if metricsRawData:
@@ -279,6 +449,9 @@ def update_metrics_in_process(output_queue, metric_task):
             group = metrics_saved.setdefault(bean_name, {})
             group[metric_name] = metric_value
         metric_task.last_metrics = json.dumps(metrics_saved)
+        save_task_metrics_to_local_tsdb(metric_task, metrics_saved)
+        save_task_status_metrics(metric_task, metrics_saved)
+        export_task_metrics_to_tsdb(metric_task, metrics_saved)
 
         analyze_metrics(metric_task, metrics)
 
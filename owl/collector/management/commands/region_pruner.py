@@ -0,0 +1,17 @@
+import logging
+import os
+import time
+
+from monitor import region_lifecycle
+
+logger = logging.getLogger(__name__)
+
+def prune_regions_in_process(output_queue, task_data):
+  logger.info("Pruning dead regions in process %d" % os.getpid())
+  try:
+    start_time = time.time()
+    archived = region_lifecycle.prune_dead_regions()
+    logger.info("spent %f seconds for archiving %d dead regions",
+      time.time() - start_time, archived)
+  except Exception as e:
+    logger.warning("Failed to prune dead regions: %r", e)
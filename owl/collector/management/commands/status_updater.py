@@ -1,22 +1,101 @@
+import calendar
 import datetime
-import json
 import logging
 import os
 import time
 
+from alert import rule_engine
+from alert import status_events
+from django.conf import settings
 from django.utils import timezone
+from monitor import cluster_rollup
+from monitor import dbutil
+from monitor import local_tsdb
+from monitor.bean_name import form_perf_counter_key_name
+from monitor.bean_name import parse_bean_name
 from monitor.models import Cluster
 from monitor.models import Status
+from monitor.models import Task
+import utils.tsdb_client
 
 import gc
 import resource
 
 logger = logging.getLogger(__name__)
 
+# the metrics of the checks of active masters, service -> job ->
+# [(bean name, metric name), ...]
+STATUS_CHECK_METRICS = {
+  'hdfs': {
+    'namenode': [
+      ('Hadoop:service=NameNode,name=FSNamesystem', 'tag.HAState'),
+      ('Hadoop:service=NameNode,name=NameNodeInfo', 'Version'),
+    ],
+  },
+  'hbase': {
+    'master': [
+      ('hadoop:service=Master,name=Master', 'IsActiveMaster'),
+      ('Hadoop:service=HBase,name=Master,sub=Server', 'tag.isActiveMaster'),
+      ('hadoop:service=HBase,name=Info', 'version'),
+      ('hadoop:service=HBase,name=Info', 'revision'),
+    ],
+  },
+}
+
+# (service, job, tsdb export enabled) -> group -> keys, see
+# get_status_metric_keys
+status_metric_keys = {}
+
+def get_status_metric_keys(service_name, job_name):
+  """
+  Return a dict from group to the keys of the metrics of a job read by the
+  status updater: the checks of active masters, and the inputs of cluster
+  rollups, job series and alert rules.
+  """
+  cache_key = (service_name, job_name, settings.TSDB_EXPORT_ENABLED)
+  if cache_key not in status_metric_keys:
+    metrics = set()
+    for bean_name, metric_name in \
+        STATUS_CHECK_METRICS.get(service_name, {}).get(job_name, []):
+      metrics.add((parse_bean_name(bean_name)[0],
+                   form_perf_counter_key_name(bean_name, metric_name)))
+    for rollup in cluster_rollup.get_rollup_metrics_of_job(service_name,
+                                                           job_name):
+      metrics.add((rollup[2], rollup[3]))
+    if settings.TSDB_EXPORT_ENABLED:
+      metrics |= cluster_rollup.get_job_series_metrics(service_name, job_name)
+    metrics |= rule_engine.get_rule_engine().get_metrics(service_name, job_name)
+    groups = {}
+    for group, key in metrics:
+      groups.setdefault(group, set()).add(key)
+    status_metric_keys[cache_key] = groups
+  return status_metric_keys[cache_key]
+
+def select_status_metrics(task, metrics):
+  """
+  Select the metrics read by the status updater from the decoded metrics of
+  a task, which are saved by the collector in TaskStatusMetrics. Return
+  None if the status updater reads no metrics of the job.
+  """
+  groups = get_status_metric_keys(task.job.cluster.service.name, task.job.name)
+  if not groups:
+    return None
+  selected = {}
+  for bean_name, bean_metrics in metrics.iteritems():
+    try:
+      keys = groups.get(parse_bean_name(bean_name)[0])
+    except IndexError:
+      continue
+    if not keys:
+      continue
+    for metric_name, metric_value in bean_metrics.iteritems():
+      if form_perf_counter_key_name(bean_name, metric_name) in keys:
+        selected.setdefault(bean_name, {})[metric_name] = metric_value
+  return selected
+
 def get_latest_metric(task, group_name, metric_name):
   try:
-    metric = json.loads(task.last_metrics)
-    return metric[group_name][metric_name]
+    return task.status_metrics[group_name][metric_name]
   except Exception as e:
     logger.warning("%r failed to get metric: %r", task, e)
     return 0
@@ -172,13 +251,39 @@ def update_storm_cluster_status(cluster):
     job.last_message = "No running Storm UI"
   cluster.last_status = max([job.last_status for job in cluster.jobs.itervalues()])
 
+def update_cluster_rollups(cluster, job_metrics):
+  previous = dict((summary.name, (summary.total, summary.last_update_time))
+                  for summary in dbutil.get_cluster_summaries(cluster))
+  rollups = cluster_rollup.compute_rollups(cluster.service.name, job_metrics,
+    previous, cluster.last_attempt_time)
+  dbutil.save_cluster_summaries(cluster, rollups, cluster.last_attempt_time)
+
+def export_job_series(cluster, job_metrics):
+  endpoint = dbutil.map_cluster_to_endpoint(cluster.name)
+  timestamp = calendar.timegm(cluster.last_attempt_time.utctimetuple())
+  # '#' is illegal in tsdb metric names
+  points = [(key.replace('#', '_'), timestamp, value,
+             {'host': endpoint, 'group': group})
+            for group, key, value in cluster_rollup.compute_job_series(
+              cluster.service.name, job_metrics)]
+  try:
+    utils.tsdb_client.register_keys(point[0] for point in points)
+    stats = utils.tsdb_client.put_points(points)
+  except Exception as e:
+    logger.warning("%r failed to export job series to tsdb: %r", cluster, e)
+    return
+  logger.info("%r exported %d job series to tsdb, %d failed",
+    cluster, stats['points'], stats['failed_points'])
+
 def update_cluster_status(cluster, start_time):
+  previous_status = cluster.last_status
   cluster.jobs = {}
   cluster.last_attempt_time = datetime.datetime.utcfromtimestamp(
     start_time).replace(tzinfo=timezone.utc)
   cluster.last_status = Status.OK
   cluster.last_message = ""
 
+  jobs = {}
   for job in cluster.job_set.all():
     job.running_tasks = {}
     job.tasks = {}
@@ -187,13 +292,38 @@ def update_cluster_status(cluster, start_time):
     job.last_message = ""
     job.running_tasks_count = 0
     job.total_tasks_count = 0
-    for task in job.task_set.filter(active=True):
-      if task.health:
-        job.running_tasks[task.id] = task
-        job.running_tasks_count += 1
-      job.total_tasks_count += 1
+    jobs[job.id] = job
     cluster.jobs[job.name] = job
 
+  rollup_jobs = set(rollup[1] for rollup in
+                    cluster_rollup.get_rollup_metrics(cluster.service.name))
+  # the job series are exported along with the task metrics
+  series_jobs = set()
+  if settings.TSDB_EXPORT_ENABLED:
+    series_jobs = set(cluster_rollup.get_job_series_jobs(cluster.service.name))
+  rule_jobs = rule_engine.get_rule_engine().get_jobs(cluster.service.name)
+  job_metrics = {}
+  # the healthy tasks of the jobs with alert rules, (task id, metrics)
+  job_tasks = {}
+  # the metrics read here are selected by the collector, the whole metrics of
+  # tasks are neither loaded nor decoded
+  status_metrics = dbutil.get_task_status_metrics(cluster)
+  # fetch the tasks of all jobs in one query instead of one query per job
+  for task in Task.objects.filter(job__cluster=cluster, active=True).defer(
+      'last_metrics', 'last_metrics_raw'):
+    job = jobs[task.job_id]
+    task.status_metrics = status_metrics.get(task.id, {})
+    if task.health:
+      job.running_tasks[task.id] = task
+      job.running_tasks_count += 1
+    job.total_tasks_count += 1
+    if (job.name in rollup_jobs or job.name in series_jobs or
+        job.name in rule_jobs) and task.status_metrics:
+      job_metrics.setdefault(job.name, []).append(
+        (task.health, task.status_metrics))
+      if job.name in rule_jobs and task.health:
+        job_tasks.setdefault(job.name, []).append((task.id, task.status_metrics))
+
   service_handler = {
       "hdfs": update_hdfs_cluster_status,
       "hbase": update_hbase_cluster_status,
@@ -202,6 +332,13 @@ def update_cluster_status(cluster, start_time):
       "storm": update_storm_cluster_status,
   }
   service_handler[cluster.service.name](cluster)
+  if rule_jobs:
+    rule_engine.apply_rules(cluster, job_tasks, start_time)
+
+  if rollup_jobs:
+    update_cluster_rollups(cluster, job_metrics)
+  if series_jobs:
+    export_job_series(cluster, job_metrics)
 
   for job in cluster.jobs.itervalues():
     if job.last_status < Status.ERROR:
@@ -213,15 +350,21 @@ def update_cluster_status(cluster, start_time):
     # OK or WARN
     cluster.last_success_time = job.last_attempt_time
   cluster.save()
+  # the alert command is driven by the status changes
+  status_events.publish_status_change(cluster, previous_status)
 
 def update_status_in_process(output_queue, task_data):
   logger.info("Updating clusters status in process %d" % os.getpid())
   try:
     start_time = time.time()
-    for cluster in Cluster.objects.filter(active=True).all():
+    for cluster in Cluster.objects.filter(active=True).select_related('service'):
       update_cluster_status(cluster, start_time)
     logger.info("spent %f seconds for updating clusters status",
         time.time() - start_time)
+
+    store = local_tsdb.get_local_tsdb()
+    if store is not None:
+      store.expire_all_if_needed()
     logger.info("gc: %r", gc.get_count())
     logger.info("usage: %r", resource.getrusage(resource.RUSAGE_SELF))
   except Exception as e:
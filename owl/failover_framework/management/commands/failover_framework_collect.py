@@ -12,7 +12,9 @@ import utils.mail
 from django.conf import settings
 from django.core.management.base import BaseCommand
 
+from failover_framework import statistics
 from failover_framework.models import Action
+from failover_framework.models import HourlyStatistics
 from failover_framework.models import Task
 
 logger = logging.getLogger(__name__)
@@ -31,9 +33,15 @@ class Command(BaseCommand):
     host_port = host + ":" + str(port)
     period = settings.FAILOVER_FRAMEWORK_PERIOD
 
+    # the statistics are maintained since the raw tasks are collected
+    if not HourlyStatistics.objects.exists():
+      logger.info("Rebuild failover statistics from tasks and actions")
+      statistics.rebuild_statistics()
+
     while True:
       start_time = time.time()
       self.collect_failover_framework_metrics(host_port, mailer)
+      statistics.delete_expired_tasks()
       sleep_time = period - (time.time() - start_time)
       if sleep_time >= 0:
         logger.info("Sleep " + str(sleep_time) + " seconds for next time to collect metrics")
@@ -59,25 +67,30 @@ class Command(BaseCommand):
           # Status Metrics
         elif "ClusterHealthy" in metric:
           task_cluster_healthy = True if metric["ClusterHealthy"] else False # int to boolean
-          task_data_consistent = True if metric["DataConsistent"] else Fasle
+          task_data_consistent = True if metric["DataConsistent"] else False
           task_success = task_cluster_healthy and task_data_consistent
 
       # insert into database
       task = Task(start_timestamp=task_start_timestamp, start_time=task_start_time, action_number=task_action_number, cluster_healthy=task_cluster_healthy, data_consistent=task_data_consistent, success=task_success)
-      task.save()
-      logger.info("Insert Task into database which start at " + task_start_time)
-
+      actions = []
       for action_info in actions_info:
         action = Action(task_id=task_start_timestamp, start_time=task_start_time, name=action_info["name"], success=action_info["success"], consume_time=action_info["consumeTime"])
-        action.save()
-        logger.info("Insert Action into database which is " + action.name)
+        actions.append(action)
+
+      # the latest task is reported until the next one starts
+      if not statistics.insert_task(task, actions):
+        logger.info("Task which start at " + task_start_time + " has been inserted")
+        return
+      statistics.invalidate_statistics()
+      logger.info("Insert Task into database which start at " + task_start_time +
+                  " with " + str(len(actions)) + " actions")
 
       # send email
       if task_success == False:
         email_to = owl_config.FAILOVER_TO_EMAIL
         content = "Cluster healthy is " + str(task_cluster_healthy) + " and data consistent is " + str(task_data_consistent) + ".\nGo to owl for more details."
         logger.warning("Failover test fails, send email to " + email_to)
-        mailer.send_email(content, "Failover Test Fails", to_mail)
+        mailer.send_email(content, "Failover Test Fails", email_to)
 
     except:
-      logger.warning("Can't get metrics from " + host_port + ", maybe failover framework is not running")
+      logger.exception("Can't get metrics from " + host_port + ", maybe failover framework is not running")
@@ -16,4 +16,14 @@ class Action(models.Model):
   name = models.CharField(max_length=256)
   success = models.BooleanField()
   consume_time = models.IntegerField()
-  
+
+# The number of tasks and actions started in an hour, maintained by
+# failover_framework_collect when a task is inserted, so the statistics
+# don't scan the raw tasks and actions.
+class HourlyStatistics(models.Model):
+  # the start of the hour in ms
+  hour_timestamp = models.BigIntegerField(primary_key=True)
+  task_number = models.IntegerField(default=0)
+  fail_task_number = models.IntegerField(default=0)
+  action_number = models.IntegerField(default=0)
+  fail_action_number = models.IntegerField(default=0)
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#
+# Hourly rollups of failover tasks and actions.
+#
+# A task and its actions are inserted together with the counters of their
+# hour, and the statistics of all periods are summed from the rollups in
+# one query. The raw tasks and actions are kept for
+# FAILOVER_FRAMEWORK_RETENTION days.
+import time
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.db import transaction
+from django.db.models import F
+
+from models import Action
+from models import HourlyStatistics
+from models import Task
+
+# in ms
+HOUR = 3600000 # 60*60*1000
+
+# the statistics periods and their length in ms, None for total
+PERIODS = [
+  ("hour", HOUR),
+  ("day", 86400000), # 24*60*60*1000
+  ("week", 604800000), # 7*24*60*60*1000
+  ("month", 2592000000), # 30*24*60*60*1000
+  ("year", 31536000000), # 365*24*60*60*1000
+  ("total", None),
+]
+
+COUNTERS = ["task_number", "fail_task_number", "action_number",
+            "fail_action_number"]
+
+STATISTICS_CACHE_KEY = "failover:statistics"
+
+def get_hour_timestamp(timestamp):
+  return timestamp - timestamp % HOUR
+
+def add_to_statistics(hour_timestamp, counts):
+  """
+  Add counts, a dict from counter to number, to the statistics of an hour.
+  """
+  HourlyStatistics.objects.get_or_create(hour_timestamp=hour_timestamp)
+  HourlyStatistics.objects.filter(hour_timestamp=hour_timestamp).update(
+    **dict((counter, F(counter) + number) for counter, number in counts.iteritems()))
+
+def insert_task(task, actions):
+  """
+  Insert a task with its actions and count them, return False if the task
+  has been inserted.
+  """
+  with transaction.atomic():
+    if Task.objects.filter(start_timestamp=task.start_timestamp).exists():
+      return False
+    task.save(force_insert=True)
+    Action.objects.bulk_create(actions)
+    add_to_statistics(get_hour_timestamp(task.start_timestamp), {
+      "task_number": 1,
+      "fail_task_number": 0 if task.success else 1,
+      "action_number": len(actions),
+      "fail_action_number": len([action for action in actions if not action.success]),
+    })
+  return True
+
+def rebuild_statistics():
+  """
+  Rebuild the statistics from the raw tasks and actions.
+  """
+  statistics = {}
+  for start_timestamp, success in Task.objects.values_list("start_timestamp", "success"):
+    counts = statistics.setdefault(get_hour_timestamp(start_timestamp),
+                                   dict((counter, 0) for counter in COUNTERS))
+    counts["task_number"] += 1
+    counts["fail_task_number"] += 0 if success else 1
+  for task_id, success in Action.objects.values_list("task_id", "success"):
+    counts = statistics.setdefault(get_hour_timestamp(task_id),
+                                   dict((counter, 0) for counter in COUNTERS))
+    counts["action_number"] += 1
+    counts["fail_action_number"] += 0 if success else 1
+
+  with transaction.atomic():
+    HourlyStatistics.objects.all().delete()
+    HourlyStatistics.objects.bulk_create([
+      HourlyStatistics(hour_timestamp=hour_timestamp, **counts)
+      for hour_timestamp, counts in statistics.iteritems()])
+
+def delete_expired_tasks(now=None):
+  """
+  Delete the raw tasks and actions older than the retention, the statistics
+  are kept.
+  """
+  now = now or time.time() * 1000
+  expire_timestamp = now - settings.FAILOVER_FRAMEWORK_RETENTION * 86400000
+  with transaction.atomic():
+    Action.objects.filter(task_id__lt=expire_timestamp).delete()
+    Task.objects.filter(start_timestamp__lt=expire_timestamp).delete()
+
+def compute_statistics(rows, now):
+  """
+  Sum the statistics of periods from rows of (hour_timestamp, counters...).
+  The hour including the start of a period is counted in the period.
+  Return a dict from "<period>_<counter>" to number.
+  """
+  result = dict(("%s_%s" % (period, counter), 0)
+                for period, length in PERIODS for counter in COUNTERS)
+  for row in rows:
+    hour_timestamp = row[0]
+    for period, length in PERIODS:
+      if length is not None and hour_timestamp + HOUR <= now - length:
+        continue
+      for counter, number in zip(COUNTERS, row[1:]):
+        result["%s_%s" % (period, counter)] += number
+  return result
+
+def get_statistics():
+  """
+  Return the statistics of all periods, cached for a collection period.
+  """
+  cache = get_cache(settings.VIEW_CACHE_ALIAS)
+  result = cache.get(STATISTICS_CACHE_KEY)
+  if result is None:
+    rows = HourlyStatistics.objects.values_list("hour_timestamp", *COUNTERS)
+    result = compute_statistics(rows, time.time() * 1000)
+    cache.set(STATISTICS_CACHE_KEY, result, settings.FAILOVER_FRAMEWORK_PERIOD)
+  return result
+
+def invalidate_statistics():
+  get_cache(settings.VIEW_CACHE_ALIAS).delete(STATISTICS_CACHE_KEY)
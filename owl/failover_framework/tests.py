@@ -1,3 +1,34 @@
-from django.test import TestCase
+from django.test import SimpleTestCase
 
-# Create your tests here.
+from statistics import HOUR, compute_statistics, get_hour_timestamp
+
+class StatisticsTest(SimpleTestCase):
+  def test_hour_timestamp(self):
+    self.assertEqual(get_hour_timestamp(3 * HOUR + 1234), 3 * HOUR)
+    self.assertEqual(get_hour_timestamp(3 * HOUR), 3 * HOUR)
+
+  def test_compute_statistics(self):
+    now = 1000 * HOUR + 100
+    rows = [
+      # the current hour
+      (1000 * HOUR, 2, 1, 10, 1),
+      # the hour including the start of the last hour
+      (999 * HOUR, 1, 0, 5, 0),
+      (998 * HOUR, 1, 1, 3, 2),
+      # two days ago
+      (952 * HOUR, 4, 0, 20, 0),
+    ]
+    result = compute_statistics(rows, now)
+    self.assertEqual(result['hour_task_number'], 3)
+    self.assertEqual(result['hour_fail_task_number'], 1)
+    self.assertEqual(result['hour_action_number'], 15)
+    self.assertEqual(result['day_task_number'], 4)
+    self.assertEqual(result['day_fail_action_number'], 3)
+    self.assertEqual(result['week_task_number'], 8)
+    self.assertEqual(result['total_action_number'], 38)
+    self.assertEqual(result['year_fail_task_number'], 2)
+
+  def test_no_statistics(self):
+    result = compute_statistics([], HOUR)
+    self.assertEqual(result['total_task_number'], 0)
+    self.assertEqual(len(result), 24)
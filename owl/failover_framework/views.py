@@ -13,6 +13,7 @@ from django.template import RequestContext, Context, loader
 
 from models import Action
 from models import Task
+from statistics import get_statistics
 
 # /failover/
 def index(request):
@@ -20,37 +21,6 @@ def index(request):
   current_time = time.time() * 1000 # in ms
   now = datetime.datetime.now()
   today_first_timestamp = current_time - ((now.hour*60 + now.minute)*60 + now.second)*1000
-  previous_hour = current_time - 3600000 # 60*60*1000
-  previous_day = current_time - 86400000 # 24*60*60*1000
-  previous_week = current_time - 604800000 # 7*24*60*60*1000
-  previous_month = current_time - 2592000000 # 30*24*60*60*100
-  previous_year = current_time - 31536000000 # 365*24*60*60*1000
-
-  hour_task_number = Task.objects.filter(start_timestamp__gt=previous_hour).count()
-  hour_fail_task_number = Task.objects.filter(start_timestamp__gt=previous_hour, success=False).count()
-  hour_action_number = Action.objects.filter(task_id__gt=previous_hour).count()
-  hour_fail_action_number = Action.objects.filter(task_id__gt=previous_hour, success=False).count()
-  day_task_number = Task.objects.filter(start_timestamp__gt=previous_day).count()
-  day_fail_task_number = Task.objects.filter(start_timestamp__gt=previous_day, success=False).count()
-  day_action_number = Action.objects.filter(task_id__gt=previous_day).count()
-  day_fail_action_number = Action.objects.filter(task_id__gt=previous_day, success=False).count()
-  week_task_number = Task.objects.filter(start_timestamp__gt=previous_week).count()
-  week_fail_task_number = Task.objects.filter(start_timestamp__gt=previous_week, success=False).count()
-  week_action_number = Action.objects.filter(task_id__gt=previous_week).count()
-  week_fail_action_number = Action.objects.filter(task_id__gt=previous_week, success=False).count()
-  month_task_number = Task.objects.filter(start_timestamp__gt=previous_month).count()
-  month_fail_task_number = Task.objects.filter(start_timestamp__gt=previous_month, success=False).count()
-  month_action_number = Action.objects.filter(task_id__gt=previous_month).count()
-  month_fail_action_number = Action.objects.filter(task_id__gt=previous_month, success=False).count()
-  year_task_number = Task.objects.filter(start_timestamp__gt=previous_year).count()
-  year_fail_task_number = Task.objects.filter(start_timestamp__gt=previous_year, success=False).count()
-  year_action_number = Action.objects.filter(task_id__gt=previous_year).count()
-  year_fail_action_number = Action.objects.filter(task_id__gt=previous_year, success=False).count()
-  total_task_number = Task.objects.count()
-  total_fail_task_number = Task.objects.filter(success=False).count()
-  total_action_number = Action.objects.count()
-  total_fail_action_number = Action.objects.filter(success=False).count()
-
   today_tasks = Task.objects.filter(start_timestamp__gt=today_first_timestamp)
   context = {
     "chart_id": "today_tasks",
@@ -76,31 +46,9 @@ def index(request):
     "failover_task_chart": failover_task_chart,
     "is_running": is_running,
     "host_port": host_port,
-    "hour_task_number": hour_task_number,
-    "hour_fail_task_number": hour_fail_task_number,
-    "hour_action_number": hour_action_number,
-    "hour_fail_action_number": hour_fail_action_number,
-    "day_task_number": day_task_number,
-    "day_fail_task_number": day_fail_task_number,
-    "day_action_number": day_action_number,
-    "day_fail_action_number": day_fail_action_number,
-    "week_task_number": week_task_number,
-    "week_fail_task_number": week_fail_task_number,
-    "week_action_number": week_action_number,
-    "week_fail_action_number": week_fail_action_number,
-    "month_task_number": month_task_number,
-    "month_fail_task_number": month_fail_task_number,
-    "month_action_number": month_action_number,
-    "month_fail_action_number": month_fail_action_number,
-    "year_task_number": year_task_number,
-    "year_fail_task_number": year_fail_task_number,
-    "year_action_number": year_action_number,
-    "year_fail_action_number": year_fail_action_number,
-    "total_task_number": total_task_number,
-    "total_fail_task_number": total_fail_task_number,
-    "total_action_number": total_action_number,
-    "total_fail_action_number": total_fail_action_number,
     }
+  # eg: hour_task_number, total_fail_action_number
+  context.update(get_statistics())
   return render_to_response("index.html", context, context_instance=RequestContext(request))
 
 def paging_objects(request, objects, number):
@@ -0,0 +1,28 @@
+# Gunicorn config of the production serving mode of owl monitor, see
+# run_gunicorn.sh. The settings could be overrided by environment variables.
+import multiprocessing
+import os
+
+bind = os.getenv('OWL_MONITOR_BIND', '0.0.0.0:8000')
+# a slow view only blocks one thread of a worker
+workers = int(os.getenv('OWL_MONITOR_WORKERS', multiprocessing.cpu_count() + 1))
+# at most API_LONG_POLL_MAX_WAITING threads of a worker wait for long-polls
+threads = int(os.getenv('OWL_MONITOR_THREADS', 8))
+# load the application before forking workers, so workers share its memory
+# and start quickly
+preload_app = True
+# must be longer than API_LONG_POLL_TIMEOUT
+timeout = 120
+graceful_timeout = 60
+# restart workers periodically to limit the memory growth of them
+max_requests = 10000
+# the master process, send it SIGHUP to reload gracefully
+pidfile = os.getenv('OWL_MONITOR_PID_FILE')
+accesslog = '-'
+errorlog = '-'
+
+def post_fork(server, worker):
+  # never share db connections opened by the master with workers
+  from django.db import connections
+  for connection in connections.all():
+    connection.close()
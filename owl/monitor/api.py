@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+#
+# JSON api of owl pages, with long-poll deltas.
+#
+# The rows of a cluster only change once per collector cycle. A client
+# passes the cycle it has seen as 'since', the request waits at most 'wait'
+# seconds for a newer cycle, and then returns the rows changed since that
+# cycle only. Snapshots of every cycle are kept in the view cache, if the
+# snapshot of 'since' has been evicted, all rows are returned with
+# 'full' set.
+#
+# A waiting request holds a thread of the web worker, so at most
+# API_LONG_POLL_MAX_WAITING requests wait at once in a worker, the others
+# return no change at once and the clients poll again.
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseBadRequest, Http404
+from django.utils import formats
+from django.utils import timezone
+
+import dbutil
+import view_cache
+
+logger = logging.getLogger(__name__)
+
+# in seconds
+POLL_INTERVAL = 1
+
+# the number of long-poll requests waiting in the process
+waiting = 0
+waiting_lock = threading.Lock()
+
+def format_time(value):
+  return formats.date_format(timezone.localtime(value), 'DATETIME_FORMAT')
+
+def get_status(item):
+  return {
+    'health': item.health,
+    'last_status': item.last_status,
+    'last_message': item.last_message,
+    'last_success_time': format_time(item.last_success_time),
+  }
+
+def get_task_rows(cluster):
+  rows = {}
+  for task in dbutil.get_tasks_by_cluster(cluster.id):
+    row = get_status(task)
+    row.update({
+      'id': task.id,
+      'job': task.job.name,
+      'job_id': task.job.id,
+      'task_id': task.task_id,
+      'host': task.host,
+      'port': task.port,
+    })
+    rows[task.id] = row
+  return rows
+
+def get_job_rows(cluster):
+  rows = {}
+  for job in dbutil.get_jobs_by_cluster(cluster.id):
+    row = get_status(job)
+    row.update({
+      'id': job.id,
+      'name': job.name,
+      'running_tasks_count': job.running_tasks_count,
+      'total_tasks_count': job.total_tasks_count,
+    })
+    rows[job.id] = row
+  return rows
+
+def get_hbase_item_rows(cluster, attr):
+  rows = {}
+  for item in dbutil.get_items_on_cluster(cluster, attr, order_by='name'):
+    rows[item.id] = {
+      'id': item.id,
+      'name': str(item),
+      'memStoreSizeMB': item.memStoreSizeMB,
+      'storefileSizeMB': item.storefileSizeMB,
+      'readRequestsCountPerSec': item.readRequestsCountPerSec,
+      'writeRequestsCountPerSec': item.writeRequestsCountPerSec,
+    }
+  return rows
+
+ROWS_HANDLER = {
+  'tasks': get_task_rows,
+  'jobs': get_job_rows,
+  'tables': lambda cluster: get_hbase_item_rows(cluster, 'table'),
+  'regionservers': lambda cluster: get_hbase_item_rows(cluster, 'regionserver'),
+}
+
+def start_waiting():
+  global waiting
+  with waiting_lock:
+    if waiting >= settings.API_LONG_POLL_MAX_WAITING:
+      return False
+    waiting += 1
+    return True
+
+def stop_waiting():
+  global waiting
+  with waiting_lock:
+    waiting -= 1
+
+def wait_for_new_cycle(cluster, since, timeout):
+  deadline = time.time() + timeout
+  while True:
+    # end the transaction opened by TransactionMiddleware, or the snapshot
+    # of it never sees the new cycle.
+    transaction.commit()
+    if view_cache.get_latest_cycle(cluster.id) != since:
+      return True
+    if time.time() >= deadline:
+      return False
+    time.sleep(POLL_INTERVAL)
+
+def get_delta(cluster, name, since):
+  cache_name = 'api:' + name
+  rows = view_cache.get_or_set(cluster, cache_name,
+    lambda: ROWS_HANDLER[name](cluster))
+  old_rows = None
+  if since is not None:
+    old_rows = view_cache.get(cluster, cache_name, since)
+
+  if old_rows is None:
+    return {
+      'full': True,
+      'rows': rows.values(),
+      'removed': [],
+    }
+  return {
+    'full': False,
+    'rows': [row for id, row in rows.iteritems() if old_rows.get(id) != row],
+    'removed': [id for id in old_rows if id not in rows],
+  }
+
+def respond_json(data):
+  return HttpResponse(json.dumps(data),
+                      content_type='application/json; charset=utf8')
+
+#url: /api/cluster/$id/$name/?since=$cycle&wait=$seconds
+def show_cluster_rows(request, id, name):
+  cluster = dbutil.get_cluster(id)
+  if cluster is None or name not in ROWS_HANDLER:
+    raise Http404
+
+  try:
+    since = request.GET.get('since')
+    since = int(since) if since else None
+    wait = int(request.GET.get('wait', 0))
+  except ValueError:
+    return HttpResponseBadRequest('Invalid since or wait')
+  wait = max(0, min(wait, settings.API_LONG_POLL_TIMEOUT))
+
+  if since is not None and since == view_cache.get_cycle(cluster):
+    if not wait or not start_waiting():
+      changed = False
+    else:
+      try:
+        changed = wait_for_new_cycle(cluster, since, wait)
+      finally:
+        stop_waiting()
+    if not changed:
+      return respond_json({
+        'cycle': since,
+        'full': False,
+        'rows': [],
+        'removed': [],
+      })
+    cluster = dbutil.get_cluster(id)
+
+  result = get_delta(cluster, name, since)
+  result['cycle'] = view_cache.get_cycle(cluster)
+  result['cluster'] = get_status(cluster)
+  return respond_json(result)
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+#
+# The perf counter names of the beans of jmx metrics, shared by
+# metric_helper and cluster_rollup.
+
+# parse bean name
+# return (service, name)
+# eg:
+#   input 'hadoop:service=HBase,name=RPCStatistics-18600'
+#   return ('HBase', 'RPCStatistics-18600')
+def parse_bean_name(bean_name):
+  items= bean_name.split(':')[1].split(',')[:2]
+  return [item.split('=')[1] for item in items]
+
+# input:
+# 'ReplicationSource for 5-10.0.4.172%2C11600%2C1364508024855'
+# return 5-bak
+# input:
+# 'ReplicationSource for 5'
+# return 5
+def parse_replication_source(name):
+  fields = name.split('-')
+  source_name = fields[0]
+  try:
+    source_num = source_name.split(' ')[2]
+    if len(fields) > 1:
+      return source_num + '-bak'
+    else:
+      return source_num
+  except:
+    return source_name
+
+# the suffix of the perf counter keys of the metrics of a bean, the
+# replication source for replication beans
+def form_perf_counter_key_suffix(bean_name):
+  service, name = parse_bean_name(bean_name)
+  if service == 'Replication':
+    return '-' + parse_replication_source(name)
+  return ''
+
+def form_perf_counter_key_name(bean_name, metric_name):
+  # illegal perf counter char '~' exsit in hbase table metric.
+  # replace it with '-'
+  # eg:tbl.miliao_summary.cf.S~T.multiput_AvgTime
+  #    to tbl.miliao_summary.cf.S-T.multiput_AvgTime
+  metric_name += form_perf_counter_key_suffix(bean_name)
+  return metric_name.replace('~', '-')
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+#
+# Benchmark the pages of owl through the django test client.
+#
+# Every page is requested a number of times, and its latency percentiles and
+# sql query count are compared with a stored baseline. A page regresses if
+# it issues more queries than its baseline, or its p95 latency exceeds the
+# baseline by the latency tolerance.
+import json
+import time
+
+from django.conf import settings
+from django.core.urlresolvers import get_resolver
+from django.test.client import Client
+
+from business import views as business_views
+from business_view_config import ONLINE_METRICS_COUNTER_CONFIG
+from business_view_config import ONLINE_METRICS_MENU_CONFIG
+from failover_framework import views as failover_views
+from hbase import views as hbase_views
+from models import Cluster, Job, Task, Table, RegionServer, Quota
+from owl.middleware import QUERY_COUNT_HEADER
+import api
+import views
+
+# the views not benchmarked, which change the data or proxy tsdb
+SKIPPED_VIEWS = set([
+  views.add_counter,
+  views.add_table_count_rows,
+  views.cancel_table_count_rows,
+  views.show_tsdb_query,
+])
+
+def get_online_url(fleet):
+  # the online metrics depend on the business config of the deployment
+  for name, path in ONLINE_METRICS_MENU_CONFIG.get('Online Read', []):
+    access_type, label = path.split('/', 1)
+    if label in ONLINE_METRICS_COUNTER_CONFIG.get('Online ' + access_type, {}):
+      return '/business/1/%s/%s' % (access_type, label)
+  return None
+
+# [(name, view, url function), ...], the url function returns the url of the
+# page in a fleet, or None if the fleet doesn't have the page.
+BENCHMARK_PAGES = [
+  ('index', views.index, lambda f: '/monitor/'),
+  ('metrics', views.show_all_metrics, lambda f: '/monitor/metrics/'),
+  ('metrics_config', views.show_all_metrics_config,
+   lambda f: '/monitor/metrics_config/'),
+  ('local_tsdb_query', views.show_local_tsdb_query,
+   lambda f: settings.LOCAL_TSDB_ENABLED and
+     '/monitor/local_tsdb/query/?m=sum:CapacityGB{group=HdfsCluster}' or None),
+  ('api_tasks', api.show_cluster_rows,
+   lambda f: '/monitor/api/cluster/%d/tasks/' % f['hbase'].id),
+  ('counters', views.show_all_counters, lambda f: '/monitor/counters/'),
+  ('service', views.show_service,
+   lambda f: '/monitor/service/%d/' % f['hbase'].service_id),
+  ('cluster', views.show_cluster, lambda f: '/monitor/cluster/%d/' % f['hbase'].id),
+  ('hbase_task_board', views.show_cluster_task_board,
+   lambda f: '/monitor/cluster/%d/task/' % f['hbase'].id),
+  ('hdfs_task_board', views.show_cluster_task_board,
+   lambda f: '/monitor/cluster/%d/task/' % f['hdfs'].id),
+  ('hdfs_user_board', views.show_cluster_user_board,
+   lambda f: '/monitor/cluster/%d/user/' % f['hdfs'].id),
+  ('quota_total_board', views.show_quota_total_board,
+   lambda f: '/monitor/cluster/%d/total/' % f['hdfs'].id),
+  ('hbase_basic_board', views.show_cluster_basic_board,
+   lambda f: '/monitor/cluster/%d/basic/' % f['hbase'].id),
+  ('hbase_table_board', views.show_cluster_table_board,
+   lambda f: '/monitor/cluster/%d/table/' % f['hbase'].id),
+  ('hbase_regionserver_board', views.show_cluster_regionserver_board,
+   lambda f: '/monitor/cluster/%d/regionserver/' % f['hbase'].id),
+  ('hbase_replication', views.show_cluster_replication,
+   lambda f: '/monitor/cluster/%d/replication/' % f['hbase'].id),
+  ('storm_builtin_metrics', views.show_cluster_storm_builtin_metrics,
+   lambda f: '/monitor/cluster/%d/builtin_metrics/?type=Spout' % f['storm'].id),
+  ('storm_system_metrics', views.show_cluster_storm_system_metrics,
+   lambda f: '/monitor/cluster/%d/system_metrics/' % f['storm'].id),
+  ('storm_user_metrics', views.show_cluster_storm_user_metrics,
+   lambda f: '/monitor/cluster/%d/user_metrics/' % f['storm'].id),
+  ('storm_topology', views.show_storm_topology,
+   lambda f: '/monitor/cluster/%d/topology/?topology_id=fleet-topology-0' % f['storm'].id),
+  ('job', views.show_job, lambda f: '/monitor/job/%d/' % f['job'].id),
+  ('task', views.show_task, lambda f: '/monitor/task/%d/' % f['task'].id),
+  ('tables', views.show_all_tables, lambda f: '/monitor/table/'),
+  ('table', views.show_table, lambda f: '/monitor/table/%d/' % f['table'].id),
+  ('table_operation', views.show_table_operation,
+   lambda f: '/monitor/table/operation/%d/' % f['table'].id),
+  ('table_count_rows', views.show_table_count_rows,
+   lambda f: '/monitor/table/count_rows/'),
+  ('cluster_operation', views.show_cluster_operation,
+   lambda f: '/monitor/cluster/operation/%d/' % f['hbase'].id),
+  ('cluster_operation_table_comparison', views.show_cluster_operation_table_comparison,
+   lambda f: '/monitor/cluster/operation/tablecomparsion/%d/' % f['hbase'].id),
+  ('regionserver', views.show_regionserver,
+   lambda f: '/monitor/regionserver/%d/' % f['regionserver'].id),
+  ('user_quota', views.show_user_quota,
+   lambda f: f['quota'] and '/monitor/user/%d/' % f['quota'].id),
+  ('regionserver_operation', views.show_regionserver_operation,
+   lambda f: '/monitor/regionserver/operation/%d/' % f['regionserver'].id),
+  ('business_index', business_views.index, lambda f: '/business/'),
+  ('business_online', business_views.show_online, get_online_url),
+  ('business', business_views.show_business, lambda f: '/business/2/Write/HBase'),
+  ('hbase_index', hbase_views.index, lambda f: '/hbase/'),
+  ('longhaul', hbase_views.show_longhaul, lambda f: '/hbase/longhaul/1/'),
+  ('failover_index', failover_views.index, lambda f: '/failover/'),
+  ('failover_actions', failover_views.show_actions, lambda f: '/failover/action/'),
+  ('failover_tasks', failover_views.show_tasks, lambda f: '/failover/task/'),
+]
+
+def get_url_views(resolver=None):
+  """
+  Return the views of all url patterns under the root urlconf.
+  """
+  resolver = resolver or get_resolver(None)
+  result = set()
+  for pattern in resolver.url_patterns:
+    if hasattr(pattern, 'url_patterns'):
+      result |= get_url_views(pattern)
+    else:
+      result.add(pattern.callback)
+  return result
+
+def get_uncovered_views():
+  """
+  Return the names of views of monitor, business, hbase and failover apps
+  which aren't benchmarked nor skipped.
+  """
+  covered = set(view for name, view, url_func in BENCHMARK_PAGES) | SKIPPED_VIEWS
+  apps = ('monitor.', 'business.', 'hbase.', 'failover_framework.')
+  return sorted('%s.%s' % (view.__module__, view.__name__)
+                for view in get_url_views()
+                if view not in covered and view.__module__.startswith(apps))
+
+def get_fleet():
+  """
+  Return the objects the pages are benchmarked on, the first cluster of
+  every service, the regionserver job of the hbase cluster, etc.
+  """
+  fleet = {}
+  for service_name in ('hdfs', 'hbase', 'storm'):
+    fleet[service_name] = Cluster.objects.filter(
+      service__name=service_name).order_by('id')[0]
+  fleet['job'] = Job.objects.filter(cluster=fleet['hbase'],
+    name='regionserver')[0]
+  fleet['task'] = Task.objects.filter(job=fleet['job']).order_by('id')[0]
+  fleet['table'] = Table.objects.filter(cluster=fleet['hbase']).order_by('id')[0]
+  fleet['regionserver'] = RegionServer.objects.filter(
+    cluster=fleet['hbase']).order_by('id')[0]
+  quotas = Quota.objects.filter(cluster=fleet['hdfs']).order_by('id')[:1]
+  fleet['quota'] = quotas[0] if quotas else None
+  return fleet
+
+def percentile(values, q):
+  values = sorted(values)
+  position = (len(values) - 1) * q
+  lower = int(position)
+  upper = min(lower + 1, len(values) - 1)
+  return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+def benchmark_page(client, url, repeat):
+  latencies = []
+  query_count = 0
+  status_code = None
+  for i in range(repeat):
+    start_time = time.time()
+    response = client.get(url)
+    latencies.append(time.time() - start_time)
+    status_code = response.status_code
+    query_count = max(query_count, int(response.get(QUERY_COUNT_HEADER, 0)))
+  return {
+    'url': url,
+    'status_code': status_code,
+    'query_count': query_count,
+    'p50': percentile(latencies, 0.5),
+    'p95': percentile(latencies, 0.95),
+    'p99': percentile(latencies, 0.99),
+  }
+
+def run_benchmark(repeat, pages=None, client=None):
+  """
+  Benchmark the pages, all pages by default. Return a dict from page name to
+  its result.
+  """
+  client = client or Client()
+  fleet = get_fleet()
+  results = {}
+  for name, view, url_func in BENCHMARK_PAGES:
+    if pages and name not in pages:
+      continue
+    url = url_func(fleet)
+    if url is None:
+      continue
+    results[name] = benchmark_page(client, url, repeat)
+  return results
+
+def compare_with_baseline(results, baseline, latency_tolerance):
+  """
+  Return the regressions of results against the baseline as messages.
+  """
+  regressions = []
+  for name, result in sorted(results.iteritems()):
+    if result['status_code'] >= 400:
+      regressions.append('%s: status %d' % (name, result['status_code']))
+    if name not in baseline:
+      continue
+    expected = baseline[name]
+    if result['query_count'] > expected['query_count']:
+      regressions.append('%s: %d queries, baseline %d' % (
+        name, result['query_count'], expected['query_count']))
+    if result['p95'] > expected['p95'] * (1 + latency_tolerance):
+      regressions.append('%s: p95 %.3fs, baseline %.3fs' % (
+        name, result['p95'], expected['p95']))
+  return regressions
+
+def load_baseline(path):
+  with open(path) as baseline_file:
+    return json.load(baseline_file)
+
+def save_baseline(path, results):
+  with open(path, 'w') as baseline_file:
+    json.dump(results, baseline_file, indent=2, sort_keys=True)
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+#
+# Cluster-wide rollups of the metrics of hdfs datanodes and yarn
+# nodemanagers.
+#
+# The rollups are summed from the metrics of running tasks by the status
+# updater once per cycle, read from the status metrics the collector selects
+# when it decodes the task metrics, saved in ClusterSummary and exported as
+# perf counters of the cluster endpoint, so pages query one series instead
+# of summing the series of every task in opentsdb.
+#
+# When the task metrics are exported to tsdb by the collector, the metrics
+# of the job pages are also aggregated over the healthy tasks of a job, and
+# pushed as the job series of the cluster endpoint.
+import calendar
+
+import metric_view_config
+
+from bean_name import form_perf_counter_key_name
+from bean_name import parse_bean_name
+
+SUM = 'sum'
+# the per second rate of a counter summed over tasks
+RATE = 'rate'
+
+GB = 1024.0 ** 3
+
+# the perf counter group of rollups of a service
+ROLLUP_GROUPS = {
+  'hdfs': 'HdfsCluster',
+  'yarn': 'YarnCluster',
+}
+
+# service -> [(name, job, group, metric, unit, aggregation, scale), ...], where
+# group is the service in the bean name of the metric, see
+# bean_name.parse_bean_name
+ROLLUP_METRICS = {
+  'hdfs': [
+    ('CapacityGB', 'datanode', 'DataNode', 'Capacity', 'GB', SUM, 1 / GB),
+    ('DfsUsedGB', 'datanode', 'DataNode', 'DfsUsed', 'GB', SUM, 1 / GB),
+    ('RemainingGB', 'datanode', 'DataNode', 'Remaining', 'GB', SUM, 1 / GB),
+    ('BytesReadPerSec', 'datanode', 'DataNode', 'BytesRead', 'byte(s)', RATE, 1),
+    ('BytesWrittenPerSec', 'datanode', 'DataNode', 'BytesWritten', 'byte(s)', RATE, 1),
+    ('BlocksReadPerSec', 'datanode', 'DataNode', 'BlocksRead', 'block(s)', RATE, 1),
+    ('BlocksWrittenPerSec', 'datanode', 'DataNode', 'BlocksWritten', 'block(s)', RATE, 1),
+  ],
+  'yarn': [
+    ('AllocatedContainers', 'nodemanager', 'NodeManager', 'AllocatedContainers', 'container(s)', SUM, 1),
+    ('ContainersRunning', 'nodemanager', 'NodeManager', 'ContainersRunning', 'container(s)', SUM, 1),
+    ('AllocatedGB', 'nodemanager', 'NodeManager', 'AllocatedGB', 'GB', SUM, 1),
+    ('AvailableGB', 'nodemanager', 'NodeManager', 'AvailableGB', 'GB', SUM, 1),
+    ('AllocatedVCores', 'nodemanager', 'NodeManager', 'AllocatedVCores', 'core(s)', SUM, 1),
+    ('AvailableVCores', 'nodemanager', 'NodeManager', 'AvailableVCores', 'core(s)', SUM, 1),
+    ('ContainersLaunchedPerSec', 'nodemanager', 'NodeManager', 'ContainersLaunched', 'container(s)', RATE, 1),
+  ],
+}
+
+# the aggregations of job series, and the ones shown on job pages
+JOB_SERIES_AGGREGATIONS = ['sum', 'avg', 'max']
+JOB_VIEW_AGGREGATIONS = ['avg', 'max']
+
+def get_rollup_metrics(service_name):
+  return ROLLUP_METRICS.get(service_name, [])
+
+def get_rollup_metrics_of_job(service_name, job_name):
+  return [rollup for rollup in get_rollup_metrics(service_name)
+          if rollup[1] == job_name]
+
+def get_task_metric(metrics, group, metric):
+  """
+  Sum a metric of all beans of the group in the decoded metrics of a task,
+  a datanode reports one FSDatasetState bean per storage.
+  """
+  value = 0
+  for bean_name, bean_metrics in metrics.iteritems():
+    if metric not in bean_metrics:
+      continue
+    try:
+      if parse_bean_name(bean_name)[0] != group:
+        continue
+    except IndexError:
+      continue
+    if type(bean_metrics[metric]) in (int, long, float):
+      value += bean_metrics[metric]
+  return value
+
+def compute_rollups(service_name, job_metrics, previous, update_time):
+  """
+  Compute the rollups of a cluster.
+
+  job_metrics: dict from job name to a list of (healthy, metrics) of its
+    active tasks. Gauges are summed over the healthy tasks, and rates over
+    all tasks, so a task missing a cycle doesn't make the counter jump.
+  previous: dict from rollup name to (total, last_update_time) of the
+    previous cycle
+  Return a list of (name, value, total, unit), the total is the sum of the
+  counter for rates.
+  """
+  rollups = []
+  timestamp = calendar.timegm(update_time.utctimetuple())
+  for name, job, group, metric, unit, aggregation, scale in \
+      get_rollup_metrics(service_name):
+    total = sum(get_task_metric(metrics, group, metric)
+                for healthy, metrics in job_metrics.get(job, [])
+                if healthy or aggregation == RATE)
+    value = total
+    if aggregation == RATE:
+      value = 0
+      if name in previous:
+        previous_total, previous_time = previous[name]
+        elapsed = timestamp - calendar.timegm(previous_time.utctimetuple())
+        # counters are reset when tasks restart
+        if elapsed > 0 and total >= previous_total:
+          value = (total - previous_total) / float(elapsed)
+    rollups.append((name, value * scale, total, unit))
+  return rollups
+
+def get_job_series_group(group, job_name, aggregation):
+  # eg: DataNode.datanode.max
+  return '%s.%s.%s' % (group, job_name, aggregation)
+
+def get_job_series_metrics(service_name, job_name):
+  """
+  Return the (group, key) of the metrics shown on the page of a job.
+  """
+  result = set()
+  config = metric_view_config.JOB_METRICS_VIEW_CONFIG.get(service_name, {})
+  for view_tag, view_config in config.get(job_name, []):
+    for graph_config in view_config:
+      for group, key, unit in graph_config:
+        result.add((group, key))
+  return result
+
+def get_job_series_jobs(service_name):
+  return metric_view_config.JOB_METRICS_VIEW_CONFIG.get(service_name, {}).keys()
+
+def get_task_perf_counters(metrics):
+  """
+  Return a dict from (group, key) to the value of the perf counters of the
+  decoded metrics of a task, see dbutil.generate_perf_counter.
+  """
+  counters = {}
+  for bean_name, bean_metrics in metrics.iteritems():
+    try:
+      group = parse_bean_name(bean_name)[0]
+    except IndexError:
+      continue
+    for metric_name, metric_value in bean_metrics.iteritems():
+      if type(metric_value) in (int, float):
+        key = form_perf_counter_key_name(bean_name, metric_name)
+        counters[(group, key)] = metric_value
+  return counters
+
+def compute_job_series(service_name, job_metrics):
+  """
+  Aggregate the metrics of job pages over the healthy tasks of every job.
+
+  job_metrics: dict from job name to a list of (healthy, metrics) of its
+    active tasks, as compute_rollups
+  Return a list of (group, key, value), the group is the job series group.
+  """
+  series = []
+  for job_name in get_job_series_jobs(service_name):
+    metrics = get_job_series_metrics(service_name, job_name)
+    values = {}
+    for healthy, task_metrics in job_metrics.get(job_name, []):
+      if not healthy:
+        continue
+      for metric, value in get_task_perf_counters(task_metrics).iteritems():
+        if metric in metrics:
+          values.setdefault(metric, []).append(value)
+    for (group, key), metric_values in sorted(values.iteritems()):
+      aggregated = {
+        'sum': sum(metric_values),
+        'avg': sum(metric_values) / float(len(metric_values)),
+        'max': max(metric_values),
+      }
+      for aggregation in JOB_SERIES_AGGREGATIONS:
+        series.append((get_job_series_group(group, job_name, aggregation), key,
+          aggregated[aggregation]))
+  return series
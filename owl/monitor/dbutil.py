@@ -7,30 +7,22 @@ import socket
 import struct
 import time
 
-import MySQLdb
-from DBUtils.PooledDB import PooledDB
-
 from django.conf import settings
 from django.utils import timezone
 
 from models import Service, Cluster, Quota, Job, Task, Status
 from models import Table, RegionServer, HBaseCluster, Region
-from models import Counter
+from models import Counter, Distribution, SkewSummary, ClusterSummary
+from models import StormMetrics, TaskStatusMetrics
 from django.db.models import Sum
+import cluster_rollup
+import distribution
 import metric_helper
+import storage
+import storm_metrics
 
 logger = logging.getLogger(__name__)
 
-db_settings = settings.DATABASES['default']
-# we use db connection pool to execute batch update
-DBConnectionPool = PooledDB(MySQLdb, maxusage = 10, mincached = 5,
-                            db = db_settings['NAME'],
-                            host = db_settings['HOST'],
-                            port = int(db_settings['PORT']),
-                            user = db_settings['USER'],
-                            passwd = db_settings['PASSWORD'],
-                            charset = 'utf8')
-
 def get_services():
   return Service.objects.filter(active=True).all()
 
@@ -45,12 +37,14 @@ def get_service(id):
 def get_clusters_by_service(service_id=None):
   filters = {"active": True}
   if service_id: filters["service"] = service_id
-  return Cluster.objects.filter(**filters).all().order_by('service', 'name')
+  # service boards list the jobs of every cluster
+  return Cluster.objects.filter(**filters).select_related('service').\
+      prefetch_related('job_set').order_by('service', 'name')
 
 
 def get_cluster(id):
   try:
-    return Cluster.objects.get(id=id, active=True)
+    return Cluster.objects.select_related('service').get(id=id, active=True)
   except Cluster.DoesNotExist:
     return None
 
@@ -62,37 +56,39 @@ def get_hdfs_cluster_by_name(name):
     return None
 
 def get_jobs_by_cluster(cluster_id):
-  return Job.objects.filter(cluster=cluster_id, active=True).all()
+  return Job.objects.filter(cluster=cluster_id, active=True).select_related('cluster__service')
 
 
 def get_job(id):
   try:
-    return Job.objects.get(id=id, active=True)
+    return Job.objects.select_related('cluster__service').get(id=id, active=True)
   except Job.DoesNotExist:
     return None
 
 
 def get_tasks_by_job(job_id):
-  return Task.objects.filter(job=job_id, active=True).all()
+  return Task.objects.filter(job=job_id, active=True).select_related('job__cluster__service')
 
 def get_healthy_tasks_by_job(job_id):
-  return filter(lambda x: x.health, Task.objects.filter(job=job_id, active=True).all())
+  return filter(lambda x: x.health, get_tasks_by_job(job_id))
 
 def get_tasks_by_cluster(cluster_id):
-  return Task.objects.filter(job__cluster=cluster_id, active=True).order_by('job', 'id')
+  # templates show the job of every task, join it to avoid a query per task
+  return Task.objects.filter(job__cluster=cluster_id, active=True).\
+      select_related('job__cluster__service').order_by('job', 'id')
 
 
 def get_tasks_by_service(service_id=None):
   filters = {"active": True}
   if service_id: filters["job__cluster__service"] = service_id
-  return Task.objects.filter(**filters).all()
+  return Task.objects.filter(**filters).select_related('job__cluster__service')
 
 def get_tasks_by_service_name(service_name):
   filters = {
     "active": True,
-    "job__cluster_service_name": service_name,
+    "job__cluster__service__name": service_name,
   }
-  return Task.objects.filter(**filters).all()
+  return Task.objects.filter(**filters).select_related('job__cluster__service')
 
 def get_task_by_host_and_port(host, port):
   try:
@@ -101,25 +97,9 @@ def get_task_by_host_and_port(host, port):
     host = socket.gethostbyname(host)
     return Task.objects.get(host = host, port = port)
 
-# each cluster only have no more than one storm task
-def get_storm_task_by_cluster(cluster):
-  filters = {
-    "active": True,
-    "job__name": "metricserver",
-    "job__cluster": cluster,
-  }
-  return Task.objects.filter(**filters).all()
-
-def get_storm_task():
-  filters = {
-    "active": True,
-    "job__name": "metricserver",
-  }
-  return Task.objects.filter(**filters).all()
-
 def get_task(id):
   try:
-    return Task.objects.get(id=id, active=True)
+    return Task.objects.select_related('job__cluster__service').get(id=id, active=True)
   except Task.DoesNotExist:
     return None
 
@@ -155,8 +135,7 @@ def generate_perf_counter(task):
   try:
     last_metrics = json.loads(task.last_metrics)
   except:
-    print 'Failed to parse metrics of task:', task
-    print task.last_metrics
+    logger.warning("Failed to parse metrics of task %s: %s", task, task.last_metrics)
     return result
 
   endpoint = result.setdefault(metric_helper.form_perf_counter_endpoint_name(task), {})
@@ -219,7 +198,7 @@ def generate_perf_counter_of_operation_metrics(record, group):
       counter['value'] = operation['MaxTime']
 
 def generate_perf_counter_for_table(result):
-  tables = Table.objects.filter(last_attempt_time__gte = alive_time_threshold())
+  tables = Table.objects.filter(last_attempt_time__gte = alive_time_threshold()).select_related('cluster')
   for table in tables:
     endpoint_name = map_cluster_to_endpoint(table.cluster.name)
     endpoint = result.setdefault(endpoint_name, {})
@@ -238,7 +217,7 @@ def generate_perf_counter_for_table(result):
   return result
 
 def generate_perf_counter_for_regionserver(result):
-  regionservers = RegionServer.objects.filter(last_attempt_time__gte = alive_time_threshold())
+  regionservers = RegionServer.objects.filter(last_attempt_time__gte = alive_time_threshold()).select_related('cluster')
   for regionserver in regionservers:
     endpoint_name = map_cluster_to_endpoint(regionserver.cluster.name)
     endpoint = result.setdefault(endpoint_name, {})
@@ -253,8 +232,22 @@ def generate_perf_counter_for_regionserver(result):
     counter['value'] = regionserver.writeRequestsCountPerSec
   return result
 
+def generate_perf_counter_for_cluster_summary(result):
+  summaries = ClusterSummary.objects.filter(
+    last_update_time__gte = alive_time_threshold()).select_related('cluster__service')
+  for summary in summaries:
+    endpoint_name = map_cluster_to_endpoint(summary.cluster.name)
+    endpoint = result.setdefault(endpoint_name, {})
+    group = endpoint.setdefault(
+      cluster_rollup.ROLLUP_GROUPS[summary.cluster.service.name], {})
+    counter = group.setdefault(summary.name, {})
+    counter['type'] = 0
+    counter['unit'] = summary.unit
+    counter['value'] = summary.value
+  return result
+
 def generate_perf_counter_for_cluster(result):
-  hbase_clusters = HBaseCluster.objects.all()
+  hbase_clusters = HBaseCluster.objects.select_related('cluster')
   for hbase_cluster in hbase_clusters:
     last_update_time = hbase_cluster.cluster.last_attempt_time
     # filter not recently updated cluster
@@ -296,35 +289,29 @@ def format_storm_name(name):
   return name
 
 def generate_perf_counter_for_storm(result):
-  storm_tasks = get_storm_task()
-  for storm_task in storm_tasks:
-    try:
-      json_metrics = json.loads(storm_task.last_metrics_raw)
-    except:
-      logger.warning("Failed to parse metrics of task:", storm_task)
-      return result
-
-    for storm_id , topology_metrics in json_metrics.iteritems():
-      endpoint = result.setdefault(format_storm_name(storm_id), {})
-      for group_name, group_metrics in topology_metrics.iteritems():
-        if group_name.find("STORM_SYSTEM_") == 0:
-          continue
-
-        group = endpoint.setdefault(format_storm_name(group_name), {})
-        for metrics_name, metrics in group_metrics.iteritems():
-          counter = group.setdefault(format_storm_name(metrics_name), {})
-          counter['type'] = 0
-          counter['unit'] = ''
-          counter['value'] = metrics
+  records = StormMetrics.objects.filter(last_update_time__gte = alive_time_threshold()).\
+      exclude(kind = storm_metrics.KIND_SYSTEM)
+  for record in records:
+    endpoint = result.setdefault(format_storm_name(record.storm_id), {})
+    for group_name, metrics_name, metrics in storm_metrics.iter_counters(
+        record.kind, json.loads(record.data)):
+      group = endpoint.setdefault(format_storm_name(group_name), {})
+      counter = group.setdefault(format_storm_name(metrics_name), {})
+      counter['type'] = 0
+      counter['unit'] = ''
+      counter['value'] = metrics
 
   return result
 
 def get_all_metrics():
   result = {}
-  generate_perf_counter_for_task(result)
+  # the collector pushes the task metrics to tsdb by itself
+  if not settings.TSDB_EXPORT_ENABLED:
+    generate_perf_counter_for_task(result)
   generate_perf_counter_for_table(result)
   generate_perf_counter_for_regionserver(result)
   generate_perf_counter_for_cluster(result)
+  generate_perf_counter_for_cluster_summary(result)
   generate_perf_counter_for_storm(result)
   return result
 
@@ -378,7 +365,7 @@ def aggregate_metrics(records):
       else:
         agg_records.append(first)
         first = record
-  print len(records), len(agg_records)
+  logger.debug("Aggregate %d records to %d", len(records), len(agg_records))
   return agg_records
 
 
@@ -390,13 +377,14 @@ def select_by_step(metrics, step):
 
 def get_table(id):
   try:
-    return Table.objects.get(id = id)
+    return Table.objects.select_related('cluster__service').get(id = id)
   except Table.DoesNotExist:
     return None
 
 def get_all_tables():
   try:
-    return Table.objects.all().filter(last_attempt_time__gte = alive_time_threshold(36000)).order_by('-storefileSizeMB')
+    return Table.objects.filter(last_attempt_time__gte = alive_time_threshold(36000)).\
+        select_related('cluster__service').order_by('-storefileSizeMB')
   except Table.DoesNotExist:
     return None
 
@@ -412,20 +400,21 @@ def get_items_on_cluster(cluster, attr, order_by):
 
 def get_regionserver(id):
   try:
-    return RegionServer.objects.get(id = id)
+    return RegionServer.objects.select_related('cluster__service', 'task').get(id = id)
   except RegionServer.DoesNotExist:
     return None
 
 def get_quota(id):
   try:
-    return Quota.objects.get(id = id)
+    return Quota.objects.select_related('cluster__service').get(id = id)
   except Quota.DoesNotExist:
     return None
 
 def get_regionservers_with_active_replication_metrics_by_cluster(cluster):
   return RegionServer.objects.filter(cluster = cluster,
                                      last_attempt_time__gte = alive_time_threshold(),
-                                     replication_last_attempt_time__gte = alive_time_threshold())
+                                     replication_last_attempt_time__gte = alive_time_threshold()).\
+      select_related('task')
 
 def get_region_by_regionserver_and_encodename(region_server, encodeName):
   try:
@@ -437,36 +426,119 @@ def get_region_by_table(tableObj):
   # must use last_attemp_time to filter deleted-regions
   return Region.objects.filter(table = tableObj).filter(last_attempt_time__gte = alive_time_threshold()).all()
 
+def get_fresh_distributions(owner_type, owner_id):
+  records = Distribution.objects.filter(owner_type = owner_type, owner_id = owner_id,
+                                        last_update_time__gte = alive_time_threshold())
+  return dict((record.name, distribution.decode(record.data)) for record in records)
+
 # attr should be 'regionserver' or 'table'
 def get_requests_distribution_groupby(cluster, attr):
-  items = getattr(cluster, attr+'_set').filter(last_attempt_time__gte = alive_time_threshold()).all()
-  read_requests_dist = {}
-  write_requests_dist = {}
-  for item in items:
-    read_requests_dist[str(item)] = (item.id, item.readRequestsCountPerSec)
-    write_requests_dist[str(item)] = (item.id, item.writeRequestsCountPerSec)
-
-  return (read_requests_dist, write_requests_dist)
-
-def get_requests_distribution(owner):
-  read_requests_dist = []
-  write_requests_dist = []
-  for region in owner.region_set.filter(last_attempt_time__gte = alive_time_threshold()).order_by('name'):
-    region_id = region.get_region_id()
-    read_requests_dist.append((region_id, region.readRequestsCountPerSec))
-    write_requests_dist.append((region_id, region.writeRequestsCountPerSec))
-
-  return (read_requests_dist, write_requests_dist)
-
-def get_data_distribution(owner):
-  memstore_size_dist = []
-  storefile_size_dist = []
-  for region in owner.region_set.filter(last_attempt_time__gte = alive_time_threshold()).order_by('name'):
-    region_id = region.get_region_id()
-    memstore_size_dist.append((region_id, region.memStoreSizeMB))
-    storefile_size_dist.append((region_id, region.storefileSizeMB))
-
-  return (memstore_size_dist, storefile_size_dist)
+  summaries = get_fresh_distributions('cluster_' + attr, cluster.id)
+  if len(summaries) < len(distribution.GROUP_DISTRIBUTIONS):
+    # not materialized by collector yet, summarize them from items
+    items = getattr(cluster, attr+'_set').filter(last_attempt_time__gte = alive_time_threshold()).all()
+    summaries = distribution.summarize_records(items, str,
+      distribution.GROUP_DISTRIBUTIONS, settings.DISTRIBUTION_TOP_N)
+
+  return (distribution.to_pie_dist(summaries['read_requests']),
+          distribution.to_pie_dist(summaries['write_requests']))
+
+# owner should be a table or a regionserver, return a dict from the name of
+# distribution to its summary, see distribution.REGION_DISTRIBUTIONS.
+def get_region_distributions(owner):
+  owner_type = owner.__class__.__name__.lower()
+  summaries = get_fresh_distributions(owner_type, owner.id)
+  if len(summaries) < len(distribution.REGION_DISTRIBUTIONS):
+    # not materialized by collector yet, summarize them in one scan, the
+    # foreign keys are loaded too since the related manager reads them
+    regions = owner.region_set.filter(last_attempt_time__gte = alive_time_threshold()).\
+        only('id', 'name', 'table', 'region_server',
+             *distribution.REGION_DISTRIBUTIONS.values()).order_by('name')
+    summaries = distribution.summarize_records(regions, lambda region: region.get_region_id(),
+      distribution.REGION_DISTRIBUTIONS, settings.DISTRIBUTION_TOP_N)
+  return summaries
+
+# distributions is a list of (owner_type, owner_id, name, summary)
+def save_distributions(cluster, distributions, update_time):
+  update_time = storage.format_datetime(update_time)
+  all_distributions = []
+  for owner_type, owner_id, name, summary in distributions:
+    all_distributions.append([cluster.id, owner_type, owner_id, name,
+                              update_time, distribution.encode(summary)])
+
+  storage.get_storage().upsert_rows('monitor_distribution',
+    ['cluster_id', 'owner_type', 'owner_id', 'name', 'last_update_time', 'data'],
+    ['last_update_time', 'data'], all_distributions)
+
+# owner should be a table or a regionserver
+def get_skew_summaries(owner):
+  owner_type = owner.__class__.__name__.lower()
+  return list(SkewSummary.objects.filter(owner_type = owner_type, owner_id = owner.id,
+                                         last_update_time__gte = alive_time_threshold()).order_by('name'))
+
+# summaries is a list of (owner_type, owner_id, name, summary), see
+# skew.analyze_regions
+def save_skew_summaries(cluster, summaries, update_time):
+  update_time = storage.format_datetime(update_time)
+  rows = []
+  for owner_type, owner_id, name, summary in summaries:
+    rows.append([cluster.id, owner_type, owner_id, name, update_time,
+                 summary['count'], summary['total'], summary['gini'],
+                 summary['median'], summary['p99'], summary['top_share'],
+                 summary.get('deviation', 0), summary['flagged'],
+                 json.dumps(summary['hot_regions'])])
+
+  columns = ['cluster_id', 'owner_type', 'owner_id', 'name', 'last_update_time',
+             'count', 'total', 'gini', 'median', 'p99', 'top_share',
+             'deviation', 'flagged', 'hot_regions']
+  storage.get_storage().upsert_rows('monitor_skewsummary', columns, columns[4:], rows)
+
+def get_cluster_summaries(cluster):
+  return ClusterSummary.objects.filter(cluster = cluster)
+
+# rollups is a list of (name, value, total, unit), see
+# cluster_rollup.compute_rollups
+def save_cluster_summaries(cluster, rollups, update_time):
+  update_time = storage.format_datetime(update_time)
+  rows = [[cluster.id, name, value, total, unit, update_time]
+          for name, value, total, unit in rollups]
+  storage.get_storage().upsert_rows('monitor_clustersummary',
+    ['cluster_id', 'name', 'value', 'total', 'unit', 'last_update_time'],
+    ['value', 'total', 'unit', 'last_update_time'], rows)
+
+# return a dict from task id to the status metrics of the tasks of a cluster,
+# see status_updater.select_status_metrics
+def get_task_status_metrics(cluster):
+  result = {}
+  for task_id, data in TaskStatusMetrics.objects.filter(
+      task__job__cluster = cluster).values_list('task', 'data'):
+    try:
+      result[task_id] = json.loads(data)
+    except ValueError as e:
+      logger.warning("Failed to decode status metrics of task %d: %r", task_id, e)
+  return result
+
+def save_task_status_metrics(task, metrics, update_time):
+  storage.get_storage().upsert_rows('monitor_taskstatusmetrics',
+    ['task_id', 'last_update_time', 'data'], ['last_update_time', 'data'],
+    [[task.id, storage.format_datetime(update_time), json.dumps(metrics)]])
+
+# return a list of (storm_id, data) of a kind of slices, see storm_metrics.py
+def get_storm_metrics(cluster, kind):
+  records = StormMetrics.objects.filter(cluster = cluster, kind = kind).order_by('storm_id')
+  return [(record.storm_id, json.loads(record.data)) for record in records]
+
+# slices is a list of (storm_id, kind, data), the topologies not in slices
+# are deleted.
+def save_storm_metrics(cluster, slices, update_time):
+  rows = [[cluster.id, storm_id, kind, storage.format_datetime(update_time),
+           json.dumps(data)] for storm_id, kind, data in slices]
+  storage.get_storage().upsert_rows('monitor_stormmetrics',
+    ['cluster_id', 'storm_id', 'kind', 'last_update_time', 'data'],
+    ['last_update_time', 'data'], rows)
+  # the update time is saved in seconds
+  StormMetrics.objects.filter(cluster = cluster,
+    last_update_time__lt = update_time.replace(microsecond = 0)).delete()
 
 def alive_time_threshold(threshold_in_secs = 120):
   return datetime.datetime.utcfromtimestamp(time.time() - threshold_in_secs).replace(tzinfo=timezone.utc)
@@ -546,51 +618,31 @@ def update_regions_for_region_server_metrics(regions):
   all_update_metrics = []
   for region in regions:
     update_metrics = []
-    update_metrics.append(str(region.last_operation_attempt_time).split('.')[0])
+    update_metrics.append(storage.format_datetime(region.last_operation_attempt_time))
     update_metrics.append(str(region.operationMetrics))
-    update_metrics.append(str(region.id))
+    update_metrics.append(region.id)
     all_update_metrics.append(update_metrics)
 
-  conn = None
-  try:
-    conn=DBConnectionPool.connection()
-    cur=conn.cursor()
-
-    cur.executemany('update monitor_region set last_operation_attempt_time=%s, operationMetrics=%s where id=%s', all_update_metrics)
-    conn.commit()
-    cur.close()
-  except MySQLdb.Error,e:
-    print "Mysql Error %d: %s" % (e.args[0], e.args[1])
-  finally:
-    if conn is not None:
-      conn.close()
+  storage.get_storage().update_rows('monitor_region',
+    ['last_operation_attempt_time', 'operationMetrics'], 'id', all_update_metrics)
 
 def update_regions_for_master_metrics(regions):
   all_update_metrics = []
   for region in regions:
     update_metrics = []
-    update_metrics.append(str(region.readRequestsCountPerSec))
-    update_metrics.append(str(region.writeRequestsCountPerSec))
-    update_metrics.append(str(region.last_attempt_time).split('.')[0])
-    update_metrics.append(str(region.memStoreSizeMB))
-    update_metrics.append(str(region.storefileSizeMB))
-    update_metrics.append(str(region.readRequestsCount))
-    update_metrics.append(str(region.writeRequestsCount))
-    update_metrics.append(str(region.requestsCount))
-    update_metrics.append(str(region.region_server.id))
-    update_metrics.append(str(region.id))
+    update_metrics.append(region.readRequestsCountPerSec)
+    update_metrics.append(region.writeRequestsCountPerSec)
+    update_metrics.append(storage.format_datetime(region.last_attempt_time))
+    update_metrics.append(region.memStoreSizeMB)
+    update_metrics.append(region.storefileSizeMB)
+    update_metrics.append(region.readRequestsCount)
+    update_metrics.append(region.writeRequestsCount)
+    update_metrics.append(region.requestsCount)
+    update_metrics.append(region.region_server.id)
+    update_metrics.append(region.id)
     all_update_metrics.append(update_metrics)
 
-  conn = None
-  try:
-    conn=DBConnectionPool.connection()
-    cur=conn.cursor()
-
-    cur.executemany('update monitor_region set readRequestsCountPerSec=%s, writeRequestsCountPerSec=%s, last_attempt_time=%s, memStoreSizeMB=%s, storefileSizeMB=%s, readRequestsCount=%s, writeRequestsCount=%s, requestsCount=%s, region_server_id=%s where id=%s', all_update_metrics)
-    conn.commit()
-    cur.close()
-  except MySQLdb.Error,e:
-    print "Mysql Error %d: %s" % (e.args[0], e.args[1])
-  finally:
-    if conn is not None:
-      conn.close()
+  storage.get_storage().update_rows('monitor_region',
+    ['readRequestsCountPerSec', 'writeRequestsCountPerSec', 'last_attempt_time',
+     'memStoreSizeMB', 'storefileSizeMB', 'readRequestsCount', 'writeRequestsCount',
+     'requestsCount', 'region_server_id'], 'id', all_update_metrics)
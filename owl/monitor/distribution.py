@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# Compact form of the request and data distributions shown on hbase boards.
+#
+# A distribution keeps the top N items by value, and a histogram of the
+# rest in buckets of powers of 10, so a page reads one row for a table with
+# tens of thousands of regions. The summary is encoded in json as:
+#   {
+#     "count": 20000, "sum": 1234.5,
+#     "top": [[label, id, value], ...],
+#     "histogram": [[lower, upper, count, sum], ...],
+#   }
+import json
+import math
+
+# distributions of the regions of a table or a regionserver
+REGION_DISTRIBUTIONS = {
+  'read_requests': 'readRequestsCountPerSec',
+  'write_requests': 'writeRequestsCountPerSec',
+  'memstore_size': 'memStoreSizeMB',
+  'storefile_size': 'storefileSizeMB',
+}
+
+# distributions of the tables and regionservers of a cluster
+GROUP_DISTRIBUTIONS = {
+  'read_requests': 'readRequestsCountPerSec',
+  'write_requests': 'writeRequestsCountPerSec',
+}
+
+def get_bucket(value):
+  if value < 1:
+    return 0
+  return int(math.floor(math.log10(value))) + 1
+
+def get_bucket_bounds(bucket):
+  if bucket == 0:
+    return (0, 1)
+  return (10 ** (bucket - 1), 10 ** bucket)
+
+def summarize(items, top_n):
+  """
+  Summarize a list of (label, id, value) into the compact form, the top
+  items keep their order in the list.
+  """
+  order = sorted(range(len(items)), key=lambda i: items[i][2], reverse=True)
+  buckets = {}
+  for i in order[top_n:]:
+    value = items[i][2]
+    bucket = buckets.setdefault(get_bucket(value), [0, 0])
+    bucket[0] += 1
+    bucket[1] += value
+
+  histogram = []
+  for bucket in sorted(buckets):
+    lower, upper = get_bucket_bounds(bucket)
+    histogram.append([lower, upper, buckets[bucket][0], buckets[bucket][1]])
+
+  return {
+    'count': len(items),
+    'sum': sum(item[2] for item in items),
+    'top': [list(items[i]) for i in sorted(order[:top_n])],
+    'histogram': histogram,
+  }
+
+def summarize_records(records, label_func, attrs, top_n):
+  """
+  Summarize records on every attribute of attrs in a single pass.
+  Return a dict from distribution name to summary.
+  """
+  items = dict((name, []) for name in attrs)
+  for record in records:
+    label = label_func(record)
+    for name, attr in attrs.iteritems():
+      items[name].append((label, record.id, getattr(record, attr)))
+  return dict((name, summarize(items[name], top_n))
+              for name in items)
+
+def encode(summary):
+  return json.dumps(summary)
+
+def decode(data):
+  return json.loads(data)
+
+def to_column_dist(summary):
+  """
+  Return the top items as a list of (label, value), as
+  requests_dist_column_chart.tpl expects.
+  """
+  return [(label, value) for label, id, value in summary['top']]
+
+def to_pie_dist(summary):
+  """
+  Return the top items as a dict from label to (id, value), as
+  requests_dist_pie_chart.tpl expects, with the rest merged into one item.
+  """
+  dist = dict((label, (id, value)) for label, id, value in summary['top'])
+  others = sum(bucket[3] for bucket in summary['histogram'])
+  others_count = sum(bucket[2] for bucket in summary['histogram'])
+  if others_count:
+    dist['others(%d)' % others_count] = ('', others)
+  return dist
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+#
+# Synthetic fleets of owl, to benchmark the pages at production scale.
+#
+# A fleet has FLEET_SERVICES, each with clusters of the jobs in JOB_TASKS.
+# The worker jobs have many tasks with last_metrics generated from the task
+# metrics view config, hbase clusters have tables and regions whose request
+# rates follow a pareto distribution, so some regions and tables are hot.
+import datetime
+import json
+import random
+import time
+
+from django.db import transaction
+from django.utils import timezone
+
+from business.models import Business
+from failover_framework import statistics as failover_statistics
+from failover_framework.models import Action as FailoverAction
+from failover_framework.models import Task as FailoverTask
+from hbase.models import Longhaul
+from metric_view_config import TASK_METRICS_VIEW_CONFIG
+from models import Service, Cluster, Job, Task, Quota
+from models import HBaseCluster, RegionServer, Table, Region
+import dbutil
+import storm_metrics
+
+CLUSTER_PREFIX = 'fleet'
+
+FLEET_SERVICES = ['hdfs', 'hbase', 'yarn', 'storm']
+
+# service -> [(job, is_worker), ...], a worker job has the tasks of the
+# fleet, the others have MASTER_TASKS tasks.
+JOB_TASKS = {
+  'hdfs': [('journalnode', False), ('namenode', False), ('datanode', True)],
+  'hbase': [('master', False), ('regionserver', True)],
+  'yarn': [('resourcemanager', False), ('nodemanager', True)],
+  'storm': [('nimbus', False), ('supervisor', True), ('metricserver', False)],
+}
+MASTER_TASKS = 2
+
+# the beans every task reports besides those in the view config
+COMMON_BEANS = {
+  'Hadoop:service=JvmMetrics,name=JvmMetrics': ['MemHeapUsedM',
+    'MemHeapCommittedM', 'GcCount', 'GcTimeMillis', 'ThreadsRunnable',
+    'ThreadsBlocked', 'ThreadsWaiting'],
+}
+
+BATCH_SIZE = 1000
+
+def get_cluster_name(service_name, index):
+  return '%s-%s-%d' % (CLUSTER_PREFIX, service_name, index)
+
+def get_job_beans(service_name, job_name):
+  """
+  Return the beans of a job as a dict from bean name to metric names, the
+  group of a metric in the view config is the service of its bean name.
+  """
+  beans = dict(COMMON_BEANS)
+  for view_name, graphs in TASK_METRICS_VIEW_CONFIG.get(service_name, {}).get(job_name, []):
+    for graph in graphs:
+      for group, metric, unit in graph:
+        bean_name = 'Hadoop:service=%s,name=%s' % (group, group)
+        beans.setdefault(bean_name, [])
+        if metric not in beans[bean_name]:
+          beans[bean_name].append(metric)
+  return beans
+
+def generate_task_metrics(beans, rand):
+  return json.dumps(dict((bean_name, dict(
+    (metric, rand.randint(0, 100000)) for metric in metrics))
+    for bean_name, metrics in beans.iteritems()))
+
+def generate_storm_metrics(topologies, workers, rand):
+  raw = {}
+  for i in range(topologies):
+    topology = raw.setdefault('fleet-topology-%d' % i, {})
+    topology[storm_metrics.BUILTIN_SPOUT_GROUP] = dict(
+      (key, rand.randint(0, 10000)) for key in ['__ack-count', '__fail-count',
+        '__emit-count', '__transfer-count', '__complete-latency'])
+    topology[storm_metrics.BUILTIN_BOLT_GROUP] = dict(
+      (key, rand.randint(0, 10000)) for key in ['__ack-count', '__fail-count',
+        '__emit-count', '__transfer-count', '__process-latency',
+        '__execute-count', '__execute-latency'])
+    for j in range(workers):
+      topology['%s10.1.%d.%d:6700' % (storm_metrics.SYSTEM_GROUP_PREFIX, i, j)] = {
+        'GC/ConcurrentMarkSweep': rand.randint(0, 100),
+        'memory/heap:used': rand.randint(0, 1 << 30),
+        'memory/nonHeap:used': rand.randint(0, 1 << 28),
+        'startTimeSecs': 1400000000,
+        'uptimeSecs': rand.randint(0, 100000),
+      }
+      topology['counter:%d' % j] = {'count': rand.randint(0, 10000)}
+  return raw
+
+def bulk_create(model, objects):
+  for start in range(0, len(objects), BATCH_SIZE):
+    model.objects.bulk_create(objects[start:start + BATCH_SIZE])
+
+def generate_cluster(service, index, options, rand):
+  now = timezone.now()
+  cluster = Cluster.objects.create(service=service,
+    name=get_cluster_name(service.name, index), last_status=0,
+    last_attempt_time=now, last_success_time=now,
+    version='fleet, r1', entry='fleet-%s-%d:80' % (service.name, index))
+
+  worker_tasks = []
+  for job_name, is_worker in JOB_TASKS[service.name]:
+    task_count = options['tasks'] if is_worker else MASTER_TASKS
+    job = Job.objects.create(cluster=cluster, name=job_name, last_status=0,
+      running_tasks_count=task_count, total_tasks_count=task_count,
+      last_attempt_time=now, last_success_time=now)
+    beans = get_job_beans(service.name, job_name)
+    bulk_create(Task, [Task(job=job, task_id=i,
+      host='10.%d.%d.%d' % (index, i / 256, i % 256), port=12000,
+      last_status=0, last_attempt_time=now, last_success_time=now,
+      last_metrics=generate_task_metrics(beans, rand),
+      last_metrics_raw='') for i in range(task_count)])
+    if is_worker:
+      worker_tasks = list(Task.objects.filter(job=job).order_by('task_id'))
+
+  if service.name == 'hbase':
+    generate_hbase(cluster, worker_tasks, options, rand)
+  elif service.name == 'hdfs':
+    bulk_create(Quota, [Quota(cluster=cluster, name='/user/fleet_%d' % i,
+      quota=str(1 << 20), used_quota=str(rand.randint(0, 1 << 20)),
+      remaining_quota='0', space_quota=str(1 << 40),
+      used_space_quota=str(rand.randint(0, 1 << 40)), remaining_space_quota='0',
+      last_update_time=now) for i in range(options['quotas'])])
+  elif service.name == 'storm':
+    dbutil.save_storm_metrics(cluster, storm_metrics.normalize(
+      generate_storm_metrics(options['topologies'], 10, rand)), now)
+  return cluster
+
+def generate_hbase(cluster, tasks, options, rand):
+  now = timezone.now()
+  HBaseCluster.objects.create(cluster=cluster, operationMetrics='{}',
+    readRequestsCountPerSec=rand.random() * 100000,
+    writeRequestsCountPerSec=rand.random() * 100000)
+  bulk_create(RegionServer, [RegionServer(cluster=cluster, task=task,
+    name='%s,12000,1400000000000' % task.host, last_attempt_time=now,
+    replication_last_attempt_time=now, replicationMetrics='{}')
+    for task in tasks])
+  regionservers = list(RegionServer.objects.filter(cluster=cluster).order_by('id'))
+
+  bulk_create(Table, [Table(cluster=cluster, name='fleet_table_%d' % i,
+    last_attempt_time=now, operationMetrics='{}')
+    for i in range(options['tables'])])
+  tables = list(Table.objects.filter(cluster=cluster).order_by('id'))
+  # a few tables have most regions
+  weights = [rand.paretovariate(1.2) for table in tables]
+  total_weight = sum(weights)
+
+  regions = []
+  for table, weight in zip(tables, weights):
+    count = max(1, int(options['regions'] * weight / total_weight))
+    for i in range(count):
+      region_server = regionservers[rand.randint(0, len(regionservers) - 1)]
+      encode_name = '%032x' % rand.getrandbits(128)
+      regions.append(Region(table=table, region_server=region_server,
+        name='%s,%08d,1400000000000.%s.' % (table.name, i, encode_name),
+        encodeName=encode_name, last_attempt_time=now,
+        last_operation_attempt_time=now, operationMetrics='{}',
+        readRequestsCountPerSec=rand.paretovariate(1.5),
+        writeRequestsCountPerSec=rand.paretovariate(1.5),
+        storefileSizeMB=rand.randint(0, 10240)))
+    if len(regions) >= BATCH_SIZE:
+      bulk_create(Region, regions)
+      regions = []
+  bulk_create(Region, regions)
+
+def generate_failover_tasks(count, rand):
+  now = int(time.time()) * 1000
+  for i in range(count):
+    start_timestamp = now - i * 600 * 1000
+    start_time = datetime.datetime.fromtimestamp(start_timestamp / 1000).\
+      strftime('%Y-%m-%d %H:%M:%S')
+    success = rand.random() > 0.05
+    task = FailoverTask(start_timestamp=start_timestamp, start_time=start_time,
+      action_number=3, cluster_healthy=success, data_consistent=True,
+      success=success)
+    actions = [FailoverAction(task_id=start_timestamp, start_time=start_time,
+      name='action_%d' % j, success=success, consume_time=rand.randint(1, 100))
+      for j in range(3)]
+    failover_statistics.insert_task(task, actions)
+
+def generate_fleet(options, seed=0):
+  """
+  Generate a fleet. options: the number of clusters per service, tasks per
+  worker job, tables and regions per hbase cluster, quotas per hdfs cluster,
+  topologies per storm cluster and failover tasks. Return the clusters.
+  """
+  rand = random.Random(seed)
+  clusters = []
+  with transaction.atomic():
+    for service_name in FLEET_SERVICES:
+      service, created = Service.objects.get_or_create(name=service_name,
+        defaults={'metric_url': '/jmx?qry=Hadoop:*'})
+      for index in range(options['clusters']):
+        clusters.append(generate_cluster(service, index, options, rand))
+
+    Business.objects.get_or_create(id=1, defaults={'business': 'online',
+      'cluster': get_cluster_name('hbase', 0), 'tables': 'fleet_table_0'})
+    Business.objects.get_or_create(id=2, defaults={'business': 'fleet',
+      'cluster': get_cluster_name('hbase', 0), 'tables': 'fleet_table_0'})
+    Longhaul.objects.get_or_create(id=1, defaults={
+      'cluster': get_cluster_name('hbase', 0), 'table': 'fleet_table_0',
+      'cf': 'cf'})
+  generate_failover_tasks(options['failover_tasks'], rand)
+  return clusters
@@ -0,0 +1,441 @@
+# -*- coding: utf-8 -*-
+#
+# An embedded time series store for owl, used to answer range queries of
+# recent windows without going through opentsdb.
+#
+# Each series(endpoint, group, key) owns a directory of append-only segment
+# files. A segment covers at most SEGMENT_SPAN seconds and is laid out in
+# columns, so a range query only touches the pages it needs:
+#
+#   header  : magic, base timestamp, capacity, count
+#   deltas  : uint16[capacity], timestamp offsets from the base timestamp
+#   values  : float64[capacity]
+#
+# Segments are memory-mapped and shared between processes, appends are
+# serialized with flock on the segment file. A new segment is sized and has
+# its header before it's linked into the series directory, so no process maps
+# a partial segment.
+import bisect
+import errno
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import re
+import struct
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_MAGIC = 'OWLTSDB1'
+SEGMENT_SUFFIX = '.seg'
+# magic, base timestamp, capacity, count
+SEGMENT_HEADER_FORMAT = '<8sIII'
+SEGMENT_HEADER_SIZE = 32
+SEGMENT_COUNT_OFFSET = 16
+# uint16 deltas cap the span of one segment to 65535 seconds.
+SEGMENT_SPAN = 3600
+SEGMENT_CAPACITY = 512
+SERIES_NAME_FILE = 'series'
+
+DEFAULT_RETENTION = 6 * 3600
+# the period of the collector
+DEFAULT_STEP = 10
+# max number of segments kept mapped in one process
+MAX_OPEN_SEGMENTS = 4096
+# interval to sweep the expired segments of all series, in seconds
+EXPIRE_INTERVAL = 3600
+
+AGGREGATORS = {
+  'sum': sum,
+  'avg': lambda values: float(sum(values)) / len(values),
+  'max': max,
+  'min': min,
+}
+
+def series_name(endpoint, group, key):
+  name = u'%s %s %s' % (endpoint, group, key)
+  # the name is hashed and saved in a file, which take bytes
+  return name.encode('utf-8')
+
+def create_segment(path, base_timestamp):
+  """
+  Create a segment file and return its fd. The file is sized and has its
+  header under the flock in a temporary file, which is then linked to path,
+  so other processes see either no segment or a complete one. Raise
+  OSError(EEXIST) if another process has created it.
+  """
+  fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+  try:
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    os.fchmod(fd, 0644)
+    os.ftruncate(fd, segment_size(SEGMENT_CAPACITY))
+    os.write(fd, struct.pack(SEGMENT_HEADER_FORMAT, SEGMENT_MAGIC,
+      base_timestamp, SEGMENT_CAPACITY, 0))
+    # unlike rename, link never replaces a segment created by another process.
+    os.link(temp_path, path)
+    fcntl.flock(fd, fcntl.LOCK_UN)
+  except:
+    os.close(fd)
+    raise
+  finally:
+    os.remove(temp_path)
+  return fd
+
+class Segment:
+  def __init__(self, path, base_timestamp=None):
+    self.path = path
+    if base_timestamp is not None:
+      self.fd = create_segment(path, base_timestamp)
+    else:
+      self.fd = os.open(path, os.O_RDWR)
+    try:
+      if os.fstat(self.fd).st_size < SEGMENT_HEADER_SIZE:
+        raise ValueError("Truncated segment file: %s" % path)
+      self.mm = mmap.mmap(self.fd, 0)
+    except:
+      os.close(self.fd)
+      raise
+    magic, self.base_timestamp, self.capacity, count = struct.unpack_from(
+      SEGMENT_HEADER_FORMAT, self.mm, 0)
+    if magic != SEGMENT_MAGIC:
+      self.close()
+      raise ValueError("Invalid segment file: %s" % path)
+    self.deltas_offset = SEGMENT_HEADER_SIZE
+    self.values_offset = SEGMENT_HEADER_SIZE + 2 * self.capacity
+
+  @property
+  def count(self):
+    return struct.unpack_from('<I', self.mm, SEGMENT_COUNT_OFFSET)[0]
+
+  def covers(self, timestamp):
+    return 0 <= timestamp - self.base_timestamp < SEGMENT_SPAN
+
+  def append(self, timestamp, value):
+    """Append a point, return False if the segment could not take it."""
+    fcntl.flock(self.fd, fcntl.LOCK_EX)
+    try:
+      count = self.count
+      if count >= self.capacity or not self.covers(timestamp):
+        return False
+      delta = timestamp - self.base_timestamp
+      if count > 0:
+        last_delta = struct.unpack_from('<H', self.mm,
+          self.deltas_offset + 2 * (count - 1))[0]
+        # the series is append-only, drop late and duplicated points.
+        if delta <= last_delta:
+          return True
+      struct.pack_into('<H', self.mm, self.deltas_offset + 2 * count, delta)
+      struct.pack_into('<d', self.mm, self.values_offset + 8 * count, value)
+      # publish the point only after it's written, readers rely on the count.
+      struct.pack_into('<I', self.mm, SEGMENT_COUNT_OFFSET, count + 1)
+      return True
+    finally:
+      fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+  def read(self, start, end):
+    """Return [(timestamp, value)] in [start, end]."""
+    count = self.count
+    if count == 0:
+      return []
+    deltas = struct.unpack_from('<%dH' % count, self.mm, self.deltas_offset)
+    begin = bisect.bisect_left(deltas, max(start - self.base_timestamp, 0))
+    stop = bisect.bisect_right(deltas, end - self.base_timestamp)
+    if begin >= stop:
+      return []
+    values = struct.unpack_from('<%dd' % (stop - begin), self.mm,
+      self.values_offset + 8 * begin)
+    return [(self.base_timestamp + deltas[begin + i], values[i])
+            for i in xrange(stop - begin)]
+
+  def close(self):
+    try:
+      self.mm.close()
+    finally:
+      os.close(self.fd)
+
+def segment_size(capacity):
+  return SEGMENT_HEADER_SIZE + 10 * capacity
+
+class LocalTsdb:
+  """
+  Local store of the perf counters which owl exports to opentsdb. The names
+  of endpoint, group and key are the same as the ones generated by
+  metric_helper.form_perf_counter_*.
+  """
+  def __init__(self, root, retention=DEFAULT_RETENTION, step=DEFAULT_STEP):
+    self.root = root
+    self.retention = retention
+    self.step = step
+    # series path -> latest Segment opened by this process
+    self.segments = {}
+    self.last_expire_time = 0
+
+  def series_path(self, endpoint, group, key):
+    digest = hashlib.md5(series_name(endpoint, group, key)).hexdigest()
+    return os.path.join(self.root, digest[:2], digest)
+
+  def list_segments(self, path):
+    try:
+      names = os.listdir(path)
+    except OSError as e:
+      if e.errno == errno.ENOENT:
+        return []
+      raise
+    return sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in names
+                  if name.endswith(SEGMENT_SUFFIX))
+
+  def segment_path(self, path, base_timestamp):
+    return os.path.join(path, '%d%s' % (base_timestamp, SEGMENT_SUFFIX))
+
+  def create_series(self, path, endpoint, group, key):
+    try:
+      os.makedirs(path)
+    except OSError as e:
+      if e.errno != errno.EEXIST:
+        raise
+      return
+    with open(os.path.join(path, SERIES_NAME_FILE), 'w') as name_file:
+      name_file.write(series_name(endpoint, group, key))
+
+  def open_segment(self, path, base_timestamp, create=False):
+    segment_path = self.segment_path(path, base_timestamp)
+    if create:
+      try:
+        return Segment(segment_path, base_timestamp)
+      except OSError as e:
+        # another process has created it.
+        if e.errno != errno.EEXIST:
+          raise
+    return Segment(segment_path)
+
+  def cache_segment(self, path, segment):
+    old_segment = self.segments.pop(path, None)
+    if old_segment is not None:
+      old_segment.close()
+    if len(self.segments) >= MAX_OPEN_SEGMENTS:
+      for cached in self.segments.itervalues():
+        cached.close()
+      self.segments.clear()
+    self.segments[path] = segment
+
+  def put(self, endpoint, group, key, timestamp, value):
+    timestamp = int(timestamp)
+    path = self.series_path(endpoint, group, key)
+    segment = self.segments.get(path)
+    if segment is not None and segment.append(timestamp, value):
+      return
+
+    bases = self.list_segments(path)
+    if not bases:
+      self.create_series(path, endpoint, group, key)
+    elif segment is None or segment.base_timestamp != bases[-1]:
+      # the latest segment may be rolled by another process.
+      segment = self.open_segment(path, bases[-1])
+      self.cache_segment(path, segment)
+      if segment.append(timestamp, value):
+        return
+
+    if bases and timestamp < bases[-1]:
+      # older than the latest segment, it can't be appended any more.
+      return
+    segment = self.open_segment(path, timestamp, create=True)
+    self.cache_segment(path, segment)
+    segment.append(timestamp, value)
+    self.expire_series(path, timestamp)
+
+  def put_many(self, points):
+    """points is an iterable of (endpoint, group, key, timestamp, value)."""
+    for endpoint, group, key, timestamp, value in points:
+      try:
+        self.put(endpoint, group, key, timestamp, float(value))
+      except Exception as e:
+        logger.warning("Failed to put %s/%s/%s into local tsdb: %r",
+          endpoint, group, key, e)
+
+  def read(self, endpoint, group, key, start, end):
+    path = self.series_path(endpoint, group, key)
+    points = []
+    for base_timestamp in self.list_segments(path):
+      if base_timestamp > end or base_timestamp + SEGMENT_SPAN <= start:
+        continue
+      try:
+        segment = self.open_segment(path, base_timestamp)
+      except (OSError, ValueError) as e:
+        # the segment is expired in the middle of the query.
+        logger.warning("Failed to open segment of %s/%s/%s: %r",
+          endpoint, group, key, e)
+        continue
+      try:
+        points.extend(segment.read(start, end))
+      finally:
+        segment.close()
+    return points
+
+  def query(self, series, start, end, aggregator='sum', downsample=None,
+            rate=False):
+    """
+    Query and merge a list of series (endpoint, group, key), like what
+    opentsdb does for 'aggregator:[downsample:][rate:]key{tags}'.
+
+    downsample is a tuple of (interval in seconds, aggregator name). Without
+    downsampling, the points of each series are interpolated at the multiples
+    of the step before merging, as series are collected at different times.
+    Return the sorted [(timestamp, value)].
+    """
+    merge = AGGREGATORS[aggregator]
+    buckets = {}
+    for endpoint, group, key in series:
+      points = self.read(endpoint, group, key, start, end)
+      if rate:
+        points = compute_rate(points)
+      if downsample:
+        points = downsample_points(points, downsample[0],
+          AGGREGATORS[downsample[1]])
+      else:
+        points = align_points(points, self.step)
+      for timestamp, value in points:
+        buckets.setdefault(timestamp, []).append(value)
+    return [(timestamp, merge(values))
+            for timestamp, values in sorted(buckets.iteritems())]
+
+  def expire_series(self, path, now=None):
+    now = now or time.time()
+    for base_timestamp in self.list_segments(path):
+      if base_timestamp + SEGMENT_SPAN >= now - self.retention:
+        break
+      try:
+        os.remove(self.segment_path(path, base_timestamp))
+      except OSError as e:
+        if e.errno != errno.ENOENT:
+          raise
+
+  def expire_all(self, now=None):
+    """Remove expired segments of all series, including the dead ones."""
+    if not os.path.isdir(self.root):
+      return
+    for prefix in os.listdir(self.root):
+      prefix_path = os.path.join(self.root, prefix)
+      if not os.path.isdir(prefix_path):
+        continue
+      for digest in os.listdir(prefix_path):
+        path = os.path.join(prefix_path, digest)
+        self.expire_series(path, now)
+        if not self.list_segments(path):
+          try:
+            os.remove(os.path.join(path, SERIES_NAME_FILE))
+            os.rmdir(path)
+          except OSError as e:
+            logger.warning("Failed to remove series %s: %r", path, e)
+
+  def expire_all_if_needed(self, now=None):
+    now = now or time.time()
+    if now - self.last_expire_time < EXPIRE_INTERVAL:
+      return
+    self.last_expire_time = now
+    start_time = time.time()
+    self.expire_all(now)
+    logger.info("spent %f seconds for expiring local tsdb",
+      time.time() - start_time)
+
+  def close(self):
+    for segment in self.segments.itervalues():
+      segment.close()
+    self.segments.clear()
+
+def compute_rate(points):
+  result = []
+  for index in xrange(1, len(points)):
+    last_timestamp, last_value = points[index - 1]
+    timestamp, value = points[index]
+    result.append((timestamp,
+      (value - last_value) / float(timestamp - last_timestamp)))
+  return result
+
+def downsample_points(points, interval, aggregator):
+  buckets = []
+  for timestamp, value in points:
+    bucket = timestamp - timestamp % interval
+    if buckets and buckets[-1][0] == bucket:
+      buckets[-1][1].append(value)
+    else:
+      buckets.append((bucket, [value]))
+  return [(bucket, aggregator(values)) for bucket, values in buckets]
+
+def align_points(points, step):
+  """
+  Linearly interpolate the points of a series at the multiples of step
+  between its first and last points. A single point is moved to the start
+  of its step.
+  """
+  if len(points) == 1:
+    timestamp, value = points[0]
+    return [(timestamp - timestamp % step, value)]
+  result = []
+  for index in xrange(1, len(points)):
+    last_timestamp, last_value = points[index - 1]
+    timestamp, value = points[index]
+    aligned = last_timestamp + (-last_timestamp) % step
+    while aligned < timestamp:
+      result.append((aligned, last_value + (value - last_value) *
+        (aligned - last_timestamp) / float(timestamp - last_timestamp)))
+      aligned += step
+  if points and points[-1][0] % step == 0:
+    result.append(points[-1])
+  return result
+
+# parse the metric query generated by metric_helper.make_metric_query, eg:
+#   sum:10m-avg:rate:readRequestsCountPerSec{host=dptst-example,group=Cluster}
+METRIC_QUERY_PATTERN = re.compile(
+  r'^(?P<aggregator>\w+):(?:(?P<interval>\d+)(?P<unit>[smhd])-(?P<downsample>\w+):)?'
+  r'(?P<rate>rate:)?(?P<key>[^{]+)\{(?P<tags>[^}]*)\}$')
+TIME_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+def parse_metric_query(query):
+  """
+  Parse a metric query into (series, aggregator, downsample, rate), where
+  the host tag could be a '|' separated list of endpoints.
+  """
+  match = METRIC_QUERY_PATTERN.match(query)
+  if not match:
+    raise ValueError("Invalid metric query: %s" % query)
+  tags = dict(tag.split('=', 1) for tag in match.group('tags').split(',') if tag)
+  if 'host' not in tags or 'group' not in tags:
+    raise ValueError("Metric query must have host and group tags: %s" % query)
+  for name in (match.group('aggregator'), match.group('downsample')):
+    if name and name not in AGGREGATORS:
+      raise ValueError("Unsupported aggregator: %s" % name)
+
+  series = [(endpoint, tags['group'], match.group('key'))
+            for endpoint in tags['host'].split('|')]
+  downsample = None
+  if match.group('interval'):
+    downsample = (int(match.group('interval')) * TIME_UNITS[match.group('unit')],
+                  match.group('downsample'))
+  return (series, match.group('aggregator'), downsample,
+          bool(match.group('rate')))
+
+# parse opentsdb's time format: '15m-ago' or '2013/12/18-12:00:00'
+def parse_time(value, now=None):
+  now = now or time.time()
+  match = re.match(r'^(\d+)([smhd])-ago$', value)
+  if match:
+    return int(now - int(match.group(1)) * TIME_UNITS[match.group(2)])
+  if value.isdigit():
+    return int(value)
+  return int(time.mktime(time.strptime(value, '%Y/%m/%d-%H:%M:%S')))
+
+local_tsdb = None
+
+def get_local_tsdb():
+  """Return the process wide store, or None if it's disabled."""
+  global local_tsdb
+  from django.conf import settings
+  if not settings.LOCAL_TSDB_ENABLED:
+    return None
+  if local_tsdb is None:
+    local_tsdb = LocalTsdb(settings.LOCAL_TSDB_ROOT,
+      settings.LOCAL_TSDB_RETENTION, settings.LOCAL_TSDB_STEP)
+  return local_tsdb
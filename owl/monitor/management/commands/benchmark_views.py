@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from monitor import benchmark
+
+logger = logging.getLogger(__name__)
+
+# Benchmark the latency and query count of owl pages on the fleet in the
+# database, and fail if any page regresses past the baseline, see
+# monitor/benchmark.py.
+class Command(BaseCommand):
+  help = "Benchmark owl pages against a baseline."
+
+  option_list = BaseCommand.option_list + (
+    make_option('--repeat', type='int', default=10,
+      help='The number of requests of every page'),
+    make_option('--baseline', default='benchmark_baseline.json',
+      help='The baseline file'),
+    make_option('--save_baseline', action='store_true', default=False,
+      help='Save the results as the baseline'),
+    make_option('--latency_tolerance', type='float', default=0.5,
+      help='The ratio the p95 latency of a page could exceed its baseline'),
+    make_option('--page', action='append', dest='pages',
+      help='The page to benchmark, all pages by default'),
+  )
+
+  def handle(self, *args, **options):
+    for view_name in benchmark.get_uncovered_views():
+      logger.warning("View %s isn't benchmarked", view_name)
+
+    results = benchmark.run_benchmark(options['repeat'], options['pages'])
+    for name, result in sorted(results.iteritems()):
+      self.stdout.write('%-40s %3d %5d queries  p50 %.3fs  p95 %.3fs  p99 %.3fs' % (
+        name, result['status_code'], result['query_count'],
+        result['p50'], result['p95'], result['p99']))
+
+    if options['save_baseline']:
+      benchmark.save_baseline(options['baseline'], results)
+      self.stdout.write('Saved baseline to %s' % options['baseline'])
+      return
+
+    baseline = {}
+    if os.path.exists(options['baseline']):
+      baseline = benchmark.load_baseline(options['baseline'])
+    else:
+      logger.warning("No baseline %s, only failed pages are checked",
+        options['baseline'])
+    regressions = benchmark.compare_with_baseline(results, baseline,
+      options['latency_tolerance'])
+    if regressions:
+      raise CommandError("Regressions:\n" + "\n".join(regressions))
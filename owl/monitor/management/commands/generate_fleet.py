@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from monitor import fleet
+from monitor.models import Cluster
+
+logger = logging.getLogger(__name__)
+
+# Fill the database with a synthetic fleet to benchmark owl, see
+# monitor/fleet.py. Use a database for benchmarks only.
+class Command(BaseCommand):
+  help = "Generate a synthetic fleet in the database to benchmark owl."
+
+  option_list = BaseCommand.option_list + (
+    make_option('--clusters', type='int', default=1,
+      help='The number of clusters of every service'),
+    make_option('--tasks', type='int', default=1000,
+      help='The number of tasks of worker jobs, like regionserver, datanode'),
+    make_option('--tables', type='int', default=1000,
+      help='The number of tables of a hbase cluster'),
+    make_option('--regions', type='int', default=200000,
+      help='The number of regions of a hbase cluster'),
+    make_option('--quotas', type='int', default=1000,
+      help='The number of quotas of a hdfs cluster'),
+    make_option('--topologies', type='int', default=20,
+      help='The number of topologies of a storm cluster'),
+    make_option('--failover_tasks', type='int', default=5000,
+      help='The number of failover tasks'),
+    make_option('--seed', type='int', default=0,
+      help='The seed of random metrics'),
+  )
+
+  def handle(self, *args, **options):
+    if options['tasks'] < 1 or options['clusters'] < 1:
+      raise CommandError("A fleet needs at least a cluster and a task")
+    if Cluster.objects.filter(name__startswith=fleet.CLUSTER_PREFIX + '-').exists():
+      raise CommandError("A fleet exists in the database")
+
+    start_time = time.time()
+    clusters = fleet.generate_fleet(options, options['seed'])
+    logger.info("Generated %d clusters in %.1f seconds", len(clusters),
+      time.time() - start_time)
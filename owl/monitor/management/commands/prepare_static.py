@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from owl import static_serving
+
+class Command(BaseCommand):
+  help = "Collect and compress static files for the production serving mode"
+
+  def handle(self, *args, **options):
+    call_command('collectstatic', interactive=False, verbosity=0)
+    version = static_serving.compress_static(settings.STATIC_ROOT)
+    self.stdout.write("Static files of version %s are prepared in %s" % (
+      version, settings.STATIC_ROOT))
@@ -1,9 +1,14 @@
 # -*- coding: utf-8 -*-
 
+import cluster_rollup
 import dbutil
 import json
 import metric_view_config
 
+from bean_name import form_perf_counter_key_name
+from bean_name import parse_bean_name
+from bean_name import parse_replication_source
+
 # define operation metric suffix
 OPERATION_HISTOGRAM_75th_TIME = 'histogram_75th_percentile'
 OPERATION_HISTOGRAM_95th_TIME = 'histogram_95th_percentile'
@@ -28,44 +33,6 @@ def form_percentile_counter_name(endpoint, group, operationName):
     percentiles.append(make_latency_metric_query(endpoint, group, '%s_%s' % (operationName, suffix)))
   return percentiles
 
-# parse bean name
-# return (service, name)
-# eg:
-#   input 'hadoop:service=HBase,name=RPCStatistics-18600'
-#   return ('HBase', 'RPCStatistics-18600')
-def parse_bean_name(bean_name):
-  items= bean_name.split(':')[1].split(',')[:2]
-  return [item.split('=')[1] for item in items]
-
-# input:
-# 'ReplicationSource for 5-10.0.4.172%2C11600%2C1364508024855'
-# return 5-bak
-# input:
-# 'ReplicationSource for 5'
-# return 5
-def parse_replication_source(name):
-  fields = name.split('-')
-  source_name = fields[0]
-  try:
-    source_num = source_name.split(' ')[2]
-    if len(fields) > 1:
-      return source_num + '-bak'
-    else:
-      return source_num
-  except:
-    return source_name
-
-def form_perf_counter_key_name(bean_name, metric_name):
-  # illegal perf counter char '~' exsit in hbase table metric.
-  # replace it with '-'
-  # eg:tbl.miliao_summary.cf.S~T.multiput_AvgTime
-  #    to tbl.miliao_summary.cf.S-T.multiput_AvgTime
-  service, name = parse_bean_name(bean_name)
-  if service == 'Replication':
-    replication_src = parse_replication_source(name)
-    metric_name += '-' + replication_src
-  return metric_name.replace('~', '-')
-
 def task_metrics_view_config(task):
   result = {}
   service, cluster, job, task = str(task).split('/')
@@ -74,7 +41,7 @@ def task_metrics_view_config(task):
 def job_metrics_view_config(job):
   result = {}
   service, cluster, job = str(job).split('/')
-  return metric_view_config.JOB_METRICS_VIEW_CONFIG[service][job]
+  return metric_view_config.JOB_METRICS_VIEW_CONFIG.get(service, {}).get(job, [])
 
 def get_all_metrics_config():
   inputs = (metric_view_config.JOB_METRICS_VIEW_CONFIG,
@@ -127,14 +94,33 @@ def make_metrics_query_for_task(endpoint, task):
     metrics.append((view_tag, metrics_view))
   return metrics
 
-def make_metrics_query_for_job(endpoints, job, tasks):
+def make_metrics_query_for_job(endpoints, job, tasks, aggregated=False):
+  """
+  Return the graphs of a job page. If aggregated, a graph shows the job
+  series of the cluster endpoint instead of the series of every task, see
+  cluster_rollup.compute_job_series.
+  """
   metrics = []
+  # the rollups of the job are single series of the cluster endpoint
+  service_name = job.cluster.service.name
+  cluster_endpoint = dbutil.map_cluster_to_endpoint(job.cluster.name)
+  rollups = cluster_rollup.get_rollup_metrics_of_job(service_name, job.name)
+  if rollups:
+    group = cluster_rollup.ROLLUP_GROUPS[service_name]
+    metrics.append(('Cluster', [
+      make_metric_query_graph_for_endpoints([cluster_endpoint], group, name, unit)
+      for name, job_name, metric_group, metric, unit, aggregation, scale in rollups]))
   task_view_config = job_metrics_view_config(job)
   for view_tag, view_config in task_view_config:
     metrics_view = []
     for graph_config in view_config:
       group, key, unit = graph_config[0]
-      metrics_view.append(make_metric_query_graph_for_endpoints(endpoints, group, key, unit))
+      if aggregated:
+        metrics_view.append(make_job_series_query_graph(cluster_endpoint,
+          job.name, group, key, unit))
+      else:
+        metrics_view.append(make_metric_query_graph_for_endpoints(endpoints,
+          group, key, unit))
     metrics.append((view_tag, metrics_view))
   return metrics
 
@@ -147,6 +133,16 @@ def make_metric_query_graph_for_endpoints(endpoints, group, key, unit=""):
     graph['query'].append(make_metric_query(endpoint, group, key, unit))
   return graph
 
+def make_job_series_query_graph(endpoint, job_name, group, key, unit=""):
+  graph = {
+    'title' : '%s:%s' % (group, key),
+    'query' : [],
+  }
+  for aggregation in cluster_rollup.JOB_VIEW_AGGREGATIONS:
+    graph['query'].append(make_metric_query(endpoint,
+      cluster_rollup.get_job_series_group(group, job_name, aggregation), key, unit))
+  return graph
+
 def get_peer_id_endpoint_map_and_cluster(region_servers):
   peer_id_endpoint_map = {}
   peer_id_cluster = {}
@@ -239,9 +235,6 @@ def make_operation_metrics_for_tables_in_cluster(cluster):
           continue
         numOpsCounterName = '%s_NumOps' % (operationName)
         avgTimeCounterName = '%s_AvgTime' % (operationName)
-        print type(endpoint)
-        print type(group)
-        print type(numOpsCounterName)
         metrics[operationName][0]['query'].append(make_ops_metric_query(endpoint, group, numOpsCounterName))
         metrics[operationName][1]['query'].append(make_latency_metric_query(endpoint, group, avgTimeCounterName))
 
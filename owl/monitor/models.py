@@ -323,6 +323,104 @@ class Region(models.Model):
   def __str__(self):
     return repr(','.join((self.name.split(',')[:2]))).replace("'", '')
 
+class Distribution(models.Model):
+  """
+  Materialized request and data distribution of a table, a regionserver or
+  a cluster, written by the collector once per cycle. See distribution.py
+  for the format of data.
+  """
+  cluster = models.ForeignKey(Cluster, db_index=True)
+  # 'table', 'regionserver' for the distribution on regions, or
+  # 'cluster_table', 'cluster_regionserver' for that on tables and
+  # regionservers of a cluster.
+  owner_type = models.CharField(max_length=32)
+  owner_id = models.IntegerField()
+  # 'read_requests', 'write_requests', 'memstore_size' or 'storefile_size'
+  name = models.CharField(max_length=32)
+  last_update_time = models.DateTimeField(default=DEFAULT_DATETIME)
+  data = models.TextField()
+
+  class Meta:
+    unique_together = [["owner_type", "owner_id", "name"],]
+
+  def __unicode__(self):
+    return u"%s/%d/%s" % (self.owner_type, self.owner_id, self.name)
+
+class SkewSummary(models.Model):
+  """
+  The skew of requests on the regions of a table or a regionserver, written
+  by the collector once per cycle. See skew.py for the statistics.
+  """
+  cluster = models.ForeignKey(Cluster, db_index=True)
+  # 'table' or 'regionserver'
+  owner_type = models.CharField(max_length=32)
+  owner_id = models.IntegerField()
+  # 'read_requests' or 'write_requests'
+  name = models.CharField(max_length=32)
+  last_update_time = models.DateTimeField(default=DEFAULT_DATETIME)
+
+  count = models.IntegerField(default = 0)
+  total = models.FloatField(default = 0)
+  gini = models.FloatField(default = 0)
+  median = models.FloatField(default = 0)
+  p99 = models.FloatField(default = 0)
+  top_share = models.FloatField(default = 0)
+  # only for regionserver
+  deviation = models.FloatField(default = 0)
+  flagged = models.BooleanField(default = False)
+  # [[label, region id, value], ...] as json
+  hot_regions = models.TextField()
+
+  class Meta:
+    unique_together = [["owner_type", "owner_id", "name"],]
+
+  def p99_median_ratio(self):
+    if self.median > 0:
+      return self.p99 / self.median
+    return None
+
+  def get_hot_regions(self):
+    return json.loads(self.hot_regions or '[]')
+
+  def __unicode__(self):
+    return u"%s/%d/%s" % (self.owner_type, self.owner_id, self.name)
+
+class RegionEvent(models.Model):
+  """
+  A split or merge of regions, detected from master snapshots, see
+  region_lifecycle.py.
+  """
+  cluster = models.ForeignKey(Cluster, db_index=True)
+  table = models.ForeignKey(Table, db_index=True)
+  # 'split' or 'merge'
+  event_type = models.CharField(max_length=16)
+  event_time = models.DateTimeField(default=DEFAULT_DATETIME, db_index=True)
+  # region names as json lists
+  parents = models.TextField()
+  children = models.TextField()
+
+  def __unicode__(self):
+    return u"%s/%s/%s" % (self.table, self.event_type, self.event_time)
+
+class RegionHistory(models.Model):
+  """
+  The final stats of a dead region, archived when it's pruned from Region.
+  """
+  table = models.ForeignKey(Table, db_index=True)
+  name = models.CharField(max_length=256)
+  encodeName = models.CharField(max_length = 128, db_index=True)
+  # the last time the region was online
+  last_attempt_time = models.DateTimeField(default=DEFAULT_DATETIME)
+  archived_time = models.DateTimeField(default=DEFAULT_DATETIME, db_index=True)
+
+  memStoreSizeMB = models.IntegerField(default = 0)
+  storefileSizeMB = models.IntegerField(default = 0)
+  readRequestsCount = models.IntegerField(default = 0)
+  writeRequestsCount = models.IntegerField(default = 0)
+
+  def __unicode__(self):
+    return unicode(self.name)
+
 class Counter(models.Model):
   # The from ip of the counter
   host = models.CharField(max_length=16)
@@ -348,6 +446,57 @@ class Counter(models.Model):
   def __unicode__(self):
     return u"%s/%s/%s/%s" % (self.host, self.group, self.name, self.last_update_time)
 
+class ClusterSummary(models.Model):
+  """
+  Rollup of a metric of the tasks of a hdfs or yarn cluster, written by the
+  status updater once per cycle. See cluster_rollup.py.
+  """
+  cluster = models.ForeignKey(Cluster, db_index=True)
+  name = models.CharField(max_length=64)
+  value = models.FloatField(default=0)
+  # the sum of the counter over tasks, for the rollups of rates
+  total = models.FloatField(default=0)
+  unit = models.CharField(max_length=16)
+  last_update_time = models.DateTimeField(default=DEFAULT_DATETIME)
+
+  class Meta:
+    unique_together = [["cluster", "name"],]
+
+  def __unicode__(self):
+    return u"%s/%s" % (self.cluster, self.name)
+
+class TaskStatusMetrics(models.Model):
+  """
+  The metrics of a task read by the status updater, selected by the
+  collector when it decodes the task metrics, so the status updater doesn't
+  decode the whole last_metrics of every task per cycle. See
+  status_updater.select_status_metrics.
+  """
+  task = models.OneToOneField(Task, db_index=True)
+  last_update_time = models.DateTimeField(default=DEFAULT_DATETIME)
+  # {bean name: {metric name: value}} as json
+  data = models.TextField()
+
+  def __unicode__(self):
+    return unicode(self.task)
+
+class StormMetrics(models.Model):
+  """
+  A slice of the metrics of a storm topology, decoded from the metricserver
+  by the collector. See storm_metrics.py for the kinds and format of data.
+  """
+  cluster = models.ForeignKey(Cluster, db_index=True)
+  storm_id = models.CharField(max_length=256)
+  kind = models.CharField(max_length=16)
+  last_update_time = models.DateTimeField(default=DEFAULT_DATETIME)
+  data = models.TextField()
+
+  class Meta:
+    unique_together = [["cluster", "storm_id", "kind"],]
+
+  def __unicode__(self):
+    return u"%s/%s/%s" % (self.cluster, self.storm_id, self.kind)
+
 class Quota(models.Model):
   cluster = models.ForeignKey(Cluster, db_index=True)
   name = models.CharField(max_length=256)
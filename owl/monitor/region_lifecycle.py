@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+#
+# Lifecycle of hbase regions.
+#
+# Every master snapshot lists all online regions of a table. Comparing it
+# with the regions online in the previous snapshot, the regions split or
+# merged are inferred from the key ranges of the regions disappeared and
+# appeared. Regions not seen for REGION_RETENTION seconds are dead: they're
+# archived to RegionHistory and deleted from the hot region table.
+import datetime
+import json
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from models import Region, RegionEvent, RegionHistory
+
+logger = logging.getLogger(__name__)
+
+EVENT_SPLIT = 'split'
+EVENT_MERGE = 'merge'
+
+# the number of regions archived in one transaction
+PRUNE_BATCH_SIZE = 1000
+
+# parse the start key from region name, eg:
+#   input 'hbase_client_test_table,01,1369368306964.7be6b8bda3e59d5e6d4556482fc84601.'
+#   return '01'
+def parse_start_key(name):
+  try:
+    return name.split(',', 1)[1].rsplit(',', 1)[0]
+  except IndexError:
+    return ''
+
+# return a dict from region name to its key range (start_key, end_key), the
+# end_key of the last region is None.
+def get_key_ranges(names):
+  regions = sorted((parse_start_key(name), name) for name in names)
+  ranges = {}
+  for index, (start_key, name) in enumerate(regions):
+    end_key = None
+    if index + 1 < len(regions):
+      end_key = regions[index + 1][0]
+    ranges[name] = (start_key, end_key)
+  return ranges
+
+def is_range_in(inner, outer):
+  if inner[0] < outer[0]:
+    return False
+  if outer[1] is None:
+    return True
+  return inner[1] is not None and inner[1] <= outer[1]
+
+def detect_events(previous_names, current_names):
+  """
+  Detect the splits and merges between two snapshots of regions of a table.
+  Return a list of (event_type, parents, children).
+  """
+  if not previous_names or not current_names:
+    return []
+  previous_ranges = get_key_ranges(previous_names)
+  current_ranges = get_key_ranges(current_names)
+  disappeared = [name for name in previous_ranges if name not in current_ranges]
+  appeared = [name for name in current_ranges if name not in previous_ranges]
+
+  events = []
+  for parent in sorted(disappeared):
+    children = sorted(child for child in appeared
+      if is_range_in(current_ranges[child], previous_ranges[parent]))
+    if len(children) > 1:
+      events.append((EVENT_SPLIT, [parent], children))
+
+  for child in sorted(appeared):
+    parents = sorted(parent for parent in disappeared
+      if is_range_in(previous_ranges[parent], current_ranges[child]))
+    if len(parents) > 1:
+      events.append((EVENT_MERGE, parents, [child]))
+  return events
+
+def track_region_events(cluster, tables, previous_times, regions, update_time):
+  """
+  Detect and save the region events of tables in a master snapshot.
+
+  previous_times: dict from table name to the time of previous snapshot
+  regions: the regions in current snapshot
+  """
+  current_names = {}
+  for region in regions:
+    current_names.setdefault(region.table_id, []).append(region.name)
+
+  # the regions updated by the previous snapshot of every table, datetime in
+  # db may be truncated to seconds.
+  thresholds = {}
+  for table_name, table in tables.iteritems():
+    previous_time = previous_times.get(table_name)
+    if previous_time is not None and table.id in current_names:
+      thresholds[table.id] = previous_time - datetime.timedelta(seconds=1)
+  if not thresholds:
+    return []
+  # one query for all tables of the cluster, instead of one per table
+  previous_names = {}
+  for table_id, name, last_attempt_time in Region.objects.filter(
+      table__cluster=cluster,
+      last_attempt_time__gte=min(thresholds.itervalues())).values_list(
+      'table_id', 'name', 'last_attempt_time'):
+    if table_id in thresholds and last_attempt_time >= thresholds[table_id]:
+      previous_names.setdefault(table_id, []).append(name)
+
+  region_events = []
+  for table_name, table in tables.iteritems():
+    if table.id not in thresholds:
+      continue
+    for event_type, parents, children in detect_events(
+        previous_names.get(table.id, []), current_names[table.id]):
+      logger.info("%s: region %s %s to %s", table, event_type, parents, children)
+      region_events.append(RegionEvent(cluster=cluster, table=table,
+        event_type=event_type, event_time=update_time,
+        parents=json.dumps(parents), children=json.dumps(children)))
+
+  if region_events:
+    RegionEvent.objects.bulk_create(region_events)
+  return region_events
+
+def get_region_events(table, count):
+  """
+  Return the latest region events of a table as dicts, which could be cached.
+  """
+  events = []
+  for event in RegionEvent.objects.filter(table=table).order_by('-event_time')[:count]:
+    events.append({
+      'event_type': event.event_type,
+      'event_time': event.event_time,
+      'parents': json.loads(event.parents),
+      'children': json.loads(event.children),
+    })
+  return events
+
+def archive_regions(regions, archived_time):
+  histories = []
+  for region in regions:
+    histories.append(RegionHistory(table_id=region.table_id,
+      name=region.name, encodeName=region.encodeName,
+      last_attempt_time=region.last_attempt_time, archived_time=archived_time,
+      memStoreSizeMB=region.memStoreSizeMB,
+      storefileSizeMB=region.storefileSizeMB,
+      readRequestsCount=region.readRequestsCount,
+      writeRequestsCount=region.writeRequestsCount))
+  with transaction.atomic():
+    RegionHistory.objects.bulk_create(histories)
+    Region.objects.filter(id__in=[region.id for region in regions]).delete()
+
+def prune_dead_regions():
+  """
+  Archive the regions dead for REGION_RETENTION seconds, and delete the
+  region histories and events older than REGION_HISTORY_RETENTION seconds.
+  Return the number of regions archived.
+  """
+  now = timezone.now()
+  dead_threshold = now - datetime.timedelta(seconds=settings.REGION_RETENTION)
+  fields = ('id', 'table', 'name', 'encodeName', 'last_attempt_time',
+            'memStoreSizeMB', 'storefileSizeMB', 'readRequestsCount',
+            'writeRequestsCount')
+  archived = 0
+  while True:
+    regions = list(Region.objects.filter(last_attempt_time__lt=dead_threshold).
+      only(*fields)[:PRUNE_BATCH_SIZE])
+    if not regions:
+      break
+    archive_regions(regions, now)
+    archived += len(regions)
+
+  history_threshold = now - datetime.timedelta(
+    seconds=settings.REGION_HISTORY_RETENTION)
+  RegionHistory.objects.filter(archived_time__lt=history_threshold).delete()
+  RegionEvent.objects.filter(event_time__lt=history_threshold).delete()
+  return archived
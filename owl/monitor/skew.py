@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+#
+# Hotspot and skew analysis of the requests on hbase regions.
+#
+# The request rates of all regions of a cluster are loaded into arrays once
+# per cycle, and the statistics of every table and regionserver are computed
+# together by sorting the regions by (group, value), so the cost doesn't
+# depend on the number of groups:
+#   gini: the gini coefficient of the requests on regions, 0 is even
+#   median, p99: percentiles of the requests on regions
+#   top_share: share of the requests served by the top SKEW_TOP_K regions
+#   hot_regions: regions serving SKEW_HOT_REGION_RATIO times the mean
+#     requests of their table, at most SKEW_HOT_REGION_COUNT per group
+#   deviation: relative deviation of the requests on a regionserver from
+#     the mean of the cluster
+import numpy
+
+from django.conf import settings
+
+# the request rates analyzed
+SKEW_METRICS = {
+  'read_requests': 'readRequestsCountPerSec',
+  'write_requests': 'writeRequestsCountPerSec',
+}
+
+class GroupStats:
+  """
+  Statistics of values by group, groups are indexed from 0.
+  """
+  def __init__(self, groups, values):
+    group_count = groups.max() + 1 if len(groups) else 0
+    # sort by group, then by value in ascending order
+    self.order = numpy.lexsort((values, groups))
+    self.sorted_groups = groups[self.order]
+    self.sorted_values = values[self.order]
+    self.counts = numpy.bincount(groups, minlength=group_count)
+    self.starts = numpy.concatenate(([0], numpy.cumsum(self.counts)[:-1]))
+    self.totals = numpy.bincount(groups, weights=values, minlength=group_count)
+    # the 1-based rank of each sorted value in its group
+    self.ranks = (numpy.arange(len(values)) -
+                  self.starts[self.sorted_groups] + 1)
+
+  def percentile(self, q):
+    positions = (self.counts - 1) * q
+    lower = numpy.floor(positions).astype(int)
+    upper = numpy.ceil(positions).astype(int)
+    fraction = positions - lower
+    return (self.sorted_values[self.starts + lower] * (1 - fraction) +
+            self.sorted_values[self.starts + upper] * fraction)
+
+  def gini(self):
+    counts = self.counts[self.sorted_groups]
+    weighted = numpy.bincount(self.sorted_groups,
+      weights=(2 * self.ranks - counts - 1) * self.sorted_values,
+      minlength=len(self.counts))
+    denominator = self.counts * self.totals
+    return numpy.where(denominator > 0,
+      weighted / numpy.maximum(denominator, 1e-9), 0)
+
+  def top_share(self, k):
+    in_top = self.ranks > self.counts[self.sorted_groups] - k
+    top_totals = numpy.bincount(self.sorted_groups,
+      weights=self.sorted_values * in_top, minlength=len(self.counts))
+    return numpy.where(self.totals > 0,
+      top_totals / numpy.maximum(self.totals, 1e-9), 0)
+
+  def top_indexes(self, mask, k):
+    """
+    Return the indexes of the top k values of each group among values
+    selected by mask, as a dict from group to indexes in descending order.
+    """
+    sorted_mask = mask[self.order]
+    # rank of the selected values from the largest in each group
+    selected = numpy.cumsum(sorted_mask[::-1])[::-1]
+    group_ends = self.starts + self.counts
+    ends_selected = numpy.concatenate((selected, [0]))[group_ends[self.sorted_groups]]
+    in_top = sorted_mask & (selected - ends_selected <= k)
+    top = {}
+    for position in numpy.flatnonzero(in_top)[::-1]:
+      top.setdefault(int(self.sorted_groups[position]), []).append(
+        int(self.order[position]))
+    return top
+
+def analyze_values(values, table_groups, rs_groups, rs_totals):
+  """
+  Analyze the values of regions grouped by table and by regionserver.
+  rs_totals is the total values of regionservers, indexed by rs_groups.
+  Return (table_summaries, rs_summaries), dicts from group to summary.
+  """
+  table_stats = GroupStats(table_groups, values)
+  table_means = table_stats.totals / numpy.maximum(table_stats.counts, 1)
+  hot = ((values >= settings.SKEW_HOT_REGION_RATIO * table_means[table_groups]) &
+         (values >= settings.SKEW_HOT_REGION_MIN_VALUE))
+
+  rs_mean = rs_totals.mean() if len(rs_totals) else 0
+  if rs_mean > 0:
+    deviations = (rs_totals - rs_mean) / rs_mean
+  else:
+    deviations = numpy.zeros(len(rs_totals))
+
+  results = []
+  for stats in (table_stats, GroupStats(rs_groups, values)):
+    gini = stats.gini()
+    median = stats.percentile(0.5)
+    p99 = stats.percentile(0.99)
+    top_share = stats.top_share(settings.SKEW_TOP_K)
+    hot_regions = stats.top_indexes(hot, settings.SKEW_HOT_REGION_COUNT)
+    summaries = {}
+    for group in numpy.flatnonzero(stats.counts):
+      summaries[int(group)] = {
+        'count': int(stats.counts[group]),
+        'total': float(stats.totals[group]),
+        'gini': float(gini[group]),
+        'median': float(median[group]),
+        'p99': float(p99[group]),
+        'top_share': float(top_share[group]),
+        'hot_regions': hot_regions.get(int(group), []),
+      }
+    results.append(summaries)
+
+  table_summaries, rs_summaries = results
+  for group, summary in rs_summaries.iteritems():
+    summary['deviation'] = float(deviations[group])
+  return table_summaries, rs_summaries
+
+def analyze_regions(regions, label_func):
+  """
+  Analyze the requests on regions of a cluster. Return a list of
+  (owner_type, owner_id, name, summary), where owner_type is 'table' or
+  'regionserver', and the hot regions in summary are [label, id, value].
+  Every summary is flagged if it has hot regions or the regionserver
+  deviates from the cluster.
+  """
+  if not regions:
+    return []
+  table_ids, table_groups = numpy.unique(
+    numpy.array([region.table_id for region in regions]), return_inverse=True)
+  rs_ids, rs_groups = numpy.unique(
+    numpy.array([region.region_server_id for region in regions]),
+    return_inverse=True)
+
+  results = []
+  for name, attr in SKEW_METRICS.iteritems():
+    values = numpy.fromiter((getattr(region, attr) for region in regions),
+                            dtype=float, count=len(regions))
+    rs_totals = numpy.bincount(rs_groups, weights=values, minlength=len(rs_ids))
+    table_summaries, rs_summaries = analyze_values(values, table_groups,
+      rs_groups, rs_totals)
+    for owner_type, ids, summaries in (('table', table_ids, table_summaries),
+                                       ('regionserver', rs_ids, rs_summaries)):
+      for group, summary in summaries.iteritems():
+        summary['hot_regions'] = [
+          [label_func(regions[index]), regions[index].id, float(values[index])]
+          for index in summary['hot_regions']]
+        summary['flagged'] = is_flagged(summary)
+        results.append((owner_type, int(ids[group]), name, summary))
+  return results
+
+def is_flagged(summary):
+  return (len(summary['hot_regions']) > 0 or
+          abs(summary.get('deviation', 0)) > settings.SKEW_RS_DEVIATION)
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+#
+# Storage backends for the batch operations of dbutil, which are too slow
+# through django orm.
+#
+# The backend is chosen by the engine of the default database. Connections
+# are created lazily on the first batch operation, and the size of the
+# connection pool depends on the type of the process, see
+# set_process_type(), so web workers which never run batch operations hold
+# no connection.
+import logging
+import os
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# process types, the collector workers do batch operations per cycle.
+PROCESS_TYPE_DEFAULT = 'default'
+PROCESS_TYPE_COLLECTOR = 'collector'
+
+process_type = PROCESS_TYPE_DEFAULT
+storage = None
+
+def format_datetime(value):
+  if timezone.is_aware(value):
+    value = timezone.make_naive(value, timezone.utc)
+  return value.strftime('%Y-%m-%d %H:%M:%S')
+
+class BatchStorage(object):
+  """
+  The interface of storage backends. Statements use '%s' placeholders.
+  """
+  def update_rows(self, table, columns, key_column, rows):
+    """
+    Update columns of rows by key_column, every row is a list of values of
+    columns followed by the key.
+    """
+    sql = 'update %s set %s where %s=%%s' % (table,
+      ', '.join('%s=%%s' % column for column in columns), key_column)
+    self.executemany(sql, rows)
+
+  def upsert_rows(self, table, columns, update_columns, rows):
+    """
+    Insert rows, or update update_columns of rows on duplicate unique keys.
+    """
+    raise NotImplementedError
+
+  def executemany(self, sql, rows):
+    raise NotImplementedError
+
+class MySQLStorage(BatchStorage):
+  def __init__(self, db_settings, pool_size):
+    self.db_settings = db_settings
+    self.pool_size = pool_size
+    self.pool = None
+    self.pid = None
+
+  def get_pool(self):
+    # a pool is never shared by forked processes
+    if self.pool is None or self.pid != os.getpid():
+      import MySQLdb
+      from DBUtils.PooledDB import PooledDB
+      self.pool = PooledDB(MySQLdb, maxusage = 10, mincached = 0,
+                           maxcached = self.pool_size,
+                           db = self.db_settings['NAME'],
+                           host = self.db_settings['HOST'],
+                           port = int(self.db_settings['PORT']),
+                           user = self.db_settings['USER'],
+                           passwd = self.db_settings['PASSWORD'],
+                           charset = 'utf8')
+      self.pid = os.getpid()
+    return self.pool
+
+  def upsert_rows(self, table, columns, update_columns, rows):
+    sql = 'insert into %s (%s) values (%s) on duplicate key update %s' % (
+      table, ', '.join(columns), ', '.join(['%s'] * len(columns)),
+      ', '.join('%s=values(%s)' % (column, column) for column in update_columns))
+    self.executemany(sql, rows)
+
+  def executemany(self, sql, rows):
+    import MySQLdb
+    conn = None
+    try:
+      conn = self.get_pool().connection()
+      cur = conn.cursor()
+      cur.executemany(sql, rows)
+      conn.commit()
+      cur.close()
+    except MySQLdb.Error as e:
+      logger.warning("Failed to execute batch of %d rows: %r", len(rows), e)
+    finally:
+      if conn is not None:
+        conn.close()
+
+class SQLiteStorage(BatchStorage):
+  """
+  Run batch operations through the django connection, which is used for
+  tests and benchmarks.
+  """
+  def upsert_rows(self, table, columns, update_columns, rows):
+    sql = 'insert or replace into %s (%s) values (%s)' % (
+      table, ', '.join(columns), ', '.join(['%s'] * len(columns)))
+    self.executemany(sql, rows)
+
+  def executemany(self, sql, rows):
+    try:
+      with transaction.atomic():
+        connection.cursor().executemany(sql, rows)
+    except Exception as e:
+      logger.warning("Failed to execute batch of %d rows: %r", len(rows), e)
+
+def set_process_type(type):
+  """
+  Set the type of current process, before any batch operation.
+  """
+  global process_type
+  process_type = type
+
+def get_storage():
+  global storage
+  if storage is None:
+    db_settings = settings.DATABASES['default']
+    engine = db_settings['ENGINE']
+    if engine.endswith('mysql'):
+      pool_size = settings.BATCH_STORAGE_POOL_SIZE.get(process_type,
+        settings.BATCH_STORAGE_POOL_SIZE[PROCESS_TYPE_DEFAULT])
+      storage = MySQLStorage(db_settings, pool_size)
+    elif engine.endswith('sqlite3'):
+      storage = SQLiteStorage()
+    else:
+      raise ValueError("Unsupported database engine for batch storage: %s" % engine)
+  return storage
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+#
+# Normalize the metrics of storm metricserver.
+#
+# The metricserver reports all metrics of a cluster in one json document:
+#   <storm_id, <group_name, <key, value>>>
+# where group_name is STORM_BUILTIN_SPOUT_METRICS, STORM_BUILTIN_BOLT_METRICS,
+# STORM_SYSTEM_<worker endpoint> or <component_id>:<task_id> of user metrics.
+# The collector decodes the document once and saves every topology as slices
+# of kinds, so a page reads only the slice it renders:
+#   spout, bolt: <key, value>
+#   system: [{"worker_endpoint": .., "GC": .., "memory_heap": .., ...}, ...]
+#   user: <component_id, <task_id, <key, value>>>
+
+BUILTIN_SPOUT_GROUP = 'STORM_BUILTIN_SPOUT_METRICS'
+BUILTIN_BOLT_GROUP = 'STORM_BUILTIN_BOLT_METRICS'
+SYSTEM_GROUP_PREFIX = 'STORM_SYSTEM_'
+
+KIND_SPOUT = 'spout'
+KIND_BOLT = 'bolt'
+KIND_SYSTEM = 'system'
+KIND_USER = 'user'
+
+BUILTIN_KINDS = {
+  BUILTIN_SPOUT_GROUP: KIND_SPOUT,
+  BUILTIN_BOLT_GROUP: KIND_BOLT,
+}
+
+# prefixes of the system metrics of a worker, and the fields they're joined to
+SYSTEM_METRIC_PREFIXES = [
+  ('GC/', 'GC'),
+  ('memory/heap:', 'memory_heap'),
+  ('memory/nonHeap:', 'memory_non_heap'),
+]
+
+def strip_prefix(name, prefix):
+  if name.startswith(prefix):
+    return name[len(prefix):]
+  return name
+
+# eg: '__ack-count' -> 'ack_count'
+def get_builtin_field_name(name):
+  return name.lstrip('_').replace('-', '_')
+
+def normalize_worker(worker_endpoint, metrics):
+  worker = {'worker_endpoint': worker_endpoint}
+  values = dict((field, []) for prefix, field in SYSTEM_METRIC_PREFIXES)
+  for name, value in sorted(metrics.iteritems()):
+    for prefix, field in SYSTEM_METRIC_PREFIXES:
+      if name.startswith(prefix):
+        values[field].append('%s:%s' % (strip_prefix(name, prefix), value))
+    if name == 'startTimeSecs':
+      worker['start_time_sec'] = value
+    elif name == 'uptimeSecs':
+      worker['uptime_sec'] = value
+  for field, field_values in values.iteritems():
+    worker[field] = ', \n'.join(field_values)
+  return worker
+
+def normalize(raw_metrics):
+  """
+  Normalize the decoded metrics of metricserver. Return a list of
+  (storm_id, kind, data).
+  """
+  result = []
+  for storm_id, topology_metrics in raw_metrics.iteritems():
+    slices = {
+      KIND_SPOUT: {},
+      KIND_BOLT: {},
+      KIND_SYSTEM: [],
+      KIND_USER: {},
+    }
+    for group_name, group_metrics in topology_metrics.iteritems():
+      if group_name in BUILTIN_KINDS:
+        slices[BUILTIN_KINDS[group_name]].update(group_metrics)
+      elif group_name.startswith(SYSTEM_GROUP_PREFIX):
+        slices[KIND_SYSTEM].append(normalize_worker(
+          strip_prefix(group_name, SYSTEM_GROUP_PREFIX), group_metrics))
+      elif ':' in group_name:
+        component_id, task_id = group_name.split(':', 1)
+        slices[KIND_USER].setdefault(component_id, {})[task_id] = group_metrics
+    slices[KIND_SYSTEM].sort(key=lambda worker: worker['worker_endpoint'])
+    for kind, data in slices.iteritems():
+      result.append((storm_id, kind, data))
+  return result
+
+def iter_counters(kind, data):
+  """
+  Iterate the (group, key, value) of perf counters of a slice, the system
+  metrics aren't exported.
+  """
+  if kind == KIND_SPOUT or kind == KIND_BOLT:
+    group = BUILTIN_SPOUT_GROUP if kind == KIND_SPOUT else BUILTIN_BOLT_GROUP
+    for key, value in data.iteritems():
+      yield group, key, value
+  elif kind == KIND_USER:
+    for component_id, component_metrics in data.iteritems():
+      for task_id, task_metrics in component_metrics.iteritems():
+        for key, value in task_metrics.iteritems():
+          yield '%s:%s' % (component_id, task_id), key, value
@@ -0,0 +1,991 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the monitor app.
+"""
+
+import calendar
+import SocketServer
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import get_cache
+from django.db import connections
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.http import QueryDict
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from collector.management.commands import metrics_updater
+from collector.management.commands import status_updater
+
+from models import Service, Cluster, Job, Task
+from models import Table, RegionServer, Region, HBaseCluster
+from models import Distribution, RegionEvent, RegionHistory
+from models import ClusterSummary
+from owl import middleware
+from owl.middleware import QUERY_COUNT_HEADER
+import api
+import benchmark
+import cluster_rollup
+import dbutil
+import fleet
+import local_tsdb
+import metric_helper
+import region_lifecycle
+import skew
+import storage
+import storm_metrics
+import tsdb_proxy
+import utils.tsdb_client
+import view_cache
+
+# max queries of a page, including session and user lookups.
+QUERY_BUDGET = 15
+
+# Every page must issue a bounded number of sql queries, which doesn't grow
+# with the number of tasks, tables or regionservers of a cluster.
+@override_settings(VIEW_CACHE_ENABLED=False, QUERY_BUDGET_ENFORCED=True,
+  QUERY_BUDGET_PER_REQUEST=QUERY_BUDGET, QUERY_CAPTURE_SQL=False)
+class QueryBudgetTest(TestCase):
+  def setUp(self):
+    now = timezone.now()
+    self.service = Service.objects.create(name='hbase', metric_url='/jmx')
+    self.cluster = Cluster.objects.create(service=self.service,
+      name='test-cluster', last_attempt_time=now, last_success_time=now)
+    HBaseCluster.objects.create(cluster=self.cluster, operationMetrics='{}')
+    self.master = Job.objects.create(cluster=self.cluster, name='master',
+      last_success_time=now)
+    self.regionserver_job = Job.objects.create(cluster=self.cluster,
+      name='regionserver', last_success_time=now)
+    self.table = Table.objects.create(cluster=self.cluster, name='test_table',
+      last_attempt_time=now, operationMetrics='{}')
+    self.task_count = 0
+    self.add_regionservers(5)
+
+  def add_regionservers(self, count):
+    now = timezone.now()
+    for i in range(self.task_count, self.task_count + count):
+      task = Task.objects.create(job=self.regionserver_job, task_id=i,
+        host='10.0.0.%d' % i, port=12001, last_success_time=now)
+      rs = RegionServer.objects.create(cluster=self.cluster, task=task,
+        name='10.0.0.%d,12000,1' % i, last_attempt_time=now,
+        replication_last_attempt_time=now, replicationMetrics='{}')
+      Region.objects.create(table=self.table, region_server=rs,
+        name='test_table,%d,1.%032d.' % (i, i), encodeName='%032d' % i,
+        last_attempt_time=now, operationMetrics='{}')
+      Table.objects.create(cluster=self.cluster, name='table_%d' % i,
+        last_attempt_time=now, operationMetrics='{}')
+    self.task_count += count
+    return rs
+
+  def get_query_count(self, url):
+    response = self.client.get(url)
+    self.assertEqual(200, response.status_code)
+    return int(response[QUERY_COUNT_HEADER])
+
+  def assert_query_budget(self, url_func):
+    count = self.get_query_count(url_func())
+    self.assertLessEqual(count, QUERY_BUDGET)
+    self.add_regionservers(20)
+    self.assertEqual(count, self.get_query_count(url_func()))
+
+  def test_index(self):
+    self.assert_query_budget(lambda: '/monitor/')
+
+  def test_query_counter(self):
+    connection = connections['default']
+    self.get_query_count('/monitor/')
+    # the sql isn't kept without QUERY_CAPTURE_SQL
+    self.assertEqual([], connection.queries)
+    with self.settings(QUERY_CAPTURE_SQL=True):
+      count = self.get_query_count('/monitor/')
+    self.assertEqual(count, len(connection.queries))
+    self.assertFalse(connection.use_debug_cursor)
+
+    with self.settings(QUERY_BUDGET_PER_REQUEST=1):
+      self.assertRaises(middleware.QueryBudgetExceeded, self.client.get,
+        '/monitor/')
+
+  def test_service(self):
+    self.assert_query_budget(lambda: '/monitor/service/%d/' % self.service.id)
+
+  def test_cluster_task_board(self):
+    self.assert_query_budget(lambda: '/monitor/cluster/%d/task/' % self.cluster.id)
+
+  def test_cluster_table_board(self):
+    self.assert_query_budget(lambda: '/monitor/cluster/%d/table/' % self.cluster.id)
+
+  def test_cluster_regionserver_board(self):
+    self.assert_query_budget(
+      lambda: '/monitor/cluster/%d/regionserver/' % self.cluster.id)
+
+  def test_cluster_replication(self):
+    self.assert_query_budget(
+      lambda: '/monitor/cluster/%d/replication/' % self.cluster.id)
+
+  def test_all_tables(self):
+    self.assert_query_budget(lambda: '/monitor/table/')
+
+  def test_table(self):
+    self.assert_query_budget(lambda: '/monitor/table/%d/' % self.table.id)
+
+  def test_regionserver(self):
+    rs = RegionServer.objects.all()[0]
+    self.assert_query_budget(lambda: '/monitor/regionserver/%d/' % rs.id)
+
+  def test_job(self):
+    self.assert_query_budget(
+      lambda: '/monitor/job/%d/' % self.regionserver_job.id)
+
+  def test_task(self):
+    task = Task.objects.all()[0]
+    self.assert_query_budget(lambda: '/monitor/task/%d/' % task.id)
+
+  def test_all_metrics(self):
+    self.assert_query_budget(lambda: '/monitor/metrics/')
+
+
+class LocalTsdbTest(SimpleTestCase):
+  def setUp(self):
+    self.root = tempfile.mkdtemp()
+    self.tsdb = local_tsdb.LocalTsdb(self.root, retention=3600)
+    self.base = 1400000000
+
+  def tearDown(self):
+    self.tsdb.close()
+    shutil.rmtree(self.root)
+
+  def get_segments(self, endpoint, group, key):
+    return self.tsdb.list_segments(self.tsdb.series_path(endpoint, group, key))
+
+  def test_put_and_read(self):
+    for i in range(10):
+      self.tsdb.put('host-1', 'Cluster', 'requests', self.base + i * 10, i)
+    # late and duplicated points are dropped
+    self.tsdb.put('host-1', 'Cluster', 'requests', self.base + 45, 100)
+    self.tsdb.put('host-1', 'Cluster', 'requests', self.base + 90, 100)
+    self.assertEqual([(self.base + 20, 2.0), (self.base + 30, 3.0)],
+      self.tsdb.read('host-1', 'Cluster', 'requests', self.base + 15,
+                     self.base + 30))
+    self.assertEqual([], self.tsdb.read('host-2', 'Cluster', 'requests',
+      self.base, self.base + 100))
+
+    # the store is shared with other processes through files
+    reader = local_tsdb.LocalTsdb(self.root)
+    self.assertEqual(10, len(reader.read('host-1', 'Cluster', 'requests',
+      self.base, self.base + 100)))
+
+  def test_unicode_endpoint(self):
+    self.tsdb.put(u'集群-1', 'Cluster', 'requests', self.base, 1)
+    self.assertEqual([(self.base, 1.0)],
+      self.tsdb.read(u'集群-1', 'Cluster', 'requests', self.base, self.base))
+
+  def test_segments_overflow(self):
+    capacity = local_tsdb.SEGMENT_CAPACITY
+    for i in range(capacity + 10):
+      self.tsdb.put('host-1', 'Cluster', 'requests', self.base + i, i)
+    # a full segment rolls to a new one
+    self.assertEqual([self.base, self.base + capacity],
+      self.get_segments('host-1', 'Cluster', 'requests'))
+
+    # a point out of the span of the delta of a segment
+    timestamp = self.base + capacity + local_tsdb.SEGMENT_SPAN
+    self.tsdb.put('host-1', 'Cluster', 'requests', timestamp, -1)
+    self.assertEqual(3, len(self.get_segments('host-1', 'Cluster', 'requests')))
+    points = self.tsdb.read('host-1', 'Cluster', 'requests', self.base,
+      timestamp)
+    self.assertEqual(capacity + 11, len(points))
+    self.assertEqual(range(capacity + 10) + [-1],
+      [value for timestamp, value in points])
+
+  def test_query(self):
+    for i in range(6):
+      self.tsdb.put('host-1', 'Cluster', 'requests', self.base + i * 10, i * 10)
+      self.tsdb.put('host-2', 'Cluster', 'requests', self.base + i * 10, i * 20)
+    series, aggregator, downsample, rate = local_tsdb.parse_metric_query(
+      'sum:30s-avg:rate:requests{host=host-1|host-2,group=Cluster}')
+    self.assertEqual([('host-1', 'Cluster', 'requests'),
+                      ('host-2', 'Cluster', 'requests')], series)
+    self.assertEqual(('sum', (30, 'avg'), True), (aggregator, downsample, rate))
+    # the rates are 1 and 2 per second
+    base = self.base - self.base % 30
+    self.assertEqual([(base + 30, 3.0), (base + 60, 3.0)],
+      self.tsdb.query(series, self.base, self.base + 50, aggregator,
+                      downsample, rate))
+
+  def test_query_aligns_series(self):
+    # the series are collected at different times in a period
+    for i in range(3):
+      self.tsdb.put('host-1', 'Cluster', 'requests', self.base + i * 10, 10)
+      self.tsdb.put('host-2', 'Cluster', 'requests', self.base + i * 10 + 5,
+        20 + i * 10)
+    series = [('host-1', 'Cluster', 'requests'),
+              ('host-2', 'Cluster', 'requests')]
+    # host-2 is interpolated to 25 and 35 at 10 and 20, and has no point at 0
+    self.assertEqual([(self.base, 10.0), (self.base + 10, 35.0),
+                      (self.base + 20, 45.0)],
+      self.tsdb.query(series, self.base, self.base + 30))
+    self.assertEqual([(self.base, 1.0)],
+      local_tsdb.align_points([(self.base + 4, 1.0)], 10))
+
+  def test_create_segment(self):
+    self.tsdb.put('host-1', 'Cluster', 'requests', self.base, 1)
+    path = self.tsdb.series_path('host-1', 'Cluster', 'requests')
+    # the temporary file is removed once the segment is linked
+    self.assertEqual(sorted([local_tsdb.SERIES_NAME_FILE,
+                             '%d%s' % (self.base, local_tsdb.SEGMENT_SUFFIX)]),
+                     sorted(os.listdir(path)))
+    segment_path = self.tsdb.segment_path(path, self.base)
+    self.assertEqual(local_tsdb.segment_size(local_tsdb.SEGMENT_CAPACITY),
+                     os.path.getsize(segment_path))
+
+    # a segment created by another process is opened, not replaced
+    segment = self.tsdb.open_segment(path, self.base, create=True)
+    try:
+      self.assertEqual([(self.base, 1.0)], segment.read(self.base, self.base))
+    finally:
+      segment.close()
+    self.assertEqual(2, len(os.listdir(path)))
+
+    # a partial segment is never mapped
+    open(segment_path, 'w').close()
+    self.assertRaises(ValueError, local_tsdb.Segment, segment_path)
+
+  def test_parse_metric_query(self):
+    self.assertEqual(([('host-1', 'Master', 'requests')], 'max', None, False),
+      local_tsdb.parse_metric_query('max:requests{host=host-1,group=Master}'))
+    for query in ('requests{host=host-1,group=Master}',
+                  'sum:requests{host=host-1}',
+                  'p99:requests{host=host-1,group=Master}',
+                  'sum:1m-p99:requests{host=host-1,group=Master}'):
+      self.assertRaises(ValueError, local_tsdb.parse_metric_query, query)
+
+  def test_parse_time(self):
+    self.assertEqual(self.base - 900, local_tsdb.parse_time('15m-ago', self.base))
+    self.assertEqual(self.base - 2 * 86400,
+      local_tsdb.parse_time('2d-ago', self.base))
+    self.assertEqual(self.base, local_tsdb.parse_time(str(self.base)))
+    self.assertEqual(
+      int(time.mktime(datetime.datetime(2013, 12, 18, 12).timetuple())),
+      local_tsdb.parse_time('2013/12/18-12:00:00'))
+    self.assertRaises(ValueError, local_tsdb.parse_time, 'yesterday')
+
+  def test_expire(self):
+    self.tsdb.put('host-1', 'Cluster', 'requests', self.base, 1)
+    self.tsdb.put('host-2', 'Cluster', 'requests', self.base, 1)
+    # a new segment expires the old segments of its series
+    timestamp = self.base + local_tsdb.SEGMENT_SPAN + 3600 + 1
+    self.tsdb.put('host-1', 'Cluster', 'requests', timestamp, 2)
+    self.assertEqual([timestamp],
+      self.get_segments('host-1', 'Cluster', 'requests'))
+    self.assertEqual([self.base],
+      self.get_segments('host-2', 'Cluster', 'requests'))
+
+    # the dead series are removed
+    self.tsdb.expire_all(timestamp)
+    path = self.tsdb.series_path('host-2', 'Cluster', 'requests')
+    self.assertFalse(os.path.exists(path))
+    self.assertEqual([(timestamp, 2.0)], self.tsdb.read('host-1', 'Cluster',
+      'requests', self.base, timestamp))
+
+@override_settings(VIEW_CACHE_ENABLED=True, VIEW_CACHE_TIMEOUT=300)
+class ViewCacheTest(TestCase):
+  def setUp(self):
+    get_cache(settings.VIEW_CACHE_ALIAS).clear()
+    service = Service.objects.create(name='hbase', metric_url='/jmx')
+    self.cluster = Cluster.objects.create(service=service, name='test-cluster',
+      last_attempt_time=timezone.now().replace(microsecond=0))
+    self.computed = []
+
+  def get_board(self):
+    def compute():
+      self.computed.append(view_cache.get_cycle(self.cluster))
+      return {'rows': len(self.computed)}
+    return view_cache.get_or_set(self.cluster, 'table_board', compute)
+
+  def test_same_cycle(self):
+    self.assertEqual({'rows': 1}, self.get_board())
+    self.assertEqual({'rows': 1}, self.get_board())
+    self.assertEqual(1, len(self.computed))
+    # the other entries of the cycle are independent
+    self.assertEqual('regionservers', view_cache.get_or_set(self.cluster,
+      'regionserver_board', lambda: 'regionservers'))
+    self.assertEqual({'rows': 1}, self.get_board())
+
+  def test_new_cycle(self):
+    cycle = view_cache.get_cycle(self.cluster)
+    self.get_board()
+    self.cluster.last_attempt_time += datetime.timedelta(seconds=10)
+    self.assertEqual({'rows': 2}, self.get_board())
+    self.assertEqual([cycle, cycle + 10], self.computed)
+    # the entries of the previous cycle are kept for the deltas
+    self.assertEqual({'rows': 1},
+      view_cache.get(self.cluster, 'table_board', cycle))
+
+  def test_invalidate(self):
+    self.get_board()
+    view_cache.invalidate(self.cluster, 'table_board')
+    self.assertEqual({'rows': 2}, self.get_board())
+    self.assertEqual({'rows': 2}, self.get_board())
+
+  def test_disabled(self):
+    with self.settings(VIEW_CACHE_ENABLED=False):
+      self.get_board()
+      self.get_board()
+    self.assertEqual(2, len(self.computed))
+
+# the long poll commits the transaction of the request, which TestCase forbids
+@override_settings(VIEW_CACHE_ENABLED=True, API_LONG_POLL_TIMEOUT=5,
+  API_LONG_POLL_MAX_WAITING=4)
+class ApiTest(TransactionTestCase):
+  def setUp(self):
+    get_cache(settings.VIEW_CACHE_ALIAS).clear()
+    now = timezone.now().replace(microsecond=0)
+    service = Service.objects.create(name='hdfs', metric_url='/jmx')
+    self.cluster = Cluster.objects.create(service=service, name='test-cluster',
+      last_attempt_time=now, last_success_time=now)
+    job = Job.objects.create(cluster=self.cluster, name='datanode',
+      last_success_time=now)
+    self.task = Task.objects.create(job=job, task_id=0, host='10.0.0.1',
+      port=12001, last_success_time=now)
+    self.url = '/monitor/api/cluster/%d/tasks/' % self.cluster.id
+    self.cycle = view_cache.get_cycle(self.cluster)
+
+  def get_json(self, query=''):
+    response = self.client.get(self.url + query)
+    self.assertEqual(200, response.status_code)
+    return json.loads(response.content)
+
+  def patch(self, module, name, value):
+    original = getattr(module, name)
+    setattr(module, name, value)
+    self.addCleanup(setattr, module, name, original)
+
+  def test_rows(self):
+    result = self.get_json()
+    self.assertTrue(result['full'])
+    self.assertEqual(self.cycle, result['cycle'])
+    self.assertEqual([], result['removed'])
+    row = result['rows'][0]
+    self.assertEqual((self.task.id, 'datanode', 0, '10.0.0.1', 12001),
+      (row['id'], row['job'], row['task_id'], row['host'], row['port']))
+    for key in ('health', 'last_status', 'last_message', 'last_success_time'):
+      self.assertIn(key, row)
+    self.assertIn('last_status', result['cluster'])
+
+  def test_immediate_return(self):
+    start = time.time()
+    # a stale cycle gets all rows without waiting
+    result = self.get_json('?since=%d&wait=5' % (self.cycle - 60))
+    self.assertTrue(result['full'])
+    self.assertEqual(1, len(result['rows']))
+    # no new cycle in the wait
+    result = self.get_json('?since=%d&wait=-5' % self.cycle)
+    self.assertEqual({'cycle': self.cycle, 'full': False, 'rows': [],
+                      'removed': []}, result)
+    with self.settings(API_LONG_POLL_TIMEOUT=0):
+      self.get_json('?since=%d&wait=100' % self.cycle)
+    self.assertLess(time.time() - start, 1)
+
+  def test_new_cycle(self):
+    self.get_json()
+    new_time = self.cluster.last_attempt_time + datetime.timedelta(seconds=10)
+    polls = []
+    def get_latest_cycle(cluster_id):
+      polls.append(cluster_id)
+      if len(polls) < 3:
+        return self.cycle
+      # the collector commits a new cycle in the wait
+      Task.objects.filter(id=self.task.id).update(last_message='restarted')
+      Cluster.objects.filter(id=cluster_id).update(last_attempt_time=new_time)
+      return calendar.timegm(new_time.utctimetuple())
+    self.patch(api, 'POLL_INTERVAL', 0.01)
+    self.patch(view_cache, 'get_latest_cycle', get_latest_cycle)
+
+    result = self.get_json('?since=%d&wait=5' % self.cycle)
+    self.assertEqual(3, len(polls))
+    self.assertEqual(self.cycle + 10, result['cycle'])
+    self.assertFalse(result['full'])
+    self.assertEqual(['restarted'],
+      [row['last_message'] for row in result['rows']])
+
+  def test_max_waiting(self):
+    self.patch(api, 'waiting', 4)
+    start = time.time()
+    result = self.get_json('?since=%d&wait=5' % self.cycle)
+    self.assertEqual({'cycle': self.cycle, 'full': False, 'rows': [],
+                      'removed': []}, result)
+    self.assertLess(time.time() - start, 1)
+    self.assertEqual(4, api.waiting)
+
+    # the waiting requests are counted until they return
+    polls = []
+    def get_latest_cycle(cluster_id):
+      polls.append(api.waiting)
+      return self.cycle + 10
+    self.patch(view_cache, 'get_latest_cycle', get_latest_cycle)
+    api.waiting = 0
+    self.get_json('?since=%d&wait=5' % self.cycle)
+    self.assertEqual([1], polls)
+    self.assertEqual(0, api.waiting)
+
+  def test_bad_params(self):
+    for query in ('?since=abc', '?since=%d&wait=x' % self.cycle, '?wait=1.5'):
+      response = self.client.get(self.url + query)
+      self.assertEqual(400, response.status_code)
+
+@unittest.skipUnless(
+  settings.DATABASES['default']['ENGINE'].endswith('sqlite3'),
+  "batch storage tests run on sqlite")
+class BatchStorageTest(TestCase):
+  def setUp(self):
+    service = Service.objects.create(name='hbase', metric_url='/jmx')
+    self.cluster = Cluster.objects.create(service=service, name='test-cluster')
+    job = Job.objects.create(cluster=self.cluster, name='regionserver')
+    task = Task.objects.create(job=job, task_id=0, host='10.0.0.1', port=12001)
+    self.rs = RegionServer.objects.create(cluster=self.cluster, task=task,
+      name='10.0.0.1,12000,1')
+    self.table = Table.objects.create(cluster=self.cluster, name='test_table')
+    self.region = Region.objects.create(table=self.table, region_server=self.rs,
+      name='test_table,,1.%032d.' % 0, encodeName='%032d' % 0)
+
+  def test_storage_backend(self):
+    self.assertTrue(isinstance(storage.get_storage(), storage.SQLiteStorage))
+
+  def test_update_regions_for_master_metrics(self):
+    self.region.readRequestsCountPerSec = 10.0
+    self.region.storefileSizeMB = 100
+    self.region.last_attempt_time = timezone.now().replace(microsecond=0)
+    dbutil.update_regions_for_master_metrics([self.region])
+
+    region = Region.objects.get(id=self.region.id)
+    self.assertEqual(10.0, region.readRequestsCountPerSec)
+    self.assertEqual(100, region.storefileSizeMB)
+    self.assertEqual(self.region.last_attempt_time, region.last_attempt_time)
+
+  def test_save_distributions(self):
+    summary = {'count': 1, 'sum': 1.0, 'top': [['r', 1, 1.0]], 'histogram': []}
+    now = timezone.now()
+    dbutil.save_distributions(self.cluster,
+      [('table', self.table.id, 'read_requests', summary)], now)
+    summary['sum'] = 2.0
+    dbutil.save_distributions(self.cluster,
+      [('table', self.table.id, 'read_requests', summary)], now)
+
+    self.assertEqual(1, Distribution.objects.count())
+    self.assertEqual(summary, dbutil.get_fresh_distributions(
+      'table', self.table.id)['read_requests'])
+
+
+def make_region_name(start_key, region_id):
+  return 'test_table,%s,%d.%032d.' % (start_key, region_id, region_id)
+
+class RegionEventTest(unittest.TestCase):
+  def test_split(self):
+    previous = [make_region_name('', 1), make_region_name('b', 2)]
+    current = [make_region_name('', 3), make_region_name('a', 4),
+               make_region_name('b', 2)]
+    self.assertEqual([(region_lifecycle.EVENT_SPLIT, [previous[0]], current[:2])],
+      region_lifecycle.detect_events(previous, current))
+
+  def test_merge(self):
+    previous = [make_region_name('', 1), make_region_name('a', 2),
+                make_region_name('b', 3)]
+    current = [make_region_name('a', 4), make_region_name('', 1)]
+    self.assertEqual([(region_lifecycle.EVENT_MERGE, previous[1:], [current[0]])],
+      region_lifecycle.detect_events(previous, current))
+
+  def test_move(self):
+    names = [make_region_name('', 1), make_region_name('a', 2)]
+    self.assertEqual([], region_lifecycle.detect_events(names, list(reversed(names))))
+    self.assertEqual([], region_lifecycle.detect_events([], names))
+
+@override_settings(REGION_RETENTION=3600, REGION_HISTORY_RETENTION=7200)
+class RegionPruneTest(TestCase):
+  def setUp(self):
+    service = Service.objects.create(name='hbase', metric_url='/jmx')
+    cluster = Cluster.objects.create(service=service, name='test-cluster')
+    job = Job.objects.create(cluster=cluster, name='regionserver')
+    task = Task.objects.create(job=job, task_id=0, host='10.0.0.1', port=12001)
+    rs = RegionServer.objects.create(cluster=cluster, task=task,
+      name='10.0.0.1,12000,1')
+    self.table = Table.objects.create(cluster=cluster, name='test_table')
+    now = timezone.now()
+    for region_id, age in enumerate([0, 60, 3 * 3600]):
+      Region.objects.create(table=self.table, region_server=rs,
+        name=make_region_name(region_id, region_id),
+        encodeName='%032d' % region_id, storefileSizeMB=region_id,
+        last_attempt_time=now - datetime.timedelta(seconds=age))
+
+  def test_prune_dead_regions(self):
+    self.assertEqual(1, region_lifecycle.prune_dead_regions())
+    self.assertEqual(2, Region.objects.count())
+    history = RegionHistory.objects.get()
+    self.assertEqual(make_region_name(2, 2), history.name)
+    self.assertEqual(2, history.storefileSizeMB)
+    self.assertEqual(0, region_lifecycle.prune_dead_regions())
+
+
+class TrackRegionEventsTest(TestCase):
+  def test_track_region_events(self):
+    service = Service.objects.create(name='hbase', metric_url='/jmx')
+    cluster = Cluster.objects.create(service=service, name='test-cluster')
+    job = Job.objects.create(cluster=cluster, name='regionserver')
+    task = Task.objects.create(job=job, task_id=0, host='10.0.0.1', port=12001)
+    rs = RegionServer.objects.create(cluster=cluster, task=task,
+      name='10.0.0.1,12000,1')
+    tables = dict((name, Table.objects.create(cluster=cluster, name=name))
+                  for name in ('table1', 'table2'))
+    previous_time = timezone.now().replace(microsecond=0)
+    for table_name, start_key, region_id, age in [
+        ('table1', '', 1, 0), ('table1', 'b', 2, 0),
+        # a dead region of the snapshots before
+        ('table1', 'c', 3, 3600),
+        ('table2', '', 5, 0), ('table2', 'a', 6, 0), ('table2', 'b', 7, 0)]:
+      Region.objects.create(table=tables[table_name], region_server=rs,
+        name=make_region_name(start_key, region_id),
+        encodeName='%032d' % region_id,
+        last_attempt_time=previous_time - datetime.timedelta(seconds=age))
+
+    regions = [Region(table=tables[table_name],
+                      name=make_region_name(start_key, region_id))
+               for table_name, start_key, region_id in [
+                 ('table1', '', 11), ('table1', 'a', 12), ('table1', 'b', 2),
+                 ('table2', '', 5), ('table2', 'a', 13)]]
+    # one query of the previous regions of all tables, and one insert
+    with self.assertNumQueries(2):
+      events = region_lifecycle.track_region_events(cluster, tables,
+        {'table1': previous_time, 'table2': previous_time}, regions,
+        previous_time + datetime.timedelta(seconds=10))
+    self.assertEqual([
+      ('table1', region_lifecycle.EVENT_SPLIT, [make_region_name('', 1)],
+       [make_region_name('', 11), make_region_name('a', 12)]),
+      ('table2', region_lifecycle.EVENT_MERGE,
+       [make_region_name('a', 6), make_region_name('b', 7)],
+       [make_region_name('a', 13)]),
+    ], sorted((event.table.name, event.event_type, json.loads(event.parents),
+               json.loads(event.children)) for event in events))
+    self.assertEqual(2, RegionEvent.objects.count())
+
+
+class FakeRegion:
+  def __init__(self, id, table_id, region_server_id, read, write):
+    self.id = id
+    self.table_id = table_id
+    self.region_server_id = region_server_id
+    self.readRequestsCountPerSec = read
+    self.writeRequestsCountPerSec = write
+
+@override_settings(SKEW_TOP_K=2, SKEW_HOT_REGION_RATIO=3,
+  SKEW_HOT_REGION_MIN_VALUE=10, SKEW_HOT_REGION_COUNT=2, SKEW_RS_DEVIATION=0.5)
+class SkewTest(SimpleTestCase):
+  def analyze(self, regions):
+    summaries = skew.analyze_regions(regions, lambda region: 'r%d' % region.id)
+    return dict(((owner_type, owner_id, name), summary)
+                for owner_type, owner_id, name, summary in summaries)
+
+  def test_hot_region(self):
+    summaries = self.analyze([
+      FakeRegion(1, 10, 100, 1, 0), FakeRegion(2, 10, 100, 1, 0),
+      FakeRegion(3, 10, 101, 100, 0), FakeRegion(4, 10, 101, 1, 0),
+      FakeRegion(5, 20, 100, 5, 5), FakeRegion(6, 20, 101, 5, 5)])
+
+    table = summaries[('table', 10, 'read_requests')]
+    self.assertEqual(4, table['count'])
+    self.assertAlmostEqual(103, table['total'])
+    self.assertAlmostEqual(0.7209, table['gini'], 4)
+    self.assertAlmostEqual(1, table['median'])
+    self.assertAlmostEqual(97.03, table['p99'])
+    self.assertAlmostEqual(101.0 / 103, table['top_share'])
+    self.assertEqual([['r3', 3, 100.0]], table['hot_regions'])
+    self.assertTrue(table['flagged'])
+
+    even_table = summaries[('table', 20, 'read_requests')]
+    self.assertAlmostEqual(0, even_table['gini'])
+    self.assertFalse(even_table['flagged'])
+
+    rs = summaries[('regionserver', 101, 'read_requests')]
+    self.assertEqual([['r3', 3, 100.0]], rs['hot_regions'])
+    self.assertAlmostEqual(99.0 / 113, rs['deviation'])
+    self.assertTrue(summaries[('regionserver', 100, 'read_requests')]['flagged'])
+    self.assertFalse(summaries[('regionserver', 100, 'write_requests')]['flagged'])
+
+  def test_hot_region_count(self):
+    regions = [FakeRegion(i, 10, 100, 1, 0) for i in range(20)]
+    regions += [FakeRegion(20 + i, 10, 100, 100 + i, 0) for i in range(3)]
+    table = self.analyze(regions)[('table', 10, 'read_requests')]
+    self.assertEqual(['r22', 'r21'], [label for label, id, value in table['hot_regions']])
+
+
+class ClusterRollupTest(SimpleTestCase):
+  def make_datanode_metrics(self, dfs_used, bytes_read):
+    return {
+      'Hadoop:service=DataNode,name=FSDatasetState-DS-1': {
+        'DfsUsed': dfs_used, 'Remaining': 0, 'Capacity': 0,
+      },
+      'Hadoop:service=DataNode,name=DataNodeActivity-host-12402': {
+        'BytesRead': bytes_read, 'BytesWritten': 0,
+        'BlocksRead': 0, 'BlocksWritten': 0,
+      },
+    }
+
+  def compute(self, job_metrics, previous, update_time):
+    rollups = cluster_rollup.compute_rollups('hdfs', job_metrics, previous,
+      update_time)
+    return dict((name, (value, total)) for name, value, total, unit in rollups)
+
+  def test_rollups(self):
+    start = timezone.now()
+    job_metrics = {'datanode': [
+      (True, self.make_datanode_metrics(cluster_rollup.GB, 100)),
+      (True, self.make_datanode_metrics(2 * cluster_rollup.GB, 200)),
+      (False, self.make_datanode_metrics(4 * cluster_rollup.GB, 400)),
+    ]}
+    rollups = self.compute(job_metrics, {}, start)
+    self.assertEqual((3.0, 3 * cluster_rollup.GB), rollups['DfsUsedGB'])
+    self.assertEqual((0, 700), rollups['BytesReadPerSec'])
+
+    previous = dict((name, (total, start)) for name, (value, total) in rollups.iteritems())
+    job_metrics['datanode'][0] = (True, self.make_datanode_metrics(0, 1100))
+    rollups = self.compute(job_metrics, previous,
+      start + datetime.timedelta(seconds=10))
+    self.assertEqual((2.0, 2 * cluster_rollup.GB), rollups['DfsUsedGB'])
+    self.assertEqual((100.0, 1700), rollups['BytesReadPerSec'])
+
+    # a restarted task resets its counters
+    job_metrics['datanode'][0] = (True, self.make_datanode_metrics(0, 0))
+    rollups = self.compute(job_metrics, previous,
+      start + datetime.timedelta(seconds=10))
+    self.assertEqual((0, 600), rollups['BytesReadPerSec'])
+
+  def test_job_series(self):
+    job_metrics = {'datanode': [
+      (True, self.make_datanode_metrics(0, 100)),
+      (True, self.make_datanode_metrics(0, 300)),
+      (False, self.make_datanode_metrics(0, 900)),
+    ]}
+    series = dict(((group, key), value) for group, key, value in
+                  cluster_rollup.compute_job_series('hdfs', job_metrics))
+    self.assertEqual(400, series[('DataNode.datanode.sum', 'BytesRead')])
+    self.assertEqual(200.0, series[('DataNode.datanode.avg', 'BytesRead')])
+    self.assertEqual(300, series[('DataNode.datanode.max', 'BytesRead')])
+    # only the metrics of job pages are aggregated
+    self.assertNotIn(('DataNode.datanode.sum', 'DfsUsed'), series)
+    self.assertNotIn(('NameNode.namenode.sum', 'BytesRead'), series)
+
+
+class StatusMetricsTest(TestCase):
+  def create_task(self, cluster, job_name, task_id, metrics, now):
+    job, created = Job.objects.get_or_create(cluster=cluster, name=job_name)
+    task = Task.objects.create(job=job, task_id=task_id, host='10.0.0.1',
+      port=12000 + task_id, last_attempt_time=now, last_success_time=now)
+    metrics_updater.save_task_status_metrics(task, metrics)
+    return task
+
+  def test_status_metrics(self):
+    now = timezone.now().replace(microsecond=0)
+    service = Service.objects.create(name='hdfs', metric_url='/jmx')
+    cluster = Cluster.objects.create(service=service, name='test-cluster')
+    namenode = self.create_task(cluster, 'namenode', 0, {
+      'Hadoop:service=NameNode,name=FSNamesystem': {
+        'tag.HAState': 1, 'FilesTotal': 10,
+      },
+      'Hadoop:service=NameNode,name=NameNodeInfo': {
+        'Version': '2.4.0', 'LiveNodes': '{}',
+      },
+    }, now)
+    for i in range(3):
+      self.create_task(cluster, 'journalnode', 10 + i, {}, now)
+      self.create_task(cluster, 'datanode', 20 + i, {
+        'Hadoop:service=DataNode,name=FSDatasetState-DS-1': {
+          'DfsUsed': cluster_rollup.GB, 'NumFailedVolumes': 0,
+        },
+      }, now)
+
+    # only the metrics read by the status updater are saved
+    status_metrics = dbutil.get_task_status_metrics(cluster)
+    self.assertEqual({
+      'Hadoop:service=NameNode,name=FSNamesystem': {'tag.HAState': 1},
+      'Hadoop:service=NameNode,name=NameNodeInfo': {'Version': '2.4.0'},
+    }, status_metrics[namenode.id])
+    # nothing is saved for journalnodes
+    self.assertEqual(4, len(status_metrics))
+
+    status_updater.update_cluster_status(cluster, time.time())
+    cluster = Cluster.objects.get(id=cluster.id)
+    self.assertEqual('10.0.0.1:12000', cluster.entry)
+    self.assertEqual('2.4.0', cluster.version)
+    self.assertEqual(3.0, ClusterSummary.objects.get(cluster=cluster,
+      name='DfsUsedGB').value)
+
+
+class StormMetricsTest(SimpleTestCase):
+  def test_normalize(self):
+    raw = {
+      'topology-1': {
+        'STORM_BUILTIN_SPOUT_METRICS': {'__ack-count': 10},
+        'STORM_BUILTIN_BOLT_METRICS': {'__execute-count': 20},
+        'STORM_SYSTEM_MYHOST:6700': {
+          'GC/ConcurrentMarkSweep': 3,
+          'memory/heap:used': 100,
+          'uptimeSecs': 60,
+        },
+        'counter:5': {'count': 1},
+      },
+    }
+    slices = dict(((storm_id, kind), data)
+                  for storm_id, kind, data in storm_metrics.normalize(raw))
+
+    self.assertEqual({'__ack-count': 10},
+      slices[('topology-1', storm_metrics.KIND_SPOUT)])
+    self.assertEqual({'counter': {'5': {'count': 1}}},
+      slices[('topology-1', storm_metrics.KIND_USER)])
+    worker = slices[('topology-1', storm_metrics.KIND_SYSTEM)][0]
+    self.assertEqual('MYHOST:6700', worker['worker_endpoint'])
+    self.assertEqual('ConcurrentMarkSweep:3', worker['GC'])
+    self.assertEqual('used:100', worker['memory_heap'])
+    self.assertEqual(60, worker['uptime_sec'])
+    self.assertEqual('ack_count', storm_metrics.get_builtin_field_name('__ack-count'))
+
+    counters = set(storm_metrics.iter_counters(storm_metrics.KIND_USER,
+      slices[('topology-1', storm_metrics.KIND_USER)]))
+    self.assertEqual(set([('counter:5', 'count', 1)]), counters)
+
+@override_settings(VIEW_CACHE_ENABLED=False, PROFILE_SAMPLE_RATE=0.0,
+                   SLOW_VIEW_THRESHOLD=1000)
+class ProfilingTest(TestCase):
+  def setUp(self):
+    get_cache(settings.VIEW_CACHE_ALIAS).delete(middleware.PROFILE_HISTORY_KEY)
+    user = User.objects.create_user('staff', password='staff')
+    user.is_staff = True
+    user.save()
+
+  def test_not_profiled(self):
+    self.client.get('/monitor/?profile=1')
+    self.assertEqual([], middleware.get_profiles())
+
+  def test_profile_by_staff(self):
+    self.client.login(username='staff', password='staff')
+    self.client.get('/monitor/?profile=1')
+    profiles = middleware.get_profiles()
+    self.assertEqual(1, len(profiles))
+    self.assertEqual('/monitor/?profile=1', profiles[0]['path'])
+    self.assertGreater(profiles[0]['query_count'], 0)
+    self.assertGreater(profiles[0]['template_time'], 0)
+    self.assertIn('cumulative', profiles[0]['call_sites'])
+
+    response = self.client.get('/profiles/')
+    self.assertEqual(200, response.status_code)
+    self.assertEqual(1, len(response.context['profiles']))
+
+  @override_settings(PROFILE_SAMPLE_RATE=1.0, PROFILE_HISTORY_SIZE=2)
+  def test_sampled_history(self):
+    for i in range(3):
+      self.client.get('/monitor/?page=%d' % i)
+    profiles = middleware.get_profiles()
+    self.assertEqual(['/monitor/?page=2', '/monitor/?page=1'],
+                     [profile['path'] for profile in profiles])
+
+FLEET_OPTIONS = {
+  'clusters': 1,
+  'tasks': 5,
+  'tables': 5,
+  'regions': 50,
+  'quotas': 3,
+  'topologies': 2,
+  'failover_tasks': 5,
+}
+
+@override_settings(TSDB_PROXY_MIN_TTL=15, TSDB_PROXY_TTL_RATIO=0.002,
+  TSDB_PROXY_CLOSED_AGE=600, TSDB_PROXY_CLOSED_TTL=3600,
+  TSDB_PROXY_MAX_POINTS=1000, TSDB_PROXY_TIMEOUT=5, TSDB_PROXY_ERROR_TTL=5)
+class TsdbProxyTest(SimpleTestCase):
+  METRIC = 'sum:readRequestsCountPerSec{host=test-cluster,group=Cluster}'
+
+  def setUp(self):
+    get_cache(settings.VIEW_CACHE_ALIAS).clear()
+
+  def normalize(self, query, now):
+    return tsdb_proxy.normalize_query(QueryDict(query), now)
+
+  def test_normalize_live_range(self):
+    now = 1400000000
+    start = tsdb_proxy.format_time(now - 900)
+    query, ttl = self.normalize('start=%s&m=%s&ignore=1&png' % (start, self.METRIC), now)
+    self.assertEqual(15, ttl)
+    self.assertNotIn('ignore', query)
+    self.assertIn('png', query)
+    # the queries of the viewers in the same ttl share the cache entry
+    start = tsdb_proxy.format_time(now + 5 - 900)
+    self.assertEqual((query, ttl), self.normalize(
+      'png&start=%s&m=%s' % (start, self.METRIC), now + 5))
+
+    query, ttl = self.normalize('start=1d-ago&m=%s' % self.METRIC, now)
+    self.assertEqual(172, ttl)
+    self.assertIn('sum%3A2m-avg%3AreadRequestsCountPerSec', query)
+
+  def test_normalize_closed_range(self):
+    now = 1400000000
+    query, ttl = self.normalize('start=%d&end=%d&m=%s' % (
+      now - 7200, now - 3600, self.METRIC), now)
+    self.assertEqual(3600, ttl)
+    self.assertIn(tsdb_proxy.format_time(now - 7200).replace('/', '%2F')
+      .replace(':', '%3A'), query)
+    self.assertRaises(ValueError, self.normalize,
+      'start=%d&end=%d' % (now, now - 1), now)
+
+  def test_coalesce(self):
+    fetched = []
+    def fetch(query):
+      fetched.append(query)
+      time.sleep(0.2)
+      return 200, 'image/png', 'graph'
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+      tsdb_proxy.get_result('start=1h-ago', 15, fetch))) for i in range(5)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(1, len(fetched))
+    self.assertEqual([(200, 'image/png', 'graph')] * 5, results)
+
+    # the errors are cached shortly
+    error = (502, 'text/plain', '')
+    tsdb_proxy.get_result('start=2h-ago', 15, lambda query: error)
+    self.assertEqual(error, tsdb_proxy.get_result('start=2h-ago', 15, fetch))
+    self.assertEqual(1, len(fetched))
+    with self.settings(TSDB_PROXY_ERROR_TTL=0):
+      tsdb_proxy.get_result('start=3h-ago', 15, lambda query: error)
+      tsdb_proxy.get_result('start=3h-ago', 15, fetch)
+    self.assertEqual(2, len(fetched))
+
+  def test_wait_for_other_process(self):
+    cache = get_cache(settings.VIEW_CACHE_ALIAS)
+    cache.set('test:lock', 1)
+    def fetch():
+      time.sleep(0.2)
+      cache.set('test', 'result')
+      cache.delete('test:lock')
+    thread = threading.Thread(target=fetch)
+    thread.start()
+    self.assertEqual('result',
+      tsdb_proxy.wait_for_other_process(cache, 'test', 'test:lock'))
+    thread.join()
+
+    # the waiters don't wait for a lock released without a result
+    cache.set('test:lock', 1)
+    threading.Timer(0.2, cache.delete, ['test:lock']).start()
+    start = time.time()
+    self.assertEqual(None,
+      tsdb_proxy.wait_for_other_process(cache, 'failed', 'test:lock'))
+    self.assertLess(time.time() - start, 1)
+
+class FakeTsdbHandler(SocketServer.StreamRequestHandler):
+  def handle(self):
+    for line in self.rfile:
+      self.server.lines.append(line)
+
+class FakeTsdbServer(SocketServer.ThreadingTCPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+@override_settings(TSDB_EXPORT_ENABLED=False)
+class TsdbExportTest(TestCase):
+  def patch(self, module, name, value):
+    original = getattr(module, name)
+    setattr(module, name, value)
+    self.addCleanup(setattr, module, name, original)
+
+  def start_fake_tsdb(self):
+    server = FakeTsdbServer(('127.0.0.1', 0), FakeTsdbHandler)
+    server.lines = []
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    self.addCleanup(server.server_close)
+    self.addCleanup(server.shutdown)
+    return server
+
+  def wait_for_lines(self, server, count):
+    deadline = time.time() + 5
+    while len(server.lines) < count and time.time() < deadline:
+      time.sleep(0.01)
+    return sorted(server.lines)
+
+  def test_export_task_metrics(self):
+    server = self.start_fake_tsdb()
+    writer = utils.tsdb_client.tsdb_writer.TsdbWriter(
+      ['127.0.0.1:%d' % server.server_address[1]], concurrency=1)
+    self.addCleanup(writer.close)
+    self.patch(utils.tsdb_client, 'writer', writer)
+    registered = []
+    self.patch(utils.tsdb_client, 'register_keys', registered.extend)
+
+    now = timezone.now()
+    service = Service.objects.create(name='hdfs', metric_url='/jmx')
+    cluster = Cluster.objects.create(service=service, name='test-cluster')
+    job = Job.objects.create(cluster=cluster, name='datanode')
+    task = Task.objects.create(job=job, task_id=0, host='10.0.0.1', port=12001,
+      last_attempt_time=now)
+    timestamp = calendar.timegm(now.utctimetuple())
+    metrics = {
+      'hadoop:service=DataNode,name=DataNodeActivity-10.0.0.1-12002': {
+        'BytesRead': 10,
+        'tag.Hostname': 'host-1',
+      },
+      'hadoop:service=DataNode,name=FSDatasetState-DS#1': {
+        'Capacity#Used': 1.5,
+      },
+    }
+    with self.settings(TSDB_EXPORT_ENABLED=True):
+      metrics_updater.export_task_metrics_to_tsdb(task, metrics)
+      # the points are buffered until the worker is idle
+      self.assertEqual([], server.lines)
+      metrics_updater.flush_exported_metrics()
+
+    self.assertEqual(['BytesRead', 'Capacity_Used'], sorted(registered))
+    self.assertEqual([
+      'put BytesRead %d 10 group=DataNode host=10.0.0.1-12001\n' % timestamp,
+      'put Capacity_Used %d 1.5 group=DataNode host=10.0.0.1-12001\n' % timestamp,
+    ], self.wait_for_lines(server, 2))
+
+  def test_all_metrics_without_tasks(self):
+    fleet.generate_fleet(FLEET_OPTIONS)
+    task = Task.objects.filter(job__name='regionserver')[0]
+    endpoint = metric_helper.form_perf_counter_endpoint_name(task)
+    self.assertIn(endpoint, dbutil.get_all_metrics())
+    # the task metrics are pushed by the collector
+    with self.settings(TSDB_EXPORT_ENABLED=True):
+      metrics = dbutil.get_all_metrics()
+    self.assertNotIn(endpoint, metrics)
+    self.assertIn(Cluster.objects.filter(service__name='hbase')[0].name, metrics)
+
+@override_settings(VIEW_CACHE_ENABLED=False)
+class BenchmarkTest(TestCase):
+  def test_all_views_covered(self):
+    self.assertEqual([], benchmark.get_uncovered_views())
+
+  def test_benchmark_fleet(self):
+    fleet.generate_fleet(FLEET_OPTIONS)
+    self.assertEqual(5, RegionServer.objects.count())
+    self.assertTrue(Region.objects.exists())
+    results = benchmark.run_benchmark(1)
+    self.assertEqual([], benchmark.compare_with_baseline(results, {}, 0.5))
+    self.assertEqual([], benchmark.compare_with_baseline(results, results, 0))
+
+    baseline = dict((name, dict(result)) for name, result in results.iteritems())
+    baseline['table']['query_count'] -= 1
+    self.assertEqual(1, len(benchmark.compare_with_baseline(results, baseline, 0)))
+
+  def test_percentile(self):
+    self.assertEqual(2, benchmark.percentile([3, 1, 2], 0.5))
+    self.assertAlmostEqual(2.98, benchmark.percentile([3, 1, 2], 0.99))
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+#
+# A caching proxy of the graph queries of opentsdb.
+#
+# The graphs of owl pages are loaded by browsers from the /q api of opentsdb,
+# and every viewer of a page sends the same heavy queries. The proxy
+# normalizes a query, so the queries of a time range share a cache entry,
+# and only one of the identical queries in flight is sent to opentsdb.
+#
+# The start and end of a range ending now are aligned to its ttl, which is a
+# fraction of the range, and a closed range is cached longer since its data
+# doesn't change. The metrics of a wide range are downsampled to at most
+# TSDB_PROXY_MAX_POINTS points, unless the query downsamples them already.
+import hashlib
+import logging
+import math
+import threading
+import time
+import urllib
+import urllib2
+
+from django.conf import settings
+from django.core.cache import get_cache
+
+import local_tsdb
+import owl_config
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'owl:tsdb_proxy'
+# the params not sent to opentsdb, the gui of opentsdb appends 'ignore' to
+# avoid the cache of browsers
+IGNORED_PARAMS = set(['ignore'])
+TIME_FORMAT = '%Y/%m/%d-%H:%M:%S'
+# the interval to check if another process has fetched a query
+POLL_INTERVAL = 0.1
+
+# the [event, result] of the queries in flight of the process
+inflight = {}
+inflight_lock = threading.Lock()
+
+def format_time(timestamp):
+  return time.strftime(TIME_FORMAT, time.localtime(timestamp))
+
+def get_ttl(start, end, now):
+  """
+  Return the seconds to cache the result of a range.
+  """
+  if end < now - settings.TSDB_PROXY_CLOSED_AGE:
+    return settings.TSDB_PROXY_CLOSED_TTL
+  return max(settings.TSDB_PROXY_MIN_TTL,
+             int((end - start) * settings.TSDB_PROXY_TTL_RATIO))
+
+def downsample_metric(query, interval):
+  """
+  Downsample a metric query to an average of interval seconds, if it isn't
+  downsampled, eg: sum:rate:key{host=a,group=b} to sum:5m-avg:rate:key{...}
+  """
+  match = local_tsdb.METRIC_QUERY_PATTERN.match(query)
+  if not match or match.group('interval'):
+    return query
+  minutes = int(math.ceil(interval / 60.0))
+  aggregator = match.group('aggregator')
+  return '%s:%dm-avg:%s' % (aggregator, minutes, query[len(aggregator) + 1:])
+
+def normalize_query(params, now):
+  """
+  Normalize the params of a /q query.
+
+  params: a QueryDict
+  Return (query string, ttl), ValueError is raised if the time range is
+  invalid.
+  """
+  start = local_tsdb.parse_time(params.get('start', '1h-ago'), now)
+  end = local_tsdb.parse_time(params['end'], now) if 'end' in params else int(now)
+  if start >= end:
+    raise ValueError("Invalid time range: %d-%d" % (start, end))
+  ttl = get_ttl(start, end, now)
+  if end >= now - settings.TSDB_PROXY_CLOSED_AGE:
+    # the range ending now moves every ttl seconds
+    start -= start % ttl
+    end -= end % ttl
+
+  metrics = params.getlist('m')
+  max_points = settings.TSDB_PROXY_MAX_POINTS
+  if max_points and end - start > max_points * 60:
+    metrics = [downsample_metric(query, (end - start) / float(max_points))
+               for query in metrics]
+
+  pairs = [('start', format_time(start)), ('end', format_time(end))]
+  pairs += [('m', query) for query in metrics]
+  for name in sorted(params.keys()):
+    if name in ('start', 'end', 'm') or name in IGNORED_PARAMS:
+      continue
+    pairs += [(name, value) for value in params.getlist(name)]
+  return urllib.urlencode([(name, value.encode('utf-8'))
+                           for name, value in pairs]), ttl
+
+def fetch(query):
+  """
+  Fetch a query from opentsdb, return (status, content type, content).
+  """
+  url = '%s/q?%s' % (owl_config.TSDB_ADDR, query)
+  try:
+    response = urllib2.urlopen(url, timeout=settings.TSDB_PROXY_TIMEOUT)
+    return 200, response.info().gettype(), response.read()
+  except urllib2.HTTPError as e:
+    return e.code, e.info().gettype(), e.read()
+  except Exception as e:
+    logger.warning("Failed to fetch %s: %r", url, e)
+    return 502, 'text/plain', 'Failed to query tsdb: %r' % e
+
+def wait_for_other_process(cache, key, lock_key):
+  """
+  Wait for the result of a query fetched by another process, return None if
+  the process released the lock without a result, or it timed out.
+  """
+  deadline = time.time() + settings.TSDB_PROXY_TIMEOUT
+  while time.time() < deadline:
+    time.sleep(POLL_INTERVAL)
+    result = cache.get(key)
+    if result is not None:
+      return result
+    # the result is cached before the lock is released
+    if cache.get(lock_key) is None:
+      return cache.get(key)
+  return None
+
+def get_result(query, ttl, fetch_func=fetch):
+  """
+  Return (status, content type, content) of a normalized query from the
+  cache, or fetch it if it isn't cached. The identical queries in flight,
+  of the process or of other processes sharing the cache, wait for the
+  first one instead of fetching again.
+  """
+  cache = get_cache(settings.VIEW_CACHE_ALIAS)
+  key = '%s:%s' % (KEY_PREFIX, hashlib.md5(query).hexdigest())
+  result = cache.get(key)
+  if result is not None:
+    return result
+
+  with inflight_lock:
+    entry = inflight.get(key)
+    leader = entry is None
+    if leader:
+      entry = inflight[key] = [threading.Event(), None]
+  if not leader:
+    entry[0].wait(settings.TSDB_PROXY_TIMEOUT)
+    if entry[1] is not None:
+      return entry[1]
+
+  try:
+    lock_key = key + ':lock'
+    locked = cache.add(lock_key, 1, settings.TSDB_PROXY_TIMEOUT)
+    if not locked:
+      result = wait_for_other_process(cache, key, lock_key)
+      if result is not None:
+        entry[1] = result
+        return result
+    try:
+      result = fetch_func(query)
+      # the errors are cached shortly, so the waiters get them and a tsdb
+      # recovered is queried again soon
+      if result[0] != 200:
+        ttl = settings.TSDB_PROXY_ERROR_TTL
+      if ttl > 0:
+        cache.set(key, result, ttl)
+    finally:
+      if locked:
+        cache.delete(lock_key)
+    entry[1] = result
+    return result
+  finally:
+    if leader:
+      with inflight_lock:
+        del inflight[key]
+      entry[0].set()
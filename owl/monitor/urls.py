@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 from django.conf.urls import patterns, url
+import api
 import views
 
 urlpatterns = patterns(
@@ -8,6 +9,10 @@ urlpatterns = patterns(
 
   url(r'^metrics/', views.show_all_metrics),
   url(r'^metrics_config/', views.show_all_metrics_config),
+  url(r'^local_tsdb/query/$', views.show_local_tsdb_query),
+  url(r'^tsdb/q$', views.show_tsdb_query),
+
+  url(r'^api/cluster/(?P<id>\d+)/(?P<name>\w+)/$', api.show_cluster_rows),
 
   url(r'^counters/', views.show_all_counters),
   url(r'^addCounter/$', views.add_counter),
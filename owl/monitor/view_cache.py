@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#
+# Cache of the data and rendered chart fragments of owl pages.
+#
+# Data of a cluster only changes once per collector period. The status
+# updater commits a new cycle of a cluster by updating its last_attempt_time
+# after the tasks of the period are saved, and the cycle is part of every
+# cache key. So all cached entries of a cluster are invalidated as soon as
+# the collector commits a new cycle, without any explicit purge, and web
+# workers sharing a cache backend see the same entries. An entry changed out
+# of the cycles is purged by invalidate().
+import calendar
+import logging
+
+from django.conf import settings
+from django.core.cache import get_cache
+
+from models import Cluster
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'owl'
+# in seconds
+CYCLE_CHECK_INTERVAL = 1
+
+def get_cycle(cluster):
+  return calendar.timegm(cluster.last_attempt_time.utctimetuple())
+
+def make_key(cluster, name, cycle=None):
+  if cycle is None:
+    cycle = get_cycle(cluster)
+  return '%s:%d:%d:%s' % (KEY_PREFIX, cluster.id, cycle, name)
+
+def get(cluster, name, cycle):
+  """
+  Return the cached value of 'name' in the given cycle of cluster, or None
+  if it's not cached.
+  """
+  if not settings.VIEW_CACHE_ENABLED:
+    return None
+  key = make_key(cluster, name, cycle)
+  try:
+    return get_cache(settings.VIEW_CACHE_ALIAS).get(key)
+  except Exception as e:
+    logger.warning("Failed to get %s from cache: %r", key, e)
+    return None
+
+def invalidate(cluster, name):
+  """
+  Purge the cached value of 'name' for the current cycle of cluster.
+  """
+  if not settings.VIEW_CACHE_ENABLED:
+    return
+  key = make_key(cluster, name)
+  try:
+    get_cache(settings.VIEW_CACHE_ALIAS).delete(key)
+  except Exception as e:
+    logger.warning("Failed to delete %s from cache: %r", key, e)
+
+def get_latest_cycle(cluster_id):
+  """
+  Return the latest cycle of cluster in db. Pollers of all web workers share
+  one query per CYCLE_CHECK_INTERVAL through the cache.
+  """
+  key = '%s:%d:cycle' % (KEY_PREFIX, cluster_id)
+  cache = get_cache(settings.VIEW_CACHE_ALIAS)
+  try:
+    cycle = cache.get(key)
+  except Exception as e:
+    logger.warning("Failed to get %s from cache: %r", key, e)
+    cycle = None
+
+  if cycle is None:
+    last_attempt_time = Cluster.objects.filter(id=cluster_id).\
+        values_list('last_attempt_time', flat=True)[0]
+    cycle = calendar.timegm(last_attempt_time.utctimetuple())
+    try:
+      cache.set(key, cycle, CYCLE_CHECK_INTERVAL)
+    except Exception as e:
+      logger.warning("Failed to set %s to cache: %r", key, e)
+  return cycle
+
+def get_or_set(cluster, name, func):
+  """
+  Return the cached value of 'name' for the current cycle of cluster, call
+  func to compute and cache it on miss.
+  """
+  if not settings.VIEW_CACHE_ENABLED:
+    return func()
+
+  cache = get_cache(settings.VIEW_CACHE_ALIAS)
+  key = make_key(cluster, name)
+  try:
+    value = cache.get(key)
+  except Exception as e:
+    # the shared backend may be unavailable, fall back to compute it.
+    logger.warning("Failed to get %s from cache: %r", key, e)
+    return func()
+
+  if value is None:
+    value = func()
+    try:
+      cache.set(key, value, settings.VIEW_CACHE_TIMEOUT)
+    except Exception as e:
+      logger.warning("Failed to set %s to cache: %r", key, e)
+  return value
@@ -14,14 +14,23 @@ from models import Table
 
 import datetime
 import dbutil
+import distribution
 import json
+import local_tsdb
 import logging
 import metric_helper
 import time
 import owl_config
+import region_lifecycle
+import storm_metrics
+import tsdb_proxy
+import view_cache
 
 logger = logging.getLogger(__name__)
 
+# the number of recent region events shown on the table page
+REGION_EVENT_COUNT = 20
+
 class Namespace:
   def __init__(self, **kwargs):
     for name, value in kwargs.iteritems():
@@ -74,7 +83,8 @@ def show_cluster_task_board(request, id):
   cluster = dbutil.get_cluster(id)
   tasks = dbutil.get_tasks_by_cluster(id)
   params = {'cluster': cluster,
-            'tasks': tasks}
+            'tasks': tasks,
+            'cycle': view_cache.get_cycle(cluster)}
   if cluster.service.name == 'hdfs':
     return respond(request, 'monitor/hdfs_task_board.html', params)
   elif cluster.service.name == 'hbase':
@@ -112,6 +122,13 @@ def show_cluster_table_board(request, id):
   if cluster.service.name != 'hbase':
     # return empty paget for unsupported service
     return HttpResponse('')
+
+  params = view_cache.get_or_set(cluster, 'table_board',
+    lambda: get_cluster_table_board_params(cluster))
+  params['cluster'] = cluster
+  return respond(request, 'monitor/hbase_table_board.html', params)
+
+def get_cluster_table_board_params(cluster):
   read_requests_dist_by_table, write_requests_dist_by_table = dbutil.get_requests_distribution_groupby(cluster, 'table');
   params = {
     'chart_id': 'read_requests_on_table',
@@ -120,7 +137,7 @@ def show_cluster_table_board(request, id):
     'base_url': '/monitor/table/',
   }
 
-  read_requests_dist_by_table_chart = loader.get_template('monitor/requests_dist_pie_chart.tpl').render(Context(params))
+  read_requests_dist_by_table_chart = render_chart('monitor/requests_dist_pie_chart.tpl', params)
 
   params = {
     'chart_id': 'write_requests_on_table',
@@ -128,8 +145,7 @@ def show_cluster_table_board(request, id):
     'request_dist': write_requests_dist_by_table,
     'base_url': '/monitor/table/',
   }
-  write_requests_dist_by_table_chart = loader.get_template('monitor/requests_dist_pie_chart.tpl').render(
-    Context(params))
+  write_requests_dist_by_table_chart = render_chart('monitor/requests_dist_pie_chart.tpl', params)
 
   tables = dbutil.get_items_on_cluster(cluster, 'table', order_by='-qps')
   system_tables = [table for table in tables if is_system_table(table)]
@@ -144,8 +160,7 @@ def show_cluster_table_board(request, id):
     tsdb_read_query.append(metric_helper.make_metric_query(cluster.name, table.name, 'readRequestsCountPerSec'))
     tsdb_write_query.append(metric_helper.make_metric_query(cluster.name, table.name, 'writeRequestsCountPerSec'))
 
-  params = {
-    'cluster': cluster,
+  return {
     'read_requests_dist_by_table_chart': read_requests_dist_by_table_chart,
     'write_requests_dist_by_table_chart': write_requests_dist_by_table_chart,
     'system_tables': system_tables,
@@ -155,7 +170,6 @@ def show_cluster_table_board(request, id):
     'tsdb_read_query': tsdb_read_query,
     'tsdb_write_query': tsdb_write_query,
   }
-  return respond(request, 'monitor/hbase_table_board.html', params)
 
 #url: /cluster/$id/total/
 def show_quota_total_board(request, id):
@@ -227,6 +241,12 @@ def show_cluster_regionserver_board(request, id):
     # return empty paget for unsupported service
     return HttpResponse('')
 
+  params = view_cache.get_or_set(cluster, 'regionserver_board',
+    lambda: get_cluster_regionserver_board_params(cluster))
+  params['cluster'] = cluster
+  return respond(request, 'monitor/hbase_regionserver_board.html', params)
+
+def get_cluster_regionserver_board_params(cluster):
   read_requests_dist_by_rs, write_requests_dist_by_rs = dbutil.get_requests_distribution_groupby(cluster, 'regionserver');
   params = {
     'chart_id': 'read_requests_on_rs',
@@ -235,7 +255,7 @@ def show_cluster_regionserver_board(request, id):
     'base_url': '/monitor/regionserver/',
   }
 
-  read_requests_dist_by_rs_chart = loader.get_template('monitor/requests_dist_pie_chart.tpl').render(Context(params))
+  read_requests_dist_by_rs_chart = render_chart('monitor/requests_dist_pie_chart.tpl', params)
 
   params = {
     'chart_id': 'write_requests_on_rs',
@@ -243,16 +263,14 @@ def show_cluster_regionserver_board(request, id):
     'request_dist': write_requests_dist_by_rs,
     'base_url': '/monitor/regionserver/',
   }
-  write_requests_dist_by_rs_chart = loader.get_template('monitor/requests_dist_pie_chart.tpl').render(Context(params))
+  write_requests_dist_by_rs_chart = render_chart('monitor/requests_dist_pie_chart.tpl', params)
 
-  regionservers = dbutil.get_items_on_cluster(cluster, 'regionserver', order_by='name')
-  params = {
-    'cluster': cluster,
+  regionservers = list(dbutil.get_items_on_cluster(cluster, 'regionserver', order_by='name'))
+  return {
     'read_requests_dist_by_rs_chart': read_requests_dist_by_rs_chart,
     'write_requests_dist_by_rs_chart': write_requests_dist_by_rs_chart,
     'regionservers': regionservers,
   }
-  return respond(request, 'monitor/hbase_regionserver_board.html', params)
 
 #url: /cluster/$id/replication/
 def show_cluster_replication(request, id):
@@ -268,105 +286,45 @@ def show_cluster_replication(request, id):
 #url: /cluster/$id/?type="spout or bolt"
 def show_cluster_storm_builtin_metrics(request, id):
   cluster = dbutil.get_cluster(id)
-  storm_tasks = dbutil.get_storm_task_by_cluster(cluster)
   type = request.GET.get('type')
   type_dict = {
-    "Spout": "STORM_BUILTIN_SPOUT_METRICS",
-    "Bolt": "STORM_BUILTIN_BOLT_METRICS",
+    "Spout": storm_metrics.KIND_SPOUT,
+    "Bolt": storm_metrics.KIND_BOLT,
   }
+  if type not in type_dict:
+    return HttpResponse('Unsupported type: %s' % type)
 
-  # builtin metrics format is <storm_id, STORM_BUILTIN_SPOUT_METRICS|STORM_BUILTIN_BOLT_METRICS, <key, value>>>
-  storm_metrics = [];
-  for storm_task in storm_tasks:
-    if storm_task.job.name != 'metricserver':
-      continue
-    try:
-      json_metrics = json.loads(storm_task.last_metrics_raw)
-    except:
-      logger.warning("Failed to parse metrics of task: %s", storm_task)
-      return HttpResponse('')
-
-    for storm_id, topology_metrics in json_metrics.iteritems():
-      element = {"storm_id": storm_id}
-      for group_name, group_metrics in topology_metrics.iteritems():
-        if group_name == type_dict.get(type):
-          for metrics_name, metrics in group_metrics.iteritems():
-            metrics_name = metrics_name.lstrip('_')
-            metrics_name = metrics_name.replace('-', '_')
-            element[metrics_name] = metrics
-      storm_metrics.append(element)
+  metrics_list = []
+  for storm_id, metrics in dbutil.get_storm_metrics(cluster, type_dict[type]):
+    element = {"storm_id": storm_id}
+    for metrics_name, value in metrics.iteritems():
+      element[storm_metrics.get_builtin_field_name(metrics_name)] = value
+    metrics_list.append(element)
 
   params = {
     'cluster' : cluster,
-    'storm_metrics' : storm_metrics,
+    'storm_metrics' : metrics_list,
     }
 
   if type == "Spout":
     return respond(request, 'monitor/storm_spout_board.html', params)
-  elif type == "Bolt":
-    return respond(request, 'monitor/storm_bolt_board.html', params)
   else:
-    return HttpResponse('Unsupported type: ' + type)
+    return respond(request, 'monitor/storm_bolt_board.html', params)
 
 #url: /cluster/$id/system_metrics/
 def show_cluster_storm_system_metrics(request, id):
   cluster = dbutil.get_cluster(id)
-  storm_tasks = dbutil.get_storm_task_by_cluster(cluster)
-
-  # system metrics format is <storm_id, STORM_SYSTEM_*, <key, value>>>;
-  # and key may in format: "GC/*", "memory/heap:*", ""memory/nonHeap:*" or ".*";
-  storm_metrics = []
-  for storm_task in storm_tasks:
-    try:
-      json_metrics = json.loads(storm_task.last_metrics_raw)
-    except:
-      logger.warning("Failed to parse metrics of task: %s", storm_task.last_metrics_raw)
-      return HttpResponse('')
-
-    for storm_id, topology_metrics in json_metrics.iteritems():
-      topology_element = []
-      for group_name, group_metrics in topology_metrics.iteritems():
-        if group_name.find("STORM_SYSTEM_") != 0:
-          continue
-        group_name = group_name.lstrip("STORM_SYSTEM_")
-        element = {"worker_endpoint" : group_name};
-        gc_value = ""
-        memory_heap_value = ""
-        memory_non_heap_value = ""
-        for metrics_name, metrics in group_metrics.iteritems():
-          if metrics_name.find("GC/") == 0:
-            if len(gc_value) != 0:
-              gc_value += ", \n"
-            gc_value += metrics_name.lstrip("GC/") + ":" + str(metrics)
-
-          if metrics_name.find("memory/heap:") == 0:
-            if len(memory_heap_value) != 0:
-              memory_heap_value += ", \n"
-            memory_heap_value += metrics_name.lstrip("memory/heap:") + ":" + str(metrics)
-
-          if metrics_name.find("memory/nonHeap:") == 0:
-            if len(memory_non_heap_value) != 0:
-              memory_non_heap_value += ", \n"
-            memory_non_heap_value += metrics_name.lstrip("memory/nonHeap:") + ":" + str(metrics)
-
-          if metrics_name == "startTimeSecs":
-            element["start_time_sec"] = metrics
-          if metrics_name == "uptimeSecs":
-            element["uptime_sec"] = metrics
-        element["GC"] = gc_value
-        element["memory_heap"] = memory_heap_value
-        element["memory_non_heap"] = memory_non_heap_value
-        topology_element.append(element)
-
-      metrics = {
-        "storm_id" : storm_id,
-        "topology_metrics" : topology_element
-      }
-      storm_metrics.append(metrics)
+
+  metrics_list = []
+  for storm_id, workers in dbutil.get_storm_metrics(cluster, storm_metrics.KIND_SYSTEM):
+    metrics_list.append({
+      "storm_id" : storm_id,
+      "topology_metrics" : workers,
+    })
 
   params = {
     'cluster' : cluster,
-    'storm_metrics' : storm_metrics,
+    'storm_metrics' : metrics_list,
     }
 
   return respond(request, 'monitor/storm_system_metrics_board.html', params)
@@ -374,36 +332,10 @@ def show_cluster_storm_system_metrics(request, id):
 #url: /cluster/$id/user_metrics/
 def show_cluster_storm_user_metrics(request, id):
   cluster = dbutil.get_cluster(id)
-  storm_tasks = dbutil.get_storm_task_by_cluster(cluster)
-
-  # user metrics format is <storm_id, component_id:task_id, <key, value>>>;
-  storm_metrics = {}
-  for storm_task in storm_tasks:
-    if storm_task.job.name != 'metricserver':
-      continue
-    try:
-      json_metrics = json.loads(storm_task.last_metrics_raw)
-    except:
-      logger.warning("Failed to parse metrics of task: %s", storm_task)
-      return HttpResponse('')
-
-    for storm_id, topology_metrics in json_metrics.iteritems():
-      topology_metrics_dict = storm_metrics.setdefault(storm_id, {})
-      for group_name, group_metrics in topology_metrics.iteritems():
-        if group_name.find("STORM_SYSTEM_") == 0 or group_name == "STORM_BUILTIN_SPOUT_METRICS" or group_name == "STORM_BUILTIN_BOLT_METRICS":
-          continue
-        group_component_id = group_name.split(":")[0]
-        group_task_id = group_name.split(":")[1]
-        group_metrics_dict = topology_metrics_dict.setdefault(group_component_id, {})
-        task_metrics_dict = group_metrics_dict.setdefault(group_task_id, {});
-
-        for metrics_name, metrics in group_metrics.iteritems():
-          task_metrics_dict[metrics_name] = metrics
-  # after upper handle, storm_metrics in format: <storm_id, <component_id, <task_id, <key, value>>>>
 
+  # user metrics in format: <storm_id, <component_id, <task_id, <key, value>>>>
   format_storm_metrics = {}
-  for storm_id in storm_metrics:
-    topology_metrics = storm_metrics.get(storm_id)
+  for storm_id, topology_metrics in dbutil.get_storm_metrics(cluster, storm_metrics.KIND_USER):
     format_topology_metrics = format_storm_metrics.setdefault(storm_id, {})
     for component_id in topology_metrics:
       group_metrics = topology_metrics.get(component_id)
@@ -511,56 +443,41 @@ def show_table(request, id):
   table = dbutil.get_table(id)
   cluster = table.cluster
 
-  read_requests_dist_by_rs, write_requests_dist_by_rs = dbutil.get_requests_distribution(table)
-  params = {
-    'chart_id': 'read_requests_on_rs',
-    'chart_title': 'read requests on region',
-    'request_dist': read_requests_dist_by_rs,
-  }
-
-  read_requests_dist_by_rs_chart = loader.get_template('monitor/requests_dist_column_chart.tpl').render(Context(params))
-
-  params = {
-    'chart_id': 'write_requests_on_rs',
-    'chart_title': 'write requests on region',
-    'request_dist': write_requests_dist_by_rs,
-  }
-  write_requests_dist_by_rs_chart = loader.get_template('monitor/requests_dist_column_chart.tpl').render(
-    Context(params))
-
-  memstore_size_dist_by_region, storefile_size_dist_by_region = dbutil.get_data_distribution(table)
-
-  params = {
-    'chart_id': 'memstore_size_dist_by_region',
-    'chart_title': 'memstore size on region',
-    'request_dist': memstore_size_dist_by_region,
-    }
-  memstore_size_dist_by_region_chart = loader.get_template('monitor/requests_dist_column_chart.tpl').render(Context(params))
+  params = view_cache.get_or_set(cluster, 'table:%d' % table.id,
+    lambda: get_table_params(cluster, table))
+  params.update({
+    'cluster': cluster,
+    'table': table,
+  })
+  return respond(request, 'monitor/hbase_table.html', params)
 
-  params = {
-    'chart_id': 'storefile_size_dist_by_region',
-    'chart_title': 'storefile size on region',
-    'request_dist': storefile_size_dist_by_region,
-    }
-  storefile_size_dist_by_region_chart = loader.get_template('monitor/requests_dist_column_chart.tpl').render(Context(params))
+def get_table_params(cluster, table):
+  summaries = dbutil.get_region_distributions(table)
+  read_requests_dist_by_rs_chart = render_distribution_chart(
+    'read_requests_on_rs', 'read requests on region', summaries['read_requests'])
+  write_requests_dist_by_rs_chart = render_distribution_chart(
+    'write_requests_on_rs', 'write requests on region', summaries['write_requests'])
+  memstore_size_dist_by_region_chart = render_distribution_chart(
+    'memstore_size_dist_by_region', 'memstore size on region', summaries['memstore_size'])
+  storefile_size_dist_by_region_chart = render_distribution_chart(
+    'storefile_size_dist_by_region', 'storefile size on region', summaries['storefile_size'])
 
   group = str(table)
   tsdb_read_query = [metric_helper.make_metric_query(cluster.name, group, 'readRequestsCountPerSec')]
   tsdb_write_query = [metric_helper.make_metric_query(cluster.name, group, 'writeRequestsCountPerSec')]
 
-  params = {
-    'cluster': cluster,
-    'table': table,
+  return {
     'read_requests_dist_by_rs_chart': read_requests_dist_by_rs_chart,
     'write_requests_dist_by_rs_chart': write_requests_dist_by_rs_chart,
     'memstore_size_dist_by_region_chart': memstore_size_dist_by_region_chart,
     'storefile_size_dist_by_region_chart': storefile_size_dist_by_region_chart,
     'tsdb_read_query': tsdb_read_query,
     'tsdb_write_query': tsdb_write_query,
+    'region_events': region_lifecycle.get_region_events(table, REGION_EVENT_COUNT),
+    'skew_summaries': dbutil.get_skew_summaries(table),
+    'skew_top_k': settings.SKEW_TOP_K,
   }
 
-  return respond(request, 'monitor/hbase_table.html', params)
-
 #url: /table/operation/$table_id
 def show_table_operation(request, id):
   table = dbutil.get_table(id)
@@ -637,7 +554,7 @@ def show_cluster_operation_table_comparison(request, id):
     'tsdb_metrics' : metric_helper.make_operation_metrics_for_tables_in_cluster(cluster),
     'endpoint' : endpoint
   }
-  print params['tsdb_metrics']
+  logger.debug("tsdb metrics of cluster %s: %s", cluster.name, params['tsdb_metrics'])
   return respond(request, 'monitor/hbase_cluster_operation_table_comparsion.html', params)
 
 #url: /regionserver/$rs_id/
@@ -645,36 +562,33 @@ def show_regionserver(request, id):
   rs = dbutil.get_regionserver(id)
   cluster = rs.cluster
 
-  read_requests_dist_by_rs, write_requests_dist_by_rs = dbutil.get_requests_distribution(rs);
-  params = {
-    'chart_id': 'read_requests_on_rs',
-    'chart_title': 'read requests on region',
-    'request_dist': read_requests_dist_by_rs,
-  }
+  params = view_cache.get_or_set(cluster, 'regionserver:%d' % rs.id,
+    lambda: get_regionserver_params(cluster, rs))
+  params.update({
+    'cluster': cluster,
+    'regionserver': rs,
+  })
+  return respond(request, 'monitor/hbase_regionserver.html', params)
 
-  read_requests_dist_by_rs_chart = loader.get_template('monitor/requests_dist_column_chart.tpl').render(Context(params))
-
-  params = {
-    'chart_id': 'write_requests_on_rs',
-    'chart_title': 'write requests on region',
-    'request_dist': write_requests_dist_by_rs,
-  }
-  write_requests_dist_by_rs_chart = loader.get_template('monitor/requests_dist_column_chart.tpl').render(
-    Context(params))
+def get_regionserver_params(cluster, rs):
+  summaries = dbutil.get_region_distributions(rs)
+  read_requests_dist_by_rs_chart = render_distribution_chart(
+    'read_requests_on_rs', 'read requests on region', summaries['read_requests'])
+  write_requests_dist_by_rs_chart = render_distribution_chart(
+    'write_requests_on_rs', 'write requests on region', summaries['write_requests'])
 
   group = str(rs)
   tsdb_read_query = [metric_helper.make_metric_query(cluster.name, group, 'readRequestsCountPerSec')]
   tsdb_write_query = [metric_helper.make_metric_query(cluster.name, group, 'writeRequestsCountPerSec')]
 
-  params = {
-    'cluster': cluster,
-    'regionserver': rs,
+  return {
     'read_requests_dist_by_rs_chart': read_requests_dist_by_rs_chart,
     'write_requests_dist_by_rs_chart': write_requests_dist_by_rs_chart,
     'tsdb_read_query': tsdb_read_query,
     'tsdb_write_query': tsdb_write_query,
+    'skew_summaries': dbutil.get_skew_summaries(rs),
+    'skew_top_k': settings.SKEW_TOP_K,
   }
-  return respond(request, 'monitor/hbase_regionserver.html', params)
 
 #url: /user/$user_id
 def show_user_quota(request, id):
@@ -697,12 +611,17 @@ def show_job(request, id):
   job = dbutil.get_job(id)
 
   endpoints = [metric_helper.form_perf_counter_endpoint_name(task) for task in tasks]
-  tsdb_metrics = metric_helper.make_metrics_query_for_job(endpoints, job, tasks)
-  print tsdb_metrics
+  # the job series aggregated by the collector are shown if exported,
+  # ?tasks=1 shows the series of every task
+  aggregated = settings.TSDB_EXPORT_ENABLED and not request.GET.get('tasks')
+  tsdb_metrics = metric_helper.make_metrics_query_for_job(endpoints, job, tasks,
+    aggregated)
+  logger.debug("tsdb metrics of job %s: %s", job, tsdb_metrics)
   params = {
     'job': job,
     'tasks': tasks,
     'tsdb_metrics': tsdb_metrics,
+    'aggregated': aggregated,
   }
 
   return respond(request, 'monitor/job.html', params)
@@ -753,6 +672,47 @@ def show_all_metrics_config(request):
   return HttpResponse(json.dumps(metrics_config, indent=indent),
                       content_type='application/json; charset=utf8')
 
+#url: /local_tsdb/query/?start=15m-ago&m=sum:key{host=endpoint,group=group}
+# The response is in the same format as opentsdb's /api/query, so it could be
+# used as a fallback when opentsdb is unavailable or lagging.
+def show_local_tsdb_query(request):
+  store = local_tsdb.get_local_tsdb()
+  if store is None:
+    return HttpResponse('Local tsdb is disabled', status=404)
+
+  try:
+    now = time.time()
+    start = local_tsdb.parse_time(request.GET.get('start', '15m-ago'), now)
+    end = local_tsdb.parse_time(request.GET['end'], now) \
+      if 'end' in request.GET else int(now)
+    result = []
+    for query in request.GET.getlist('m'):
+      series, aggregator, downsample, rate = local_tsdb.parse_metric_query(query)
+      points = store.query(series, start, end, aggregator, downsample, rate)
+      result.append({
+        'metric': series[0][2],
+        'tags': {'group': series[0][1]},
+        'aggregateTags': ['host'] if len(series) > 1 else [],
+        'dps': dict((str(timestamp), value) for timestamp, value in points),
+      })
+  except ValueError as e:
+    return HttpResponse(str(e), status=400)
+
+  return HttpResponse(json.dumps(result),
+                      content_type='application/json; charset=utf8')
+
+#url: /tsdb/q
+def show_tsdb_query(request):
+  try:
+    query, ttl = tsdb_proxy.normalize_query(request.GET, time.time())
+  except ValueError as e:
+    return HttpResponse(str(e), status=400)
+  status, content_type, content = tsdb_proxy.get_result(query, ttl)
+  response = HttpResponse(content, content_type=content_type, status=status)
+  if status == 200:
+    response['Cache-Control'] = 'max-age=%d' % ttl
+  return response
+
 def get_time_range(request):
   start_time = datetime.datetime.today() + datetime.timedelta(hours=-1)
   end_time = datetime.datetime.today()
@@ -814,6 +774,21 @@ def show_all_counters(request):
                       content_type='application/json; charset=utf8')
 
 
+def render_chart(template, params):
+  return loader.get_template(template).render(Context(params))
+
+# render the column chart of a distribution on regions, the regions out of
+# the top ones are shown as a histogram below the chart.
+def render_distribution_chart(chart_id, chart_title, summary):
+  params = {
+    'chart_id': chart_id,
+    'chart_title': chart_title,
+    'request_dist': distribution.to_column_dist(summary),
+    'histogram': summary['histogram'],
+    'total_count': summary['count'],
+  }
+  return render_chart('monitor/requests_dist_column_chart.tpl', params)
+
 def respond(request, template, params=None):
   """Helper to render a response, passing standard stuff to the response.
   Args:
@@ -829,6 +804,9 @@ def respond(request, template, params=None):
   params['user'] = request.user
   params['chart_url_prefix'] = owl_config.CHART_URL_PREFIX
   params['tsdb_url_prefix'] = owl_config.TSDB_ADDR
+  # the graphs are loaded through the caching proxy of tsdb queries
+  params['tsdb_query_prefix'] = '/monitor/tsdb' if settings.TSDB_PROXY_ENABLED \
+    else owl_config.TSDB_ADDR
   params['supervisor_port'] = owl_config.SUPERVISOR_PORT
   params['start_date'] = (datetime.datetime.now() - datetime.timedelta(minutes=15)).strftime('%Y/%m/%d-%H:%M:%S')
   params['quota_start_date'] = (datetime.datetime.now() - datetime.timedelta(hours=20)).strftime('%Y/%m/%d-%H:%M:%S')
@@ -0,0 +1,34 @@
+"""
+The environment of owl processes, shared by manage.py and the wsgi
+applications.
+"""
+import ctypes
+import os
+import sys
+
+root_path = os.path.abspath(
+    os.path.dirname(os.path.realpath(__file__)) + '/../..')
+owl_path = os.path.join(root_path, 'owl')
+
+def add_path(path):
+  if path not in sys.path:
+    sys.path.append(path)
+
+def setup():
+  """
+  Put the libs of owl, the client of minos and the config of owl on sys.path,
+  and load libzookeeper for the module zookeeper.
+  """
+  # add libs path for loading module zookeeper
+  lib_path = os.path.join(owl_path, "libs")
+  add_path(lib_path)
+  ctypes.cdll.LoadLibrary(os.path.join(lib_path, 'libzookeeper_mt.so.2'))
+
+  client_path = os.path.join(root_path, 'client')
+  add_path(client_path)
+
+  deploy_utils = __import__('deploy_utils')
+  conf_path = deploy_utils.get_config_dir()
+
+  owl_conf_path = os.path.join(conf_path, 'owl')
+  add_path(owl_conf_path)
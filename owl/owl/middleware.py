@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+import StringIO
+import cProfile
+import logging
+import pstats
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.db import connections
+from django.template.base import Template
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger('owl.slow_view')
+
+QUERY_COUNT_HEADER = 'X-Owl-Query-Count'
+QUERY_TIME_HEADER = 'X-Owl-Query-Time'
+
+class QueryBudgetExceeded(Exception):
+  pass
+
+class QueryStats(object):
+  def __init__(self):
+    self.count = 0
+    self.time = 0.0
+
+class QueryCountCursorWrapper(object):
+  """
+  A cursor counting the queries executed and the time spent on them, unlike
+  the debug cursor of django, it doesn't keep the sql.
+  """
+  def __init__(self, cursor, stats):
+    self.cursor = cursor
+    self.stats = stats
+
+  def __getattr__(self, attr):
+    return getattr(self.cursor, attr)
+
+  def __iter__(self):
+    return iter(self.cursor)
+
+  def execute(self, *args, **kwargs):
+    return self.count(self.cursor.execute, *args, **kwargs)
+
+  def executemany(self, *args, **kwargs):
+    return self.count(self.cursor.executemany, *args, **kwargs)
+
+  def count(self, func, *args, **kwargs):
+    start_time = time.time()
+    try:
+      return func(*args, **kwargs)
+    finally:
+      self.stats.count += 1
+      self.stats.time += time.time() - start_time
+
+def install_query_counter(connection):
+  """
+  Wrap the cursors of a connection to count their queries, the stats are
+  kept in connection._owl_query_stats for the life of the connection object.
+  """
+  if getattr(connection, '_owl_query_stats', None) is not None:
+    return
+  stats = connection._owl_query_stats = QueryStats()
+  make_cursor = connection.cursor
+  connection.cursor = lambda: QueryCountCursorWrapper(make_cursor(), stats)
+
+def get_query_stats(start_stats):
+  """
+  Return the number of queries and the time spent on them since
+  start_stats, a dict from connection alias to (count, time).
+  """
+  count = 0
+  query_time = 0.0
+  for connection in connections.all():
+    if connection.alias not in start_stats:
+      continue
+    start_count, start_time = start_stats[connection.alias]
+    count += connection._owl_query_stats.count - start_count
+    query_time += connection._owl_query_stats.time - start_time
+  return count, query_time
+
+class QueryCountMiddleware(object):
+  """
+  Report the number of sql queries and the time spent on them of a request
+  in the response headers. The requests exceeding the query budget are
+  logged, with their sql if QUERY_CAPTURE_SQL, and fail if
+  QUERY_BUDGET_ENFORCED.
+  """
+  def process_request(self, request):
+    request._owl_query_stats = {}
+    request._owl_debug_cursors = {}
+    request._owl_sql_offsets = {}
+    for connection in connections.all():
+      install_query_counter(connection)
+      stats = connection._owl_query_stats
+      request._owl_query_stats[connection.alias] = (stats.count, stats.time)
+      if settings.QUERY_CAPTURE_SQL:
+        # keep the sql of queries even if DEBUG is off, which costs memory
+        request._owl_debug_cursors[connection.alias] = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        request._owl_sql_offsets[connection.alias] = len(connection.queries)
+
+  def process_response(self, request, response):
+    if not hasattr(request, '_owl_query_stats'):
+      return response
+
+    count, query_time = get_query_stats(request._owl_query_stats)
+    sqls = []
+    for connection in connections.all():
+      if connection.alias in request._owl_debug_cursors:
+        sqls += [query['sql'] for query in connection.queries[
+          request._owl_sql_offsets[connection.alias]:]]
+        connection.use_debug_cursor = request._owl_debug_cursors[connection.alias]
+
+    response[QUERY_COUNT_HEADER] = str(count)
+    response[QUERY_TIME_HEADER] = '%.3f' % query_time
+    if count > settings.QUERY_BUDGET_PER_REQUEST:
+      logger.warning("%s issued %d queries in %.3f seconds, over budget %d%s",
+          request.path, count, query_time, settings.QUERY_BUDGET_PER_REQUEST,
+          ''.join('\n' + sql for sql in sqls))
+      if settings.QUERY_BUDGET_ENFORCED:
+        raise QueryBudgetExceeded("%s issued %d queries, over budget %d" % (
+          request.path, count, settings.QUERY_BUDGET_PER_REQUEST))
+    return response
+
+PROFILE_PARAM = 'profile'
+PROFILE_HISTORY_KEY = 'owl:profiles'
+# in seconds
+PROFILE_HISTORY_TIMEOUT = 24 * 3600
+
+# the code of Template.render, its cumulative time in a profile is the
+# template render time, nested templates are counted once.
+TEMPLATE_RENDER_CODE = Template.render.__func__.__code__
+TEMPLATE_RENDER_KEY = (TEMPLATE_RENDER_CODE.co_filename,
+                       TEMPLATE_RENDER_CODE.co_firstlineno,
+                       TEMPLATE_RENDER_CODE.co_name)
+
+def should_profile(request):
+  # eg: /monitor/table/1/?profile=1 by staff users
+  if request.GET.get(PROFILE_PARAM) and getattr(request, 'user', None) and \
+      request.user.is_staff:
+    return True
+  return random.random() < settings.PROFILE_SAMPLE_RATE
+
+def get_call_sites(profiler, count):
+  """
+  Return the template render time and the top call sites by cumulative time
+  in a profile, as text.
+  """
+  stats = pstats.Stats(profiler, stream=StringIO.StringIO())
+  template_time = 0.0
+  if TEMPLATE_RENDER_KEY in stats.stats:
+    template_time = stats.stats[TEMPLATE_RENDER_KEY][3]
+  stats.sort_stats('cumulative').print_stats(count)
+  return template_time, stats.stream.getvalue()
+
+def get_profiles():
+  """
+  Return the last PROFILE_HISTORY_SIZE profiles, the latest first.
+  """
+  return get_cache(settings.VIEW_CACHE_ALIAS).get(PROFILE_HISTORY_KEY, [])
+
+def save_profile(profile):
+  cache = get_cache(settings.VIEW_CACHE_ALIAS)
+  profiles = [profile] + cache.get(PROFILE_HISTORY_KEY, [])
+  cache.set(PROFILE_HISTORY_KEY, profiles[:settings.PROFILE_HISTORY_SIZE],
+    PROFILE_HISTORY_TIMEOUT)
+
+class ProfilingMiddleware(object):
+  """
+  Profile the views of requests with ?profile=1 by staff users, or sampled
+  at PROFILE_SAMPLE_RATE. Profiles are kept in the view cache, and requests
+  slower than SLOW_VIEW_THRESHOLD seconds are logged with their sql stats
+  and call sites if profiled. Keep it last to profile the view only.
+  """
+  def process_request(self, request):
+    request._owl_start_time = time.time()
+
+  def process_view(self, request, view_func, view_args, view_kwargs):
+    if not should_profile(request):
+      return None
+    profiler = cProfile.Profile()
+    # render lazy responses inside the profile to count the templates
+    response = profiler.runcall(view_func, request, *view_args, **view_kwargs)
+    if hasattr(response, 'render') and callable(response.render):
+      response = profiler.runcall(response.render)
+    request._owl_profiler = profiler
+    return response
+
+  def process_response(self, request, response):
+    if not hasattr(request, '_owl_start_time'):
+      return response
+
+    elapsed = time.time() - request._owl_start_time
+    profiler = getattr(request, '_owl_profiler', None)
+    if profiler is None and elapsed < settings.SLOW_VIEW_THRESHOLD:
+      return response
+
+    query_count, query_time = 0, 0.0
+    if hasattr(request, '_owl_query_stats'):
+      query_count, query_time = get_query_stats(request._owl_query_stats)
+    template_time, call_sites = None, ''
+    if profiler is not None:
+      template_time, call_sites = get_call_sites(profiler,
+        settings.PROFILE_CALL_SITES)
+      save_profile({
+        'path': request.get_full_path(),
+        'time': timezone.now(),
+        'elapsed': elapsed,
+        'query_count': query_count,
+        'query_time': query_time,
+        'template_time': template_time,
+        'call_sites': call_sites,
+      })
+
+    if elapsed >= settings.SLOW_VIEW_THRESHOLD:
+      slow_logger.warning("%s took %.3f seconds, %d queries in %.3f seconds%s\n%s",
+        request.get_full_path(), elapsed, query_count, query_time,
+        ', template %.3f seconds' % template_time if template_time is not None else '',
+        call_sites)
+    return response
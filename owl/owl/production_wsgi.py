@@ -0,0 +1,26 @@
+"""
+WSGI config of owl for the production serving mode.
+
+The same as wsgi.py, but the collected static files are served by the
+application itself with a versioned STATIC_URL, see static_serving.py.
+"""
+import os
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "owl.settings")
+
+from owl import environment
+environment.setup()
+
+from django.conf import settings
+from owl import static_serving
+
+STATIC_PREFIX = settings.STATIC_URL
+STATIC_VERSION = static_serving.read_static_version(settings.STATIC_ROOT)
+if STATIC_VERSION:
+  # templates refer static files through STATIC_URL
+  settings.STATIC_URL = '%s%s/' % (STATIC_PREFIX, STATIC_VERSION)
+
+from django.core.wsgi import get_wsgi_application
+
+application = static_serving.StaticFilesApplication(get_wsgi_application(),
+  settings.STATIC_ROOT, STATIC_PREFIX, STATIC_VERSION)
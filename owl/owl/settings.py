@@ -63,7 +63,7 @@ MEDIA_URL = ''
 # Don't put anything in this directory yourself; store your static files
 # in apps' "static/" subdirectories and in STATICFILES_DIRS.
 # Example: "/home/media/media.lawrence.com/static/"
-STATIC_ROOT = ''
+STATIC_ROOT = os.path.join(SITE_ROOT, '../collected_static')
 
 # URL prefix for static files.
 # Example: "http://media.lawrence.com/static/"
@@ -96,12 +96,16 @@ TEMPLATE_LOADERS = (
   )
 
 MIDDLEWARE_CLASSES = (
+  # keep it first to count the queries of all other middlewares
+  'owl.middleware.QueryCountMiddleware',
   'django.middleware.common.CommonMiddleware',
   'django.contrib.sessions.middleware.SessionMiddleware',
   'django.middleware.csrf.CsrfViewMiddleware',
   'django.contrib.auth.middleware.AuthenticationMiddleware',
   'django.contrib.messages.middleware.MessageMiddleware',
   'django.middleware.transaction.TransactionMiddleware',
+  # keep it last to profile the views only
+  'owl.middleware.ProfilingMiddleware',
   # Uncomment the next line for simple clickjacking protection:
   # 'django.middleware.clickjacking.XFrameOptionsMiddleware',
   )
@@ -217,6 +221,11 @@ LOGGING = {
       'handlers': ['console'],
       'level': 'INFO',
       'propagate': True,
+    },
+    'owl.slow_view': {
+      'handlers': ['file'],
+      'level': 'INFO',
+      'propagate': True,
     }
   }
 }
@@ -228,6 +237,9 @@ LOGIN_REDIRECT_URL = '/monitor/'
 FAILOVER_FRAMEWORK_HOST = "127.0.0.1"
 FAILOVER_FRAMEWORK_PORT = 9981
 FAILOVER_FRAMEWORK_PERIOD = 600
+# the days to keep the raw failover tasks and actions, the hourly statistics
+# are kept forever
+FAILOVER_FRAMEWORK_RETENTION = 30
 
 # for count rows of monitor app
 DEPLOY_COMMAND = "/home/work/infra/minos/client/deploy"
@@ -235,6 +247,129 @@ COUNT_PERIOD = 30
 COUNT_START_HOUR = 0
 COUNT_END_HOUR = 6
 
+# the days to keep the status events consumed by the alert command
+ALERT_EVENT_RETENTION = 30
+
+# for the mails of owl commands, sent in the background, see owl/utils/mail.py
+# the seconds to group the mails of the same recipients and subject
+MAIL_GROUP_WINDOW = 60
+# the seconds to drop the mails identical to one sent
+MAIL_DEDUP_WINDOW = 3600
+# the max mails to a recipient per hour, 0 for no limit
+MAIL_RATE_LIMIT = 20
+# the seconds to send all mails to the same recipients as one digest, 0 to
+# disable digests
+MAIL_DIGEST_INTERVAL = 0
+# the seconds to keep an idle smtp connection
+MAIL_SMTP_IDLE_TIMEOUT = 60
+
+# for the embedded local time-series store of monitor app
+LOCAL_TSDB_ENABLED = False
+LOCAL_TSDB_ROOT = os.path.join(SITE_ROOT, '../local_tsdb')
+# in seconds
+LOCAL_TSDB_RETENTION = 6 * 3600
+# the step the points of series are aligned to before merging them without
+# downsampling, the period of the collector, in seconds
+LOCAL_TSDB_STEP = 10
+
+# push the task metrics to the tsdb of owl_config.TSDB_ADDR from the
+# collector, /monitor/metrics then leaves them out, so the metrics collector
+# of opentsdb only fetches the metrics of tables, clusters and storm. The
+# metrics of job pages are also pushed as sum, avg and max of the job, which
+# the job pages show instead of the series of every task
+TSDB_EXPORT_ENABLED = False
+
+# for the caching proxy of the graph queries of tsdb, see monitor/tsdb_proxy.py,
+# the times are in seconds
+TSDB_PROXY_ENABLED = False
+TSDB_PROXY_TIMEOUT = 30
+# the ttl of a range ending now is the range multiplied by the ratio
+TSDB_PROXY_MIN_TTL = 15
+TSDB_PROXY_TTL_RATIO = 0.002
+# a range ended this long ago is closed, and cached for the closed ttl
+TSDB_PROXY_CLOSED_AGE = 600
+TSDB_PROXY_CLOSED_TTL = 3600
+# the error results of tsdb are cached shortly for the identical queries
+TSDB_PROXY_ERROR_TTL = 5
+# the max points of a metric in a graph, 0 to never downsample
+TSDB_PROXY_MAX_POINTS = 1000
+
+# for the cache of monitor pages, the default local memory cache is per
+# process, use a shared backend when running several web workers, eg:
+#   'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+#   'LOCATION': '127.0.0.1:11211',
+CACHES = {
+  'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'owl',
+  }
+}
+VIEW_CACHE_ENABLED = True
+VIEW_CACHE_ALIAS = 'default'
+# in seconds, entries are also invalidated by a new collector cycle
+VIEW_CACHE_TIMEOUT = 300
+
+# the max number of sql queries of a request, requests over it are logged,
+# and fail if QUERY_BUDGET_ENFORCED, eg: in tests and benchmarks
+QUERY_BUDGET_PER_REQUEST = 50
+QUERY_BUDGET_ENFORCED = False
+# log the sql of the requests over the budget, which keeps the sql of all
+# queries of requests like DEBUG does
+QUERY_CAPTURE_SQL = False
+
+# the number of top items kept in the materialized distributions of hbase
+# boards, the others are kept as a histogram.
+DISTRIBUTION_TOP_N = 100
+
+# max seconds a long-poll request of the json api waits for a new cycle
+API_LONG_POLL_TIMEOUT = 30
+# max long-poll requests waiting at once in a web worker, the others return
+# the current cycle at once. Keep it well below the threads of a worker, see
+# gunicorn_config.py, so long-polls never starve the pages.
+API_LONG_POLL_MAX_WAITING = 4
+
+# max idle connections kept for the batch updates of dbutil by type of
+# process, see monitor/storage.py. Connections are created on demand.
+BATCH_STORAGE_POOL_SIZE = {
+  'default': 1,
+  'collector': 5,
+}
+
+# in seconds, regions not online for REGION_RETENTION are archived to the
+# region history and deleted by the collector every REGION_PRUNE_PERIOD.
+# Region histories and events are kept for REGION_HISTORY_RETENTION.
+REGION_RETENTION = 3600
+REGION_PRUNE_PERIOD = 600
+REGION_HISTORY_RETENTION = 90 * 24 * 3600
+
+# the request skew analysis of regions, see monitor/skew.py. A region is hot
+# if its requests are SKEW_HOT_REGION_RATIO times the mean of its table and
+# at least SKEW_HOT_REGION_MIN_VALUE per second. A regionserver is flagged if
+# its requests deviate from the mean of the cluster by SKEW_RS_DEVIATION.
+SKEW_TOP_K = 10
+SKEW_HOT_REGION_RATIO = 5
+SKEW_HOT_REGION_MIN_VALUE = 100
+SKEW_HOT_REGION_COUNT = 10
+SKEW_RS_DEVIATION = 0.5
+
+# the zookeeper browser of zktree keeps a session per ensemble, and caches
+# at most ZKTREE_CACHE_SIZE znodes per session. Cached znodes are invalidated
+# by watches, and expire after ZKTREE_CACHE_TIMEOUT seconds for acl changes.
+ZKTREE_CACHE_SIZE = 10000
+ZKTREE_CACHE_TIMEOUT = 300
+ZKTREE_CHILDREN_PER_PAGE = 200
+
+# the profiling of owl requests, see owl/middleware.py. Staff users profile a
+# request with ?profile=1, and other requests are sampled at
+# PROFILE_SAMPLE_RATE. The last PROFILE_HISTORY_SIZE profiles are shown in
+# /profiles/. Requests slower than SLOW_VIEW_THRESHOLD seconds are logged to
+# the owl.slow_view logger.
+PROFILE_SAMPLE_RATE = 0.0
+PROFILE_HISTORY_SIZE = 20
+# the number of top call sites by cumulative time kept in a profile
+PROFILE_CALL_SITES = 30
+SLOW_VIEW_THRESHOLD = 2.0
+
 # Import the customized django settings of owl, which is located in
 # ${config_dir}/owl/owl_django_settings.py
 # We could overwrite existing settings, like database, or add new settings like
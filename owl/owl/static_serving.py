@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+#
+# Serve the collected static files of owl in production serving mode.
+#
+# Static files are collected into STATIC_ROOT by 'manage.py prepare_static',
+# which also writes a gzip compressed variant of every text file and the
+# version of all files. The version is part of the static url, so browsers
+# could cache the files forever, and a new version is used once any file
+# changes.
+import email.utils
+import gzip
+import hashlib
+import mimetypes
+import os
+import shutil
+import time
+
+VERSION_FILE = 'VERSION'
+COMPRESSED_EXTENSIONS = ('.css', '.js', '.html', '.htm', '.json', '.svg',
+                         '.txt', '.xml')
+# in seconds, a year
+MAX_AGE = 365 * 24 * 3600
+BLOCK_SIZE = 64 * 1024
+
+def compress_static(root):
+  """
+  Compress the text files under root, and write the version of all files.
+  Return the version.
+  """
+  version = hashlib.md5()
+  for dir_path, dir_names, file_names in os.walk(root):
+    dir_names.sort()
+    for file_name in sorted(file_names):
+      path = os.path.join(dir_path, file_name)
+      if file_name.endswith('.gz') or path == os.path.join(root, VERSION_FILE):
+        continue
+
+      with open(path, 'rb') as input:
+        content = input.read()
+      version.update(os.path.relpath(path, root))
+      version.update(content)
+
+      if os.path.splitext(file_name)[1] in COMPRESSED_EXTENSIONS:
+        compressed_path = path + '.gz'
+        if (not os.path.exists(compressed_path) or
+            os.path.getmtime(compressed_path) < os.path.getmtime(path)):
+          with open(path, 'rb') as input:
+            output = gzip.open(compressed_path, 'wb', 9)
+            try:
+              shutil.copyfileobj(input, output)
+            finally:
+              output.close()
+
+  version = version.hexdigest()[:12]
+  with open(os.path.join(root, VERSION_FILE), 'w') as output:
+    output.write(version)
+  return version
+
+def read_static_version(root):
+  try:
+    with open(os.path.join(root, VERSION_FILE)) as input:
+      return input.read().strip()
+  except IOError:
+    return ''
+
+def iter_file(file):
+  try:
+    while True:
+      block = file.read(BLOCK_SIZE)
+      if not block:
+        break
+      yield block
+  finally:
+    file.close()
+
+class StaticFilesApplication(object):
+  """
+  Wsgi application serving the static files under root at url prefix, and
+  passing other requests to application.
+
+  Files requested with the current version in url are cached forever, and
+  the gzip compressed variant of a file is served if the client accepts it.
+  """
+  def __init__(self, application, root, prefix, version):
+    self.application = application
+    self.root = os.path.abspath(root)
+    self.prefix = prefix
+    self.version = version
+
+  def __call__(self, environ, start_response):
+    path = environ.get('PATH_INFO', '')
+    if not path.startswith(self.prefix):
+      return self.application(environ, start_response)
+    if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+      start_response('405 Method Not Allowed', [('Allow', 'GET, HEAD')])
+      return []
+
+    path = path[len(self.prefix):]
+    versioned = False
+    if self.version and path.startswith(self.version + '/'):
+      path = path[len(self.version) + 1:]
+      versioned = True
+
+    file_path = os.path.abspath(os.path.join(self.root, path))
+    if (not file_path.startswith(self.root + os.sep) or
+        not os.path.isfile(file_path)):
+      start_response('404 Not Found', [('Content-Type', 'text/plain')])
+      return ['Not Found']
+
+    content_type, encoding = mimetypes.guess_type(file_path)
+    headers = [
+      ('Content-Type', content_type or 'application/octet-stream'),
+      ('Vary', 'Accept-Encoding'),
+    ]
+    if ('gzip' in environ.get('HTTP_ACCEPT_ENCODING', '') and
+        os.path.isfile(file_path + '.gz')):
+      file_path += '.gz'
+      headers.append(('Content-Encoding', 'gzip'))
+
+    if versioned:
+      headers.append(('Cache-Control', 'public, max-age=%d' % MAX_AGE))
+      headers.append(('Expires', email.utils.formatdate(
+        time.time() + MAX_AGE, usegmt=True)))
+
+    stat = os.stat(file_path)
+    last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+    headers.append(('Last-Modified', last_modified))
+    if environ.get('HTTP_IF_MODIFIED_SINCE') == last_modified:
+      start_response('304 Not Modified', headers)
+      return []
+
+    headers.append(('Content-Length', str(stat.st_size)))
+    start_response('200 OK', headers)
+    if environ['REQUEST_METHOD'] == 'HEAD':
+      return []
+    file = open(file_path, 'rb')
+    if 'wsgi.file_wrapper' in environ:
+      return environ['wsgi.file_wrapper'](file, BLOCK_SIZE)
+    return iter_file(file)
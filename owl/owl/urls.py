@@ -19,6 +19,7 @@ urlpatterns = patterns(
   url(r'^admin/', include(admin.site.urls)),
 
   url(r'^accounts/', include('django.contrib.auth.urls')),
+  url(r'^profiles/$', 'owl.views.show_profiles'),
 
   url(r'^monitor/', include('monitor.urls')),
   url(r'^hbase/', include('hbase.urls')),
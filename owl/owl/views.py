@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.shortcuts import render_to_response
+from django.template import RequestContext
+
+from middleware import get_profiles
+
+# /profiles/
+@staff_member_required
+def show_profiles(request):
+  params = {
+    'profiles': get_profiles(),
+  }
+  return render_to_response('profiles.html', params,
+                            context_instance=RequestContext(request))
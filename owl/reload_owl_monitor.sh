@@ -0,0 +1,9 @@
+#!/bin/bash
+
+# Reload the code and config of owl monitor gracefully in the production
+# serving mode: gunicorn starts new workers and stops old ones after they
+# finish their requests.
+
+source "$(dirname $0)"/../build/minos_env.sh || exit 1
+
+kill -HUP `cat $OWL_MONITOR_PID_FILE`
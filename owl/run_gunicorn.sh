@@ -0,0 +1,10 @@
+#!/bin/bash
+
+# Run owl monitor with gunicorn, the production serving mode.
+# $1 is for set host:port
+
+source "$(dirname $0)"/../build/minos_env.sh || exit 1
+cd $OWL_ROOT
+
+export OWL_MONITOR_BIND=$1
+$BUILD_ENV_BIN_ROOT/gunicorn -c gunicorn_config.py owl.production_wsgi:application > server.log 2>&1
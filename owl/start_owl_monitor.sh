@@ -1,11 +1,18 @@
 #!/bin/bash
 
 if [ $# -lt 1 ]; then
-  echo "Usage: $0 port"
+  echo "Usage: $0 port [runserver|gunicorn]"
   exit 1
 fi
 
 source $SCRIPT_UTILS
+
+if [ "$2" == "gunicorn" ]; then
+  # gunicorn writes the pid of its master process to $OWL_MONITOR_PID_FILE
+  nohup ./run_gunicorn.sh 0.0.0.0:$1 &
+  exit 0
+fi
+
 nohup ./runserver.sh 0.0.0.0:$1 &
 
 child_pid=`get_child_pid $!`
@@ -0,0 +1,58 @@
+// Keep owl boards up to date by long polling the json api of owl.
+//
+// url: the api url, eg: /monitor/api/cluster/1/tasks/
+// cycle: the collector cycle the page is rendered with.
+// update: function(row) called for every changed row, returning false if
+//         the row is not on the page.
+// row_count: function() returning the number of rows on the page.
+var owlLiveUpdate = function(url, cycle, update, row_count) {
+    var poll = function() {
+        $.ajax({
+            url: url,
+            data: {since: cycle, wait: 30},
+            dataType: 'json',
+            cache: false,
+            success: function(data) {
+                // all rows are returned if the snapshot of our cycle is
+                // not cached on server.
+                if (data.removed.length > 0 ||
+                    (data.full && data.rows.length != row_count())) {
+                    // rows are added or removed, render the whole page again.
+                    location.reload();
+                    return;
+                }
+                for (var i = 0; i < data.rows.length; i++) {
+                    if (update(data.rows[i]) === false) {
+                        location.reload();
+                        return;
+                    }
+                }
+                cycle = data.cycle;
+                poll();
+            },
+            error: function() {
+                setTimeout(poll, 10000);
+            }
+        });
+    };
+    poll();
+};
+
+// update the status cell of the task rows on task boards.
+var owlLiveTaskBoard = function(cluster_id, cycle, static_url) {
+    owlLiveUpdate('/monitor/api/cluster/' + cluster_id + '/tasks/', cycle,
+        function(row) {
+            var cell = $('#task-' + row.id + ' .task-status');
+            if (cell.length == 0) {
+                return false;
+            }
+            var image = row.health ? 'ok.png' : 'alert.png';
+            cell.html(row.last_success_time +
+                ' <img src="' + static_url + '/' + image +
+                '" width="24" alt="Big Boat"/>');
+            return true;
+        },
+        function() {
+            return $('tr[id^="task-"]').length;
+        });
+};
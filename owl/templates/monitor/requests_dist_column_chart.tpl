@@ -50,3 +50,12 @@ $(function () {
 });
 </script>
 <div id="{{ chart_id }}"></div>
+{% if histogram %}
+<table class="table table-condensed">
+    <caption>top {{ request_dist|length }} of {{ total_count }} regions shown, the others are:</caption>
+    <tr><th>Range</th><th>Regions</th><th>Total</th></tr>
+    {% for bucket in histogram %}
+    <tr><td>[{{ bucket.0 }}, {{ bucket.1 }})</td><td>{{ bucket.2 }}</td><td>{{ bucket.3|floatformat }}</td></tr>
+    {% endfor %}
+</table>
+{% endif %}
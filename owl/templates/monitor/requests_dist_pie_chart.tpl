@@ -50,13 +50,15 @@
                 name: '{{ chart_title }}',
                  events: {
                      click: function(e) {
-                        location.href = e.point.url
+                        if (e.point.url) {
+                          location.href = e.point.url
+                        }
                         e.preventDefault();
                      }
                  },
                 data: [
                     {% for name, info in request_dist.items %}
-                      {name:'{{ name }}', y:{{ info.1 }}, url:'{{ base_url }}{{ info.0 }}'},
+                      {name:'{{ name }}', y:{{ info.1 }}, url:'{% if info.0 %}{{ base_url }}{{ info.0 }}{% endif %}'},
                     {% endfor %}
                 ]
             }]
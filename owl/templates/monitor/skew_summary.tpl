@@ -0,0 +1,31 @@
+{% if skew_summaries %}
+    <div class="row">
+        <div class="span12"><h3>Request skew on regions</h3></div>
+    </div>
+    <table class="table table-condensed">
+        <thead>
+            <tr>
+                <th>Requests</th>
+                <th>Regions</th>
+                <th>Gini</th>
+                <th>P99/Median</th>
+                <th>Top {{ skew_top_k }} Share</th>
+                {% if show_deviation %}<th>Deviation From Cluster</th>{% endif %}
+                <th>Hot Regions</th>
+            </tr>
+        </thead>
+        <tbody>
+        {% for summary in skew_summaries %}
+            <tr{% if summary.flagged %} class="warning"{% endif %}>
+                <td>{{ summary.name }}</td>
+                <td>{{ summary.count }}</td>
+                <td>{{ summary.gini|floatformat:3 }}</td>
+                <td>{{ summary.p99_median_ratio|floatformat:1|default:"-" }}</td>
+                <td>{% widthratio summary.top_share 1 100 %}%</td>
+                {% if show_deviation %}<td>{% widthratio summary.deviation 1 100 %}%</td>{% endif %}
+                <td>{% for label, id, value in summary.get_hot_regions %}{{ label }}: {{ value|floatformat:1 }}<br/>{% endfor %}</td>
+            </tr>
+        {% endfor %}
+        </tbody>
+    </table>
+{% endif %}
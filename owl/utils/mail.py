@@ -1,43 +1,333 @@
-import owl_config
+# -*- coding: utf-8 -*-
+#
+# The notifications by mail of owl commands.
+#
+# Mails are queued and sent by a background thread, so the loops of the
+# commands never block on smtp. The thread keeps one smtp connection logged
+# in, and batches the mails:
+#   - the mails to the same recipients with the same subject in
+#     MAIL_GROUP_WINDOW seconds are sent as one mail;
+#   - a mail identical to one sent in MAIL_DEDUP_WINDOW seconds is dropped,
+#     and the number dropped is reported once the window expires;
+#   - at most MAIL_RATE_LIMIT mails are sent to a recipient per hour, the
+#     mails over the limit are held and grouped until it's allowed;
+#   - if MAIL_DIGEST_INTERVAL is set, all mails to the same recipients are
+#     sent as one digest every interval.
+# The mails pending are sent when the process exits.
+import Queue
+import atexit
+import collections
+import hashlib
+import logging
 import smtplib
+import socket
+import threading
+import time
+
 from email.mime.text import MIMEText
 
+from django.conf import settings
+
+import owl_config
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_PERIOD = 3600
+# the max notifications in a mail, the others are only counted
+MAX_GROUP_MESSAGES = 100
+# the times to send a mail before dropping it
+MAX_SEND_TIMES = 3
+POLL_INTERVAL = 1
+STOP = object()
+
+def split_emails(to_email):
+  return [addr.strip() for addr in to_email.split(',') if addr.strip()]
+
+class SmtpConnection:
+  """
+  A smtp connection reused for mails, reconnected if it's broken or idle
+  for idle_timeout seconds.
+  """
+  def __init__(self, smtp_host, from_email, password, idle_timeout):
+    self.smtp_host = smtp_host
+    self.from_email = from_email
+    self.password = password
+    self.idle_timeout = idle_timeout
+    self.smtp = None
+    self.last_used = 0
+
+  def connect(self):
+    self.smtp = smtplib.SMTP(self.smtp_host)
+    if self.password:
+      self.smtp.login(self.from_email.split('@')[0], self.password)
+
+  def close(self):
+    if self.smtp is None:
+      return
+    try:
+      self.smtp.quit()
+    except Exception:
+      pass
+    self.smtp = None
+
+  def sendmail(self, to_emails, message):
+    if self.smtp is not None and \
+        time.time() - self.last_used > self.idle_timeout:
+      self.close()
+    # the server may close a connection kept, retry once on a new one
+    for retry in (True, False):
+      if self.smtp is None:
+        self.connect()
+      try:
+        self.smtp.sendmail(self.from_email, to_emails, message)
+        self.last_used = time.time()
+        return
+      except (smtplib.SMTPServerDisconnected, socket.error):
+        self.close()
+        if not retry:
+          raise
+
+class MailGroup:
+  """
+  The notifications sent as one mail.
+  """
+  def __init__(self, key, to_email, subject, type, now):
+    self.key = key
+    self.to_email = to_email
+    self.subject = subject
+    self.type = type
+    self.start_time = now
+    # [subject, content, count, dedup key, count suppressed as duplicates]
+    self.messages = []
+    self.dropped = 0
+    self.send_times = 0
+
+  def add(self, subject, content, dedup_key, count, suppressed):
+    for message in self.messages:
+      if message[3] == dedup_key:
+        message[2] += count
+        message[4] += suppressed
+        return
+    if len(self.messages) >= MAX_GROUP_MESSAGES:
+      self.dropped += count + suppressed
+      return
+    self.messages.append([subject, content, count, dedup_key, suppressed])
+
+  def format(self):
+    """
+    Return (subject, content) of the mail.
+    """
+    if len(self.messages) == 1 and self.messages[0][2] == 1 and \
+        not self.messages[0][4] and not self.dropped:
+      return self.messages[0][:2]
+
+    total = sum(message[2] + message[4] for message in self.messages) + \
+      self.dropped
+    subject = '%s (%d notifications)' % (self.subject, total)
+    separator = '<hr>\n' if self.type == 'html' else '\n' + '-' * 40 + '\n'
+    sections = []
+    for message_subject, content, count, dedup_key, suppressed in \
+        self.messages:
+      header = message_subject
+      if count > 1:
+        header += ' (repeated %d times)' % count
+      if suppressed:
+        header += ' (%d duplicates suppressed)' % suppressed
+      if self.type == 'html':
+        header = '<p><b>%s</b></p>' % header
+      sections.append('%s\n%s\n' % (header, content))
+    if self.dropped:
+      sections.append('%d more notifications not shown\n' % self.dropped)
+    return subject, separator.join(sections)
+
+class Notifier:
+  """
+  Queue the mails and send them by a background thread, see the comment of
+  the module.
+  """
+  def __init__(self, connection, group_window, dedup_window, rate_limit,
+               digest_interval):
+    self.connection = connection
+    self.group_window = group_window
+    self.dedup_window = dedup_window
+    self.rate_limit = rate_limit
+    self.digest_interval = digest_interval
+    self.queue = Queue.Queue()
+    # group key -> MailGroup, in the order of the first notifications
+    self.groups = collections.OrderedDict()
+    # recipient -> the send times of the rate limit period
+    self.send_times = {}
+    # dedup key -> [last send time, count dropped since,
+    #               (subject, content, to_email, type)]
+    self.recent = {}
+    self.thread = None
+
+  def start(self):
+    self.thread = threading.Thread(target=self.run, name='mail-notifier')
+    self.thread.daemon = True
+    self.thread.start()
+
+  def stop(self, timeout=60):
+    """
+    Send the mails pending and stop the thread.
+    """
+    if self.thread is None or not self.thread.is_alive():
+      return
+    self.queue.put(STOP)
+    self.thread.join(timeout)
+
+  def notify(self, subject, content, to_email, type='plain'):
+    self.queue.put((subject, content, to_email, type, time.time()))
+
+  def run(self):
+    while True:
+      items = []
+      try:
+        items.append(self.queue.get(timeout=POLL_INTERVAL))
+        while True:
+          items.append(self.queue.get_nowait())
+      except Queue.Empty:
+        pass
+
+      stopped = STOP in items
+      try:
+        for item in items:
+          if item is not STOP:
+            self.add(*item)
+        self.send_due(time.time(), flush=stopped)
+      except Exception:
+        logger.exception('Mail notifier error')
+      if stopped:
+        self.connection.close()
+        return
+      if self.connection.smtp is not None and \
+          time.time() - self.connection.last_used > self.connection.idle_timeout:
+        self.connection.close()
+
+  def add(self, subject, content, to_email, type, now):
+    to_email = ','.join(split_emails(to_email))
+    if not to_email:
+      return
+    dedup_key = hashlib.md5(repr((to_email, subject, content))).hexdigest()
+    recent = self.recent.get(dedup_key)
+    if recent and now - recent[0] < self.dedup_window:
+      recent[1] += 1
+      logger.info('Drop duplicate mail to %s: %s', to_email, subject)
+      return
+    suppressed = 0
+    if recent:
+      suppressed = recent[1]
+      del self.recent[dedup_key]
+    self.add_to_group(subject, content, to_email, type, dedup_key, 1,
+      suppressed, now)
+
+  def add_to_group(self, subject, content, to_email, type, dedup_key, count,
+                   suppressed, now):
+    if self.digest_interval:
+      key = (to_email, type)
+      group_subject = 'OWL digest'
+    else:
+      key = (to_email, subject, type)
+      group_subject = subject
+    group = self.groups.get(key)
+    if group is None:
+      group = self.groups[key] = MailGroup(key, to_email, group_subject, type,
+        now)
+    group.add(subject, content, dedup_key, count, suppressed)
+
+  def is_rate_limited(self, to_emails, now):
+    if not self.rate_limit:
+      return False
+    for addr in to_emails:
+      times = self.send_times.get(addr)
+      while times and now - times[0] >= RATE_LIMIT_PERIOD:
+        times.popleft()
+      if times and len(times) >= self.rate_limit:
+        return True
+    return False
+
+  def send_due(self, now, flush=False):
+    """
+    Send the groups of mails due, or all of them if flush.
+    """
+    self.expire_recent(now, flush)
+    window = self.digest_interval or self.group_window
+    for key, group in self.groups.items():
+      to_emails = group.to_email.split(',')
+      if not flush:
+        if now - group.start_time < window:
+          continue
+        if self.is_rate_limited(to_emails, now):
+          continue
+      del self.groups[key]
+      self.send_group(group, to_emails, now)
+
+  def expire_recent(self, now, flush=False):
+    """
+    Forget the mails sent over the dedup window, or all of them if flush.
+    The duplicates dropped of them are reported by a summary, even if the
+    mails don't come again.
+    """
+    for dedup_key, recent in self.recent.items():
+      if not flush and now - recent[0] < self.dedup_window:
+        continue
+      del self.recent[dedup_key]
+      if recent[1]:
+        subject, content, to_email, type = recent[2]
+        self.add_to_group(subject, content, to_email, type, dedup_key, 0,
+          recent[1], now)
+
+  def send_group(self, group, to_emails, now):
+    subject, content = group.format()
+    msg = MIMEText(content, group.type, 'utf-8')
+    msg['Subject'] = subject
+    msg['From'] = self.connection.from_email
+    msg['To'] = group.to_email
+    group.send_times += 1
+    try:
+      self.connection.sendmail(to_emails, msg.as_string())
+    except Exception as e:
+      logger.warning('Send email to %s failed: %r', group.to_email, e)
+      if group.send_times < MAX_SEND_TIMES:
+        # retry in the next window
+        group.start_time = now
+        self.groups[group.key] = group
+      return
+
+    logger.info('Sent email to %s: %s', group.to_email, subject)
+    for addr in to_emails:
+      self.send_times.setdefault(addr, collections.deque()).append(now)
+    for message in group.messages:
+      self.recent[message[3]] = [now, 0,
+        (message[0], message[1], group.to_email, group.type)]
+
+notifier = None
+notifier_lock = threading.Lock()
+
+def get_notifier():
+  global notifier
+  with notifier_lock:
+    if notifier is None:
+      connection = SmtpConnection(owl_config.SMTPHOST,
+        owl_config.ALERT_FROM_EMAIL, owl_config.ROBOT_EMAIL_PASSWORD,
+        settings.MAIL_SMTP_IDLE_TIMEOUT)
+      notifier = Notifier(connection,
+        group_window=settings.MAIL_GROUP_WINDOW,
+        dedup_window=settings.MAIL_DEDUP_WINDOW,
+        rate_limit=settings.MAIL_RATE_LIMIT,
+        digest_interval=settings.MAIL_DIGEST_INTERVAL)
+      notifier.start()
+      atexit.register(notifier.stop)
+    return notifier
+
 class Mailer:
   def __init__(self, options):
     self.options = options
-    self.from_email = owl_config.ALERT_FROM_EMAIL
-    self.smtp_host = owl_config.SMTPHOST
-    self.password = owl_config.ROBOT_EMAIL_PASSWORD
 
   def send_email(self, content, subject, to_email, type='plain'):
-    send_email(content = content,
-               subject = subject,
-               from_email = self.from_email,
-               to_email = to_email,
-               smtp_host = self.smtp_host,
-               password = self.password,
-               type = type,
-              )
-
-def send_email(subject, content, from_email, to_email, smtp_host, password, type):
-  if not to_email:
-    return
-
-  msg = MIMEText(content, type)
-  msg['Subject'] = subject
-  msg['From'] = from_email
-  to_emails = [addr.strip() for addr in to_email.split(',')]
-  msg['To'] = ','.join(to_emails)
-
-  connected = False
-  try:
-    smtp = smtplib.SMTP(smtp_host)
-    if password:
-      smtp.login(from_email.split('@')[0], password)
-      connected = True
-
-    smtp.sendmail(msg['From'], to_emails, msg.as_string())
-  except Exception as e:
-    print 'Send email failed: %r' % e
-    if connected:
-      smtp.quit()
+    """
+    Queue a mail, it's sent in the background.
+    """
+    if not to_email:
+      return
+    get_notifier().notify(subject, content, to_email, type)
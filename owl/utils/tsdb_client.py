@@ -0,0 +1,92 @@
+import logging
+import os
+import sys
+import threading
+import time
+
+from urlparse import urlparse
+
+import owl_config
+
+root_path = os.path.abspath(
+  os.path.dirname(os.path.realpath(__file__))+ '/../..')
+opentsdb_path = os.path.join(root_path, 'opentsdb')
+if opentsdb_path not in sys.path:
+  sys.path.append(opentsdb_path)
+tsdb_register = __import__('tsdb_register')
+tsdb_writer = __import__('tsdb_writer')
+
+logger = logging.getLogger(__name__)
+
+# the writer of a process, its connection to tsdb is kept between pushes
+writer = None
+writer_lock = threading.Lock()
+# the points buffered by a process, see buffer_points
+buffered_points = []
+buffer_start_time = 0
+buffer_lock = threading.Lock()
+# the register of metric names of a process
+register = None
+register_lock = threading.Lock()
+
+def register_keys(keys):
+  '''
+  Register the metric names not registered before to tsdb.
+  '''
+  global register
+  with register_lock:
+    if register is None:
+      register = tsdb_register.TsdbRegister()
+    new_keys = sorted(set(keys) - register.register_keys)
+    if not new_keys:
+      return
+    register.new_keys.extend(new_keys)
+    register.register_keys.update(new_keys)
+    register.register_new_keys_to_tsdb()
+
+def put_points(points, batch_size=1000, drain_wait=None):
+  '''
+  Put points to the tsdb of owl_config.TSDB_ADDR in batches over one
+  persistent connection. A point is (metric, timestamp, value, tags).
+  Return the stats of the write, see tsdb_writer.TsdbWriter.
+  '''
+  global writer
+  with writer_lock:
+    if writer is None:
+      writer = tsdb_writer.TsdbWriter([urlparse(owl_config.TSDB_ADDR).netloc],
+        batch_size=batch_size, concurrency=1)
+    stats = writer.write(points, drain_wait)
+  if stats['failed_points']:
+    logger.warning("Failed to put %d of %d points to %s, %d not sent",
+      stats['failed_points'], stats['points'], owl_config.TSDB_ADDR,
+      stats['unsent_points'])
+  return stats
+
+def buffer_points(points, max_points=1000, max_delay=5):
+  '''
+  Buffer the points of small writes, like the metrics of a task, and put
+  them together once max_points are buffered or the oldest ones wait for
+  max_delay seconds. Return the stats of the put, or None if buffered.
+  '''
+  global buffer_start_time
+  with buffer_lock:
+    if not buffered_points:
+      buffer_start_time = time.time()
+    buffered_points.extend(points)
+    if len(buffered_points) < max_points and \
+        time.time() - buffer_start_time < max_delay:
+      return None
+  return flush_points()
+
+def flush_points():
+  '''
+  Put the points buffered, return the stats of the put, or None if there
+  are no points buffered.
+  '''
+  with buffer_lock:
+    points = buffered_points[:]
+    del buffered_points[:]
+  if not points:
+    return None
+  # never wait for the errors replied late, they're counted to the next put
+  return put_points(points, drain_wait=0)
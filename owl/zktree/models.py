@@ -1,7 +1,14 @@
+from collections import OrderedDict
 from datetime import datetime
+import logging
 import threading
+import time
 import zookeeper
 
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
 PERM_READ = 1
 PERM_WRITE = 2
 PERM_CREATE = 4
@@ -13,11 +20,32 @@ zookeeper.set_log_stream(open("cli_log.txt","w"))
 
 TIMEOUT = 10.0
 
+# errors after which a client is dropped from the pool and reconnected
+CONNECTION_ERRORS = (zookeeper.ConnectionLossException,
+                     zookeeper.SessionExpiredException,
+                     zookeeper.InvalidStateException)
+
 class ZKClient(object):
+    """
+    A long-lived zookeeper session which caches the znodes read with
+    watches. A cached znode is invalidated when its data or children
+    change, and the whole cache is cleared when the session expires. The
+    acls don't trigger watches, so entries also expire after
+    ZKTREE_CACHE_TIMEOUT seconds. A watch is only set again after it
+    fired, an expired entry is read again without a watch.
+    """
     def __init__(self, servers, timeout):
+        self.servers = servers
         self.connected = False
+        self.expired = False
         self.conn_cv = threading.Condition( )
         self.handle = -1
+        self.cache_lock = threading.Lock()
+        # path -> (cache time, znode info), in lru order
+        self.cache = OrderedDict()
+        # the paths with the data or children watches set and not fired
+        self.data_watches = set()
+        self.child_watches = set()
 
         self.conn_cv.acquire()
         self.handle = zookeeper.init(servers, self.connection_watcher, 30000)
@@ -25,15 +53,34 @@ class ZKClient(object):
         self.conn_cv.release()
 
         if not self.connected:
+            self.close()
             raise Exception("Unable to connect to %s" % (servers))
 
     def connection_watcher(self, h, type, state, path):
         self.handle = h
         self.conn_cv.acquire()
-        self.connected = True
+        self.connected = state == zookeeper.CONNECTED_STATE
+        if state == zookeeper.EXPIRED_SESSION_STATE:
+            logger.warning("Session to %s expired", self.servers)
+            self.expired = True
+            self.invalidate()
         self.conn_cv.notifyAll()
         self.conn_cv.release()
 
+    def node_watcher(self, h, type, state, path):
+        if type == zookeeper.SESSION_EVENT:
+            return
+        with self.cache_lock:
+            # a deleted znode fires both watches
+            if type != zookeeper.CHILD_EVENT:
+                self.data_watches.discard(path)
+            if type in (zookeeper.CHILD_EVENT, zookeeper.DELETED_EVENT):
+                self.child_watches.discard(path)
+            self.cache.pop(path, None)
+
+    def is_usable(self):
+        return not self.expired
+
     def close(self):
         zookeeper.close(self.handle)
 
@@ -46,31 +93,113 @@ class ZKClient(object):
     def get_acls(self, path):
         return zookeeper.get_acl(self.handle, path)
 
+    def invalidate(self, path=None):
+        with self.cache_lock:
+            if path is None:
+                # the watches are gone with the session
+                self.cache.clear()
+                self.data_watches.clear()
+                self.child_watches.clear()
+            else:
+                self.cache.pop(path, None)
+
+    def get_node(self, path):
+        """
+        Return the cached (data, stat, children, acls) of a znode, the
+        children are sorted.
+        """
+        now = time.time()
+        with self.cache_lock:
+            entry = self.cache.pop(path, None)
+            if entry and now - entry[0] < settings.ZKTREE_CACHE_TIMEOUT:
+                self.cache[path] = entry
+                return entry[1]
+            watch_data = path not in self.data_watches
+            watch_children = path not in self.child_watches
+            self.data_watches.add(path)
+            self.child_watches.add(path)
+
+        # the watches are set before reading, so a change after the read
+        # always invalidates the entry
+        try:
+            data, stat = self.get(path,
+                self.node_watcher if watch_data else None)
+            watch_data = False
+            children = sorted(self.get_children(path,
+                self.node_watcher if watch_children else None) or [])
+            watch_children = False
+            acls = self.get_acls(path)[1] or []
+        finally:
+            # the watches not set
+            with self.cache_lock:
+                if watch_data:
+                    self.data_watches.discard(path)
+                if watch_children:
+                    self.child_watches.discard(path)
+        node = (data, stat, children, acls)
+        with self.cache_lock:
+            # if a watch fired during the read, the node read may not be
+            # covered by a watch, so it isn't cached
+            if path in self.data_watches and path in self.child_watches:
+                self.cache[path] = (now, node)
+                while len(self.cache) > settings.ZKTREE_CACHE_SIZE:
+                    self.cache.popitem(last=False)
+        return node
+
+# ensemble address -> ZKClient
+clients = {}
+clients_lock = threading.Lock()
+
+def get_client(addrs):
+    with clients_lock:
+        zk = clients.get(addrs)
+        if zk is not None and zk.is_usable():
+            return zk
+        if zk is not None:
+            zk.close()
+        zk = ZKClient(addrs, TIMEOUT)
+        clients[addrs] = zk
+        return zk
+
+def drop_client(addrs, zk):
+    with clients_lock:
+        if clients.get(addrs) is zk:
+            del clients[addrs]
+            zk.close()
+
+def get_perm_list(perms):
+    perms_list = []
+    if perms & PERM_READ:
+        perms_list.append("PERM_READ")
+    if perms & PERM_WRITE:
+        perms_list.append("PERM_WRITE")
+    if perms & PERM_CREATE:
+        perms_list.append("PERM_CREATE")
+    if perms & PERM_DELETE:
+        perms_list.append("PERM_DELETE")
+    if perms & PERM_ADMIN:
+        perms_list.append("PERM_ADMIN")
+    if perms & PERM_ALL == PERM_ALL:
+        perms_list = ["PERM_ALL"]
+    return perms_list
+
 class ZNode(object):
     def __init__(self, addrs, path="/"):
         self.path = path
-        zk = ZKClient(addrs, TIMEOUT)
+        zk = get_client(addrs)
         try:
-            self.data, self.stat = zk.get(path)
-            self.stat['ctime'] = datetime.fromtimestamp(self.stat['ctime']/1000)
-            self.stat['mtime'] = datetime.fromtimestamp(self.stat['mtime']/1000)
-            self.children = zk.get_children(path) or []
-            self.acls = zk.get_acls(path)[1] or []
-            for acl in self.acls:
-                perms = acl['perms']
-                perms_list = []
-                if perms & PERM_READ:
-                    perms_list.append("PERM_READ")
-                if perms & PERM_WRITE:
-                    perms_list.append("PERM_WRITE")
-                if perms & PERM_CREATE:
-                    perms_list.append("PERM_CREATE")
-                if perms & PERM_DELETE:
-                    perms_list.append("PERM_DELETE")
-                if perms & PERM_ADMIN:
-                    perms_list.append("PERM_ADMIN")
-                if perms & PERM_ALL == PERM_ALL:
-                    perms_list = ["PERM_ALL"]
-                acl['perm_list'] = perms_list
-        finally:
-            zk.close()
+            data, stat, children, acls = zk.get_node(path)
+        except CONNECTION_ERRORS:
+            drop_client(addrs, zk)
+            raise
+        # the cached node is shared, copy what's changed for the page
+        self.data = data
+        self.stat = dict(stat)
+        self.stat['ctime'] = datetime.fromtimestamp(self.stat['ctime']/1000)
+        self.stat['mtime'] = datetime.fromtimestamp(self.stat['mtime']/1000)
+        self.children = children
+        self.acls = []
+        for acl in acls:
+            acl = dict(acl)
+            acl['perm_list'] = get_perm_list(acl['perms'])
+            self.acls.append(acl)
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the zktree app.
+"""
+
+import threading
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+import models
+
+class FakeZookeeper(object):
+    """
+    A stub of the module zookeeper, with the znodes in memory. The watches
+    are fired by fire().
+    """
+    CONNECTED_STATE = 3
+    EXPIRED_SESSION_STATE = -112
+    CREATED_EVENT = 1
+    DELETED_EVENT = 2
+    CHANGED_EVENT = 3
+    CHILD_EVENT = 4
+    SESSION_EVENT = -1
+
+    class ConnectionLossException(Exception):
+        pass
+
+    class NoNodeException(Exception):
+        pass
+
+    def __init__(self, nodes):
+        # path -> (data, children)
+        self.nodes = nodes
+        # [(kind, path, watcher), ...] of the watches set
+        self.watches = []
+        self.reads = 0
+        self.error = None
+        self.closed = []
+        self.connection_watcher = None
+
+    def init(self, servers, watcher, timeout):
+        self.connection_watcher = watcher
+        # connected in the thread of the client library
+        threading.Thread(target=watcher,
+            args=(1, self.SESSION_EVENT, self.CONNECTED_STATE, '')).start()
+        return 1
+
+    def close(self, handle):
+        self.closed.append(handle)
+
+    def read(self, kind, path, watcher):
+        if self.error is not None:
+            raise self.error
+        if path not in self.nodes:
+            raise self.NoNodeException(path)
+        self.reads += 1
+        if watcher is not None:
+            self.watches.append((kind, path, watcher))
+        return self.nodes[path]
+
+    def get(self, handle, path, watcher=None):
+        data, children = self.read('data', path, watcher)
+        return data, {'ctime': 0, 'mtime': 0, 'version': 0}
+
+    def get_children(self, handle, path, watcher=None):
+        return self.read('child', path, watcher)[1]
+
+    def get_acl(self, handle, path):
+        return {}, [{'perms': models.PERM_ALL, 'scheme': 'world', 'id': 'anyone'}]
+
+    def count_watches(self, kind, path):
+        return len([watch for watch in self.watches
+                    if watch[:2] == (kind, path)])
+
+    def fire(self, kind, type, path):
+        watches = [watch for watch in self.watches if watch[:2] == (kind, path)]
+        self.watches = [watch for watch in self.watches if watch not in watches]
+        for kind, path, watcher in watches:
+            watcher(1, type, self.CONNECTED_STATE, path)
+
+ADDRS = 'zk1:2181'
+
+@override_settings(ZKTREE_CACHE_SIZE=100, ZKTREE_CACHE_TIMEOUT=300,
+    ZKTREE_CHILDREN_PER_PAGE=2)
+class ZKClientTest(TestCase):
+    def setUp(self):
+        self.zookeeper = FakeZookeeper({
+            '/': ('', ['test']),
+            '/test': ('data', ['a', 'b', 'c', 'd', 'e']),
+        })
+        self.patch('zookeeper', self.zookeeper)
+        self.patch('CONNECTION_ERRORS',
+            (FakeZookeeper.ConnectionLossException,))
+        self.patch('clients', {})
+
+    def patch(self, name, value):
+        original = getattr(models, name)
+        setattr(models, name, value)
+        self.addCleanup(setattr, models, name, original)
+
+    def test_watch_invalidation(self):
+        zk = models.get_client(ADDRS)
+        zk.get_node('/test')
+        self.assertEqual(2, self.zookeeper.reads)
+        zk.get_node('/test')
+        self.assertEqual(2, self.zookeeper.reads)
+
+        # an expired entry is read again without setting the watches again
+        with self.settings(ZKTREE_CACHE_TIMEOUT=0):
+            zk.get_node('/test')
+        self.assertEqual(4, self.zookeeper.reads)
+        self.assertEqual(1, self.zookeeper.count_watches('data', '/test'))
+        self.assertEqual(1, self.zookeeper.count_watches('child', '/test'))
+
+        self.zookeeper.nodes['/test'] = ('changed', ['a'])
+        self.zookeeper.fire('data', FakeZookeeper.CHANGED_EVENT, '/test')
+        data, stat, children, acls = zk.get_node('/test')
+        self.assertEqual('changed', data)
+        # only the watch fired is set again
+        self.assertEqual(1, self.zookeeper.count_watches('data', '/test'))
+        self.assertEqual(1, self.zookeeper.count_watches('child', '/test'))
+
+        self.zookeeper.nodes['/test'] = ('changed', ['a', 'b'])
+        self.zookeeper.fire('child', FakeZookeeper.CHILD_EVENT, '/test')
+        self.assertEqual(['a', 'b'], zk.get_node('/test')[2])
+
+    def test_session_expired(self):
+        zk = models.get_client(ADDRS)
+        zk.get_node('/test')
+        zk.connection_watcher(1, FakeZookeeper.SESSION_EVENT,
+            FakeZookeeper.EXPIRED_SESSION_STATE, '')
+        self.assertFalse(zk.is_usable())
+        self.assertEqual(0, len(zk.cache))
+        self.assertEqual(set(), zk.data_watches)
+
+        new_zk = models.get_client(ADDRS)
+        self.assertIsNot(zk, new_zk)
+        self.assertEqual([zk.handle], self.zookeeper.closed)
+
+    def test_drop_client_on_connection_loss(self):
+        zk = models.get_client(ADDRS)
+        self.zookeeper.error = FakeZookeeper.ConnectionLossException()
+        self.assertRaises(FakeZookeeper.ConnectionLossException,
+            models.ZNode, ADDRS, '/test')
+        self.assertNotIn(ADDRS, models.clients)
+        self.assertEqual([zk.handle], self.zookeeper.closed)
+        # the watches of a failed read aren't recorded
+        self.assertEqual(set(), zk.data_watches)
+
+        self.zookeeper.error = None
+        self.assertEqual('data', models.ZNode(ADDRS, '/test').data)
+        self.assertIsNot(zk, models.clients[ADDRS])
+
+    def test_index_page_bounds(self):
+        def get_page(page):
+            response = self.client.get('/zktree/%s/test/' % ADDRS,
+                {'page': page})
+            self.assertEqual(200, response.status_code)
+            children = response.context['children']
+            return children.number, list(children.object_list)
+
+        self.assertEqual((1, ['a', 'b']), get_page('1'))
+        self.assertEqual((2, ['c', 'd']), get_page('2'))
+        # invalid pages are the first page, and pages past the end the last
+        self.assertEqual((1, ['a', 'b']), get_page('abc'))
+        self.assertEqual((3, ['e']), get_page('100'))
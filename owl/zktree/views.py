@@ -1,3 +1,5 @@
+from django.conf import settings
+from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.shortcuts import render_to_response
 from monitor.views import respond
 import os
@@ -16,7 +18,13 @@ def index(request, addrs, path=""):
     try:
         parent_path = os.path.dirname(path)
         znode = ZNode(addrs, path)
-        znode.children.sort()
+        paginator = Paginator(znode.children, settings.ZKTREE_CHILDREN_PER_PAGE)
+        try:
+            children = paginator.page(request.GET.get('page'))
+        except PageNotAnInteger:
+            children = paginator.page(1)
+        except EmptyPage:
+            children = paginator.page(paginator.num_pages)
         if not istext(znode.data):
             znode.data = "0x" + "".join(["%d" % (ord(d)) for d in znode.data])
             znode.datatype = "bin"
@@ -24,6 +32,7 @@ def index(request, addrs, path=""):
             znode.datatype = "str"
 
         params = {'znode':znode,
+                  'children':children,
                   'addrs':addrs,
                   'parent_path':parent_path}
         return respond(request, 'zktree/index.html', params)